@@ -3,90 +3,182 @@ Simple class to use the ABCD method for background estimation.
 Just set histograms for control regions A, B, C and let the class return D.
 Transfer factor is calculated from simulation in A and B, and then applied
 to the data histogram C in order to get a predcition for D.
+Contents and uncertainties are kept in numpy arrays (one entry per global
+bin), ROOT histograms are only created for the results. This works for TH1,
+TH2 and TH3. The under- and overflow bins are not used by default, with
+flow = "include" they are used like all other bins and with flow = "fold"
+they are added to the first/last bins (see common/histArrays.py).
+Instead of the linear error propagation the uncertainties can also be
+estimated with toys (getBackgroundPredictionToys), which also works for bins
+with few events in A.
+Variations added without a name are uncorrelated and added in quadrature
+to the uncertainty of their region. Variations with a name are correlated
+between A and B (e.g. "JES" in both regions can cancel in the TF), the TF is
+recalculated with all named variations at once and getUncertaintyBreakdown
+returns the uncertainty of the prediction for every name.
+The TF is cached until A, B or their uncertainties change, with
+getBackgroundPredictions it can be applied to many C histograms at once.
 """
 
-import ROOT
-from math import sqrt
+import ROOT,sys
+import numpy as np
+from MyRootTools.common.histArrays       import getContents, getErrors, getShape, makeHist, flowOptions
+
+################################################################################
+## Difference of central to up/down (average) as uncertainty
+def averageDifference(central, up, down):
+    return (np.abs(central-up)+np.abs(central-down))/2
+
+################################################################################
+## Error propagation for a ratio (c1+-e1)/(c2+-e2), bins with c2 = 0 get 0
+def ratioWithError(c1, e1, c2, e2):
+    nonzero = c2 != 0
+    c2 = np.where(nonzero, c2, 1.)
+    ratio = np.where(nonzero, c1/c2, 0.)
+    error = np.where(nonzero, np.sqrt(e1/c2 * e1/c2 + c1*e2/(c2*c2) * c1*e2/(c2*c2)), 0.)
+    return ratio, error
+
+################################################################################
+## Uncertainty of the TF B/A from correlated variations. Every row of upA,
+## downA, upB and downB is one variation (with the nominal values if it does
+## not change a region). The TF is calculated with the shifted inputs and the
+## average difference to the nominal TF is returned for every row.
+def correlatedShifts(valuesA, valuesB, upA, downA, upB, downB):
+    tf = ratioWithError(valuesB, 0., valuesA, 0.)[0]
+    tfUp = ratioWithError(upB, 0., upA, 0.)[0]
+    tfDown = ratioWithError(downB, 0., downA, 0.)[0]
+    return np.where(valuesA != 0, averageDifference(tf, tfUp, tfDown), 0.)
+
+################################################################################
+## Error propagation for a product (c1+-e1)*(c2+-e2)
+def productWithError(c1, e1, c2, e2):
+    error = np.sqrt(e1*e1*c2*c2 + e2*e2*c1*c1)
+    return c1*c2, error
+
 
 class BackgroundABCD:
-    def __init__(self):
-        self.__histA = ROOT.TH1F()
+    def __init__(self, flow="exclude"):
+        if flow not in flowOptions:
+            print "[Error]: Unknown flow option %s, use 'include', 'exclude' or 'fold'." %(flow)
+            sys.exit(1)
+        self.__flow = flow
+        self.__shape = None
+        self.__valuesA = None
+        self.__valuesB = None
         self.__histB = ROOT.TH1F()
         self.__histC = ROOT.TH1F()
         self.__histA_exists = False
         self.__histB_exists = False
         self.__histC_exists = False
-        self.__UncertaintiesA = ROOT.TH1F()
-        self.__UncertaintiesB = ROOT.TH1F()
+        self.__UncertaintiesA = None
+        self.__UncertaintiesB = None
+        self.__statA = None
+        self.__statB = None
+        self.__variationsA = []
+        self.__variationsB = []
+        self.__namedA = {}
+        self.__namedB = {}
+        self.__transferFactor = None                # cached TF, reset when A or B change
+        self.maxToyEntries = 10000000               # toys x bins in memory at once
+
+    ############################################################################
+    ## Make sure that all histograms have the same number of bins per axis
+    def __checkBinning(self, hist):
+        if self.__shape is None:
+            self.__shape = getShape(hist)
+        if getShape(hist) != self.__shape:
+            print "[Error]: Histogram %s does not have the same binning as the other regions." %(hist.GetName())
+            sys.exit(1)
 
     ############################################################################
     ## Get difference of central to up/down (average)
     def __calculateUncertainty(self, central, up, down):
-        Nbins = central.GetSize()-2
-        uncert = central.Clone()
-        uncert.Reset()
-        for i in range(Nbins):
-            bin = i+1
-            diff_up = abs(central.GetBinContent(bin)-up.GetBinContent(bin))
-            diff_down = abs(central.GetBinContent(bin)-down.GetBinContent(bin))
-            diff = (diff_up+diff_down)/2
-            uncert.SetBinContent(bin, diff)
-        return uncert
-
-    ############################################################################
-    ## Quadratically add two histograms that contain uncertainties as bin content
+        return averageDifference(central, getContents(up, self.__flow), getContents(down, self.__flow))
+
+    ############################################################################
+    ## Quadratically add two arrays of uncertainties
     def __addUncertainties(self, uncert1, uncert2):
-        Nbins = uncert1.GetSize()-2
-        uncert = uncert1.Clone()
-        uncert.Reset()
-        for i in range(Nbins):
-            bin = i+1
-            u1 = uncert1.GetBinContent(bin)
-            u2 = uncert2.GetBinContent(bin)
-            uncert.SetBinContent(bin, sqrt(u1*u1+u2*u2))
-        return uncert
+        return np.sqrt(uncert1*uncert1+uncert2*uncert2)
 
     ############################################################################
     ## Set histogram A, use BinError for uncertainty
     def setSampleRegionA(self, hist):
-        self.__histA = hist.Clone()
-        self.__UncertaintiesA = hist.Clone()
-        self.__UncertaintiesA.Reset()
-        Nbins = hist.GetSize()-2
-        for i in range(Nbins):
-            bin = i+1
-            self.__UncertaintiesA.SetBinContent(bin, hist.GetBinError(bin))
+        self.__checkBinning(hist)
+        self.__valuesA = getContents(hist, self.__flow)
+        self.__UncertaintiesA = getErrors(hist, self.__flow)
+        self.__statA = self.__UncertaintiesA
+        self.__variationsA = []
+        self.__namedA = {}
         self.__histA_exists = True
+        self.__transferFactor = None
 
     ############################################################################
     ## Set histogram B, use BinError for uncertainty
     def setSampleRegionB(self, hist):
+        self.__checkBinning(hist)
         self.__histB = hist.Clone()
-        self.__UncertaintiesB = hist.Clone()
-        self.__UncertaintiesB.Reset()
-        Nbins = hist.GetSize()-2
-        for i in range(Nbins):
-            bin = i+1
-            self.__UncertaintiesB.SetBinContent(bin, hist.GetBinError(bin))
+        self.__valuesB = getContents(hist, self.__flow)
+        self.__UncertaintiesB = getErrors(hist, self.__flow)
+        self.__statB = self.__UncertaintiesB
+        self.__variationsB = []
+        self.__namedB = {}
         self.__histB_exists = True
+        self.__transferFactor = None
 
     ############################################################################
-    ## Add up/down variations to histogram A
-    def addUncertaintyRegionA(self, up, down):
+    ## Add up/down variations to histogram A, variations with the same name
+    ## in A and B are correlated
+    def addUncertaintyRegionA(self, up, down, name=None):
         if not self.__histA_exists:
             print "[Error]: Histogram A is not set but needed to add uncertainties."
             sys.exit(1)
-        diff = self.__calculateUncertainty(self, self.__histA, up, down)
+        self.__checkBinning(up)
+        self.__checkBinning(down)
+        self.__transferFactor = None
+        if name is not None:
+            self.__addNamedVariation(self.__namedA, name, up, down)
+            return
+        diff = self.__calculateUncertainty(self.__valuesA, up, down)
         self.__UncertaintiesA = self.__addUncertainties(self.__UncertaintiesA, diff)
+        self.__variationsA.append( (getContents(up, self.__flow), getContents(down, self.__flow)) )
 
     ############################################################################
-    ## Add up/down variations to histogram B
-    def addUncertaintyRegionB(self, up, down):
+    ## Add up/down variations to histogram B, variations with the same name
+    ## in A and B are correlated
+    def addUncertaintyRegionB(self, up, down, name=None):
         if not self.__histB_exists:
             print "[Error]: Histogram B is not set but needed to add uncertainties."
             sys.exit(1)
-        diff = self.__calculateUncertainty(self, self.__histB, up, down)
+        self.__checkBinning(up)
+        self.__checkBinning(down)
+        self.__transferFactor = None
+        if name is not None:
+            self.__addNamedVariation(self.__namedB, name, up, down)
+            return
+        diff = self.__calculateUncertainty(self.__valuesB, up, down)
         self.__UncertaintiesB = self.__addUncertainties(self.__UncertaintiesB, diff)
+        self.__variationsB.append( (getContents(up, self.__flow), getContents(down, self.__flow)) )
+
+    ############################################################################
+    ## Store a named variation of one region
+    def __addNamedVariation(self, named, name, up, down):
+        if name in named:
+            print "[Error]: Variation %s is already added to this region." %(name)
+            sys.exit(1)
+        named[name] = (getContents(up, self.__flow), getContents(down, self.__flow))
+
+    ############################################################################
+    ## Names of all correlated variations
+    def __getVariationNames(self):
+        return sorted(set(self.__namedA.keys()) | set(self.__namedB.keys()))
+
+    ############################################################################
+    ## Up and down values of a region for all named variations as arrays
+    ## (Nvariations, Nbins), nominal values if a region has no variation
+    def __stackVariations(self, names, nominal, named):
+        up = np.array([named[name][0] if name in named else nominal for name in names]).reshape(len(names), len(nominal))
+        down = np.array([named[name][1] if name in named else nominal for name in names]).reshape(len(names), len(nominal))
+        return up, down
 
     ############################################################################
     ## Set the sample for region C (this should be data)
@@ -100,43 +192,39 @@ class BackgroundABCD:
         self.__histC.Add(hist, -1)
 
     ############################################################################
-    ## Error propagation for a ratio (c1+-e1)/(c2+-e2)
-    def __doErrorProgagationRatio(self, c1, e1, c2, e2):
-        error = 0.
-        ratio = 0.
-        if c2 != 0:
-            ratio = c1/c2
-            error = sqrt(e1/c2 * e1/c2 + c1*e2/(c2*c2) * c1*e2/(c2*c2))
-        return ratio, error
-
-    ############################################################################
-    ## Error propagation for a product (c1+-e1)*(c2+-e2)
-    def __doErrorProgagationProduct(self, c1, e1, c2, e2):
-        error = sqrt(e1*e1*c2*c2 + e2*e2*c1*c1)
-        return c1*c2, error
-
-    ############################################################################
-    ## Get TF from histograms A and B
-    def getTransferFactor(self):
+    ## TF with the uncertainty from statistics and uncorrelated variations
+    ## and the shifts of the TF from all named variations. The result is
+    ## cached until A, B or their uncertainties change.
+    def __calculateTransferFactorParts(self):
         if not self.__histA_exists:
             print "[Error]: Histogram A is not set but needed for TF."
             sys.exit(1)
         if not self.__histB_exists:
             print "[Error]: Histogram B is not set but needed for TF."
             sys.exit(1)
-        tf = self.__histB.Clone()
-        tf.Reset()
-        Nbins = tf.GetSize()-2
-        for i in range(Nbins):
-            bin = i+1
-            c1 = self.__histB.GetBinContent(bin)
-            e1 = self.__UncertaintiesB.GetBinContent(bin)
-            c2 = self.__histA.GetBinContent(bin)
-            e2 = self.__UncertaintiesA.GetBinContent(bin)
-            ratio, error = self.__doErrorProgagationRatio(c1, e1, c2, e2)
-            tf.SetBinContent(bin, ratio)
-            tf.SetBinError(bin, error)
-        return tf
+        if self.__transferFactor is None:
+            self.__transferFactor = self.__computeTransferFactorParts()
+        return self.__transferFactor
+
+    def __computeTransferFactorParts(self):
+        ratio, error = ratioWithError(self.__valuesB, self.__UncertaintiesB, self.__valuesA, self.__UncertaintiesA)
+        names = self.__getVariationNames()
+        upA, downA = self.__stackVariations(names, self.__valuesA, self.__namedA)
+        upB, downB = self.__stackVariations(names, self.__valuesB, self.__namedB)
+        shifts = correlatedShifts(self.__valuesA, self.__valuesB, upA, downA, upB, downB)
+        return ratio, error, names, shifts
+
+    ############################################################################
+    ## TF and its total uncertainty as arrays
+    def __calculateTransferFactor(self):
+        ratio, error, names, shifts = self.__calculateTransferFactorParts()
+        return ratio, np.sqrt(error*error+np.sum(shifts*shifts, axis=0))
+
+    ############################################################################
+    ## Get TF from histograms A and B
+    def getTransferFactor(self):
+        ratio, error = self.__calculateTransferFactor()
+        return makeHist(self.__histB, ratio, error)
 
     ############################################################################
     ## Multiply TF with data driven background from region C
@@ -147,24 +235,149 @@ class BackgroundABCD:
             sys.exit(1)
 
         # Calculate TF from hists A and B
-        tf = self.getTransferFactor()
+        c1, e1 = self.__calculateTransferFactor()
+        self.__checkBinning(self.__histC)
 
         # Multiply histogram C with TF
-        prediction = self.__histC.Clone()
-        prediction_up = self.__histC.Clone()
-        prediction_down = self.__histC.Clone()
-        prediction.Reset()
-        prediction_up.Reset()
-        prediction_down.Reset()
-        Nbins = tf.GetSize()-2
-        for i in range(Nbins):
-            bin = i+1
-            c1 = tf.GetBinContent(bin)
-            e1 = tf.GetBinError(bin)
-            c2 = self.__histC.GetBinContent(bin)
-            e2 = self.__histC.GetBinError(bin)
-            product, error = self.__doErrorProgagationProduct(c1, e1, c2, e2)
-            prediction.SetBinContent(bin,product)
-            prediction_up.SetBinContent(bin,product+error)
-            prediction_down.SetBinContent(bin,product-error)
+        c2 = getContents(self.__histC, self.__flow)
+        e2 = getErrors(self.__histC, self.__flow)
+        product, error = productWithError(c1, e1, c2, e2)
+        prediction = makeHist(self.__histC, product)
+        prediction_up = makeHist(self.__histC, product+error)
+        prediction_down = makeHist(self.__histC, product-error)
         return prediction, prediction_up, prediction_down
+
+    ############################################################################
+    ## Apply the (cached) TF to a list of histograms for region C (e.g. data
+    ## eras or different background subtractions), the inputs are not cloned
+    ## or changed. Returns a list with (prediction, up, down) for every
+    ## histogram as getBackgroundPrediction. With bands=False only the
+    ## prediction is returned for every histogram, with the uncertainty as
+    ## bin error.
+    def getBackgroundPredictions(self, histsC, bands=True):
+        c1, e1 = self.__calculateTransferFactor()
+        predictions = []
+        for hist in histsC:
+            self.__checkBinning(hist)
+            c2 = getContents(hist, self.__flow)
+            e2 = getErrors(hist, self.__flow)
+            product, error = productWithError(c1, e1, c2, e2)
+            if bands:
+                predictions.append( (makeHist(hist, product), makeHist(hist, product+error), makeHist(hist, product-error)) )
+            else:
+                predictions.append(makeHist(hist, product, error))
+        return predictions
+
+    ############################################################################
+    ## Uncertainty of the prediction for every source as histograms with the
+    ## absolute uncertainty as bin content: "A:stat", "B:stat", "C:stat" for
+    ## the statistics of every region (as in BackgroundABCDBatch), every named
+    ## variation and "uncorrelated" for the variations without a name (only
+    ## if there are any). Added in quadrature they give the uncertainty of
+    ## getBackgroundPrediction.
+    def getUncertaintyBreakdown(self):
+        if not self.__histC_exists:
+            print "[Error]: Histogram C is not set but needed for prediction."
+            sys.exit(1)
+        self.__checkBinning(self.__histC)
+        tf, error, names, shifts = self.__calculateTransferFactorParts()
+        c2 = getContents(self.__histC, self.__flow)
+        e2 = getErrors(self.__histC, self.__flow)
+        # d(B/A)/dA = -B/A^2, d(B/A)/dB = 1/A, bins with A = 0 have no TF
+        nonzero = self.__valuesA != 0
+        A = np.where(nonzero, self.__valuesA, 1.)
+        dA = np.where(nonzero, np.abs(self.__valuesB/(A*A)), 0.)
+        dB = np.where(nonzero, 1./np.abs(A), 0.)
+        breakdown = {}
+        breakdown["A:stat"] = makeHist(self.__histC, self.__statA*dA*np.abs(c2))
+        breakdown["B:stat"] = makeHist(self.__histC, self.__statB*dB*np.abs(c2))
+        breakdown["C:stat"] = makeHist(self.__histC, e2*np.abs(tf))
+        if len(self.__variationsA)+len(self.__variationsB) > 0:
+            variationsA = sum([averageDifference(self.__valuesA, up, down)**2 for (up, down) in self.__variationsA], np.zeros(len(A)))
+            variationsB = sum([averageDifference(self.__valuesB, up, down)**2 for (up, down) in self.__variationsB], np.zeros(len(A)))
+            breakdown["uncorrelated"] = makeHist(self.__histC, np.sqrt(variationsA*dA*dA+variationsB*dB*dB)*np.abs(c2))
+        for (name, shift) in zip(names, shifts):
+            breakdown[name] = makeHist(self.__histC, shift*np.abs(c2))
+        return breakdown
+
+    ############################################################################
+    ## Draw toys of the bin contents. With statModel = "poisson" the contents
+    ## are scaled Poisson numbers with (content/error)^2 effective events, so
+    ## weighted MC and data both get the right mean and variance. Bins
+    ## without content or error and statModel = "gauss" use a Gaussian.
+    ## Every bin has its own random stream seeded by (seed, region, bin), so
+    ## the toys do not depend on how the bins are split into blocks.
+    def __drawStat(self, seed, region, bins, contents, errors, Ntoys, statModel):
+        toys = np.empty((Ntoys, len(bins)))
+        usePoisson = (contents > 0) & (errors > 0) & (statModel == "poisson")
+        for (i, bin) in enumerate(bins):
+            random = np.random.RandomState([seed, region, bin])
+            if usePoisson[i]:
+                scale = errors[i]*errors[i]/contents[i]
+                toys[:,i] = scale*random.poisson(contents[i]/scale, Ntoys)
+            else:
+                toys[:,i] = contents[i]+errors[i]*random.standard_normal(Ntoys)
+        return toys
+
+    ############################################################################
+    ## Shift of the contents for nuisance values theta (one per toy), linear
+    ## interpolation to up for theta > 0 and to down for theta < 0
+    def __shiftVariations(self, theta, central, variations):
+        shift = np.zeros((len(theta), len(central)))
+        for (i, (up, down)) in enumerate(variations):
+            t = theta[:,i,None]
+            shift += np.where(t > 0, t*(up-central), t*(central-down))
+        return shift
+
+    ############################################################################
+    ## Prediction with uncertainties from toys of A, B, C and of every up/down
+    ## variation (one Gaussian nuisance per variation, shared by A and B for
+    ## named variations).
+    ## Returns the prediction and the quantiles of the toy predictions as
+    ## up/down (default: 68% band). Toys with A <= 0 in a bin are not used
+    ## for that bin. The same seed always gives the same result (also for a
+    ## different maxToyEntries).
+    def getBackgroundPredictionToys(self, Ntoys=100000, seed=1, quantiles=(0.158655, 0.841345), statModel="poisson"):
+        if not self.__histC_exists:
+            print "[Error]: Histogram C is not set but needed for prediction."
+            sys.exit(1)
+        if statModel not in ["poisson", "gauss"]:
+            print "[Error]: Unknown statModel %s, use 'poisson' or 'gauss'." %(statModel)
+            sys.exit(1)
+        self.__checkBinning(self.__histC)
+        tf, errTF = self.__calculateTransferFactor()
+        valuesC = getContents(self.__histC, self.__flow)
+        statC = getErrors(self.__histC, self.__flow)
+        prediction = tf*valuesC
+
+        random = np.random.RandomState(seed)
+        thetaA = random.standard_normal((Ntoys, len(self.__variationsA)))
+        thetaB = random.standard_normal((Ntoys, len(self.__variationsB)))
+        # named variations share one nuisance in A and B
+        names = self.__getVariationNames()
+        thetaNamed = random.standard_normal((Ntoys, len(names)))
+        variationsA = self.__variationsA+[self.__namedA[name] for name in names if name in self.__namedA]
+        variationsB = self.__variationsB+[self.__namedB[name] for name in names if name in self.__namedB]
+        thetaA = np.hstack((thetaA, thetaNamed[:,[i for (i, name) in enumerate(names) if name in self.__namedA]]))
+        thetaB = np.hstack((thetaB, thetaNamed[:,[i for (i, name) in enumerate(names) if name in self.__namedB]]))
+        low = np.zeros(len(prediction))
+        high = np.zeros(len(prediction))
+        # only bins with a transfer factor, in blocks that fit into memory
+        active = np.nonzero(self.__valuesA != 0)[0]
+        blocksize = max(1, self.maxToyEntries//Ntoys)
+        for start in range(0, len(active), blocksize):
+            bins = active[start:start+blocksize]
+            toysA = self.__drawStat(seed, 0, bins, self.__valuesA[bins], self.__statA[bins], Ntoys, statModel)
+            toysA += self.__shiftVariations(thetaA, self.__valuesA[bins], [(up[bins], down[bins]) for (up, down) in variationsA])
+            toysB = self.__drawStat(seed, 1, bins, self.__valuesB[bins], self.__statB[bins], Ntoys, statModel)
+            toysB += self.__shiftVariations(thetaB, self.__valuesB[bins], [(up[bins], down[bins]) for (up, down) in variationsB])
+            toysC = self.__drawStat(seed, 2, bins, valuesC[bins], statC[bins], Ntoys, statModel)
+            toys = np.where(toysA > 0, toysB/np.where(toysA > 0, toysA, 1.)*toysC, np.nan)
+            if np.isnan(toys).any():
+                band = np.nanpercentile(toys, [100.*quantiles[0], 100.*quantiles[1]], axis=0)
+            else:
+                band = np.percentile(toys, [100.*quantiles[0], 100.*quantiles[1]], axis=0)
+            low[bins] = band[0]
+            high[bins] = band[1]
+
+        return makeHist(self.__histC, prediction), makeHist(self.__histC, high), makeHist(self.__histC, low)
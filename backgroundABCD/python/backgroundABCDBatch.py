@@ -0,0 +1,176 @@
+"""
+ABCD method for many distributions at once.
+Every distribution (e.g. one observable) has its own histograms for the
+regions A, B and C, backgrounds that are subtracted from C and named up/down
+variations for A, B and C. The bins of all distributions are put into one
+flat array, so all transfer factors, predictions and uncertainties are
+computed in one pass with the same formulas as in BackgroundABCD.
+
+The inputs are given as a dictionary:
+    inputs = {
+        "mT": {"A": histA, "B": histB, "C": histC,
+               "backgroundsC": [hist1, hist2],
+               "variationsA": {"JES": (up, down)},
+               "variationsB": {"JES": (up, down)},
+               "variationsC": {"bkgnorm": (up, down)}},
+        "pt": {...},
+    }
+Only A, B and C are required. Variations of C are variations of histC, the
+backgroundsC are subtracted from them like from histC. Variations with the same name are correlated
+(like named variations in BackgroundABCD), for every name the prediction is
+recalculated with all regions shifted at once. The uncertainty sources in
+the breakdown are the variation names and "<region>:stat" for the
+statistical uncertainties. Histograms can have any dimension, the flow
+option is the same as for BackgroundABCD.
+"""
+
+from __future__ import print_function
+import ROOT,sys
+import numpy as np
+from MyRootTools.common.histArrays       import getContents, getErrors, getShape, makeHist, flowOptions
+from MyRootTools.backgroundABCD.backgroundABCD import averageDifference, ratioWithError, correlatedShifts
+
+class BackgroundABCDBatch:
+    def __init__(self, inputs=None, flow="exclude"):
+        if flow not in flowOptions:
+            print("[Error]: Unknown flow option %s, use 'include', 'exclude' or 'fold'." %(flow))
+            sys.exit(1)
+        self.__flow = flow
+        self.__names = []
+        self.__inputs = {}
+        if inputs is not None:
+            for name in sorted(inputs.keys()):
+                self.addDistribution(name, **inputs[name])
+
+    ############################################################################
+    ## Add one distribution, the histograms are not cloned
+    def addDistribution(self, name, A, B, C, backgroundsC=[], variationsA={}, variationsB={}, variationsC={}):
+        if name in self.__inputs:
+            print("[Error]: Distribution %s is already added." %(name))
+            sys.exit(1)
+        shape = getShape(A)
+        for variations in [variationsA, variationsB, variationsC]:
+            if len([variation for variation in variations if variation.endswith(":stat")]) > 0:
+                print("[Error]: Names ending with :stat are used for the statistical uncertainties.")
+                sys.exit(1)
+        for hist in [B, C]+list(backgroundsC)+[h for variations in [variationsA, variationsB, variationsC] for pair in variations.values() for h in pair]:
+            if getShape(hist) != shape:
+                print("[Error]: Histogram %s of distribution %s does not have the same binning as A." %(hist.GetName(), name))
+                sys.exit(1)
+        self.__names.append(name)
+        self.__inputs[name] = {
+            "A": A, "B": B, "C": C, "backgroundsC": list(backgroundsC),
+            "variations": {"A": dict(variationsA), "B": dict(variationsB), "C": dict(variationsC)},
+        }
+
+    ############################################################################
+    ## Names of all variations, variations with the same name are correlated
+    ## between the regions and distributions
+    def __getVariationNames(self):
+        names = set()
+        for name in self.__names:
+            for region in ["A", "B", "C"]:
+                names.update(self.__inputs[name]["variations"][region].keys())
+        return sorted(names)
+
+    ############################################################################
+    ## Read all inputs into flat arrays (all distributions after each other):
+    ## contents and statistical uncertainties of every region and the up/down
+    ## values of every variation as arrays (Nvariations, Nbins), with the
+    ## nominal values where a variation does not change a region
+    def __readInputs(self, variations):
+        values = {"A": [], "B": [], "C": []}
+        stat = {"A": [], "B": [], "C": []}
+        shifted = dict([(region, ([np.zeros((len(variations), 0))], [np.zeros((len(variations), 0))])) for region in ["A", "B", "C"]])
+        for name in self.__names:
+            inputs = self.__inputs[name]
+            contents = dict([(region, getContents(inputs[region], self.__flow)) for region in ["A", "B", "C"]])
+            errors = dict([(region, getErrors(inputs[region], self.__flow)) for region in ["A", "B", "C"]])
+            # backgrounds in C are subtracted, their errors are added in quadrature
+            subtracted = dict([(region, 0.) for region in ["A", "B", "C"]])
+            errorC2 = errors["C"]*errors["C"]
+            for hist in inputs["backgroundsC"]:
+                subtracted["C"] = subtracted["C"]+getContents(hist, self.__flow)
+                errorBkg = getErrors(hist, self.__flow)
+                errorC2 = errorC2+errorBkg*errorBkg
+            contents["C"] = contents["C"]-subtracted["C"]
+            errors["C"] = np.sqrt(errorC2)
+            for region in ["A", "B", "C"]:
+                values[region].append(contents[region])
+                stat[region].append(errors[region])
+                up = np.tile(contents[region], (len(variations), 1))
+                down = np.tile(contents[region], (len(variations), 1))
+                for (variation, (hup, hdown)) in inputs["variations"][region].items():
+                    # variations of C are given before the background subtraction
+                    up[variations.index(variation)] = getContents(hup, self.__flow)-subtracted[region]
+                    down[variations.index(variation)] = getContents(hdown, self.__flow)-subtracted[region]
+                shifted[region][0].append(up)
+                shifted[region][1].append(down)
+        for region in ["A", "B", "C"]:
+            values[region] = np.concatenate([np.zeros(0)]+values[region])
+            stat[region] = np.concatenate([np.zeros(0)]+stat[region])
+            shifted[region] = (np.concatenate(shifted[region][0], axis=1), np.concatenate(shifted[region][1], axis=1))
+        return values, stat, shifted
+
+    ############################################################################
+    ## Split a flat array into the distributions and make histograms
+    def __makeHists(self, values, region, errors=None):
+        hists = {}
+        start = 0
+        for name in self.__names:
+            template = self.__inputs[name][region]
+            stop = start+template.GetSize()
+            hists[name] = makeHist(template, values[start:stop], None if errors is None else errors[start:stop])
+            start = stop
+        return hists
+
+    ############################################################################
+    ## Transfer factors of all distributions as dictionary of histograms
+    def getTransferFactors(self):
+        variations = self.__getVariationNames()
+        values, stat, shifted = self.__readInputs(variations)
+        tf, errTF = ratioWithError(values["B"], stat["B"], values["A"], stat["A"])
+        shifts = correlatedShifts(values["A"], values["B"], shifted["A"][0], shifted["A"][1], shifted["B"][0], shifted["B"][1])
+        return self.__makeHists(tf, "B", np.sqrt(errTF*errTF+np.sum(shifts*shifts, axis=0)))
+
+    ############################################################################
+    ## Predictions for D of all distributions.
+    ## Returns predictions[name] = (prediction, up, down) as in
+    ## BackgroundABCD.getBackgroundPrediction and the breakdown of the
+    ## uncertainty breakdown[source][name] with the absolute uncertainty on
+    ## the prediction from every source as bin content.
+    def getBackgroundPredictions(self):
+        variations = self.__getVariationNames()
+        values, stat, shifted = self.__readInputs(variations)
+        tf = ratioWithError(values["B"], 0., values["A"], 0.)[0]
+        prediction = tf*values["C"]
+
+        # statistical uncertainties with linear error propagation
+        # d(B/A*C)/dA = -B*C/A^2, d(B/A*C)/dB = C/A, d(B/A*C)/dC = B/A
+        A = np.where(values["A"] != 0, values["A"], 1.)
+        coefficients = {
+            "A": np.where(values["A"] != 0, values["B"]*values["C"]/(A*A), 0.),
+            "B": np.where(values["A"] != 0, values["C"]/A, 0.),
+            "C": tf,
+        }
+        contributions = {}
+        for region in ["A", "B", "C"]:
+            contributions[region+":stat"] = stat[region]*np.abs(coefficients[region])
+
+        # variations: recalculate B/A*C with all regions shifted at once
+        predictionUp = ratioWithError(shifted["B"][0], 0., shifted["A"][0], 0.)[0]*shifted["C"][0]
+        predictionDown = ratioWithError(shifted["B"][1], 0., shifted["A"][1], 0.)[0]*shifted["C"][1]
+        shifts = np.where(values["A"] != 0, averageDifference(prediction, predictionUp, predictionDown), 0.)
+        for (variation, shift) in zip(variations, shifts):
+            contributions[variation] = shift
+
+        error = np.sqrt(np.sum([c*c for c in contributions.values()], axis=0))
+        up = self.__makeHists(prediction+error, "C")
+        down = self.__makeHists(prediction-error, "C")
+        predictions = {}
+        for (name, hist) in self.__makeHists(prediction, "C").items():
+            predictions[name] = (hist, up[name], down[name])
+        breakdown = {}
+        for (source, contribution) in contributions.items():
+            breakdown[source] = self.__makeHists(contribution, "C")
+        return predictions, breakdown
@@ -1,16 +1,74 @@
-import ROOT
-from math import sqrt
+import ROOT,sys
+import numpy as np
+import multiprocessing
+from MyRootTools.common.histArrays       import getContents, getErrors, getBinCenters, getBinEdges, flowMask, getShape, makeHist, makeHistFromArrays, setContents, flowOptions
+from MyRootTools.common.formulaArrays    import compileFormula
+from MyRootTools.common.diskCache        import DiskCache, hashKey
 
+
+################################################################################
+## Fit one formula to the alpha histogram given as plain data (this runs in
+## the worker processes). Returns the fit result as plain data:
+## parameters, their errors, covariance matrix, chi2 and ndf.
+def _fitFormula(job):
+    (index, name, formula, fitrange, hist) = job
+    # own name and not in gDirectory, so a histogram of the user with the
+    # same name is not replaced when fitting in this process
+    alpha = makeHistFromArrays("%s_%s" %(hist["name"], name), hist["edges"], hist["contents"], hist["errors"])
+    alpha.SetDirectory(0)
+    functionclass = [ROOT.TF1, ROOT.TF2, ROOT.TF3][len(hist["edges"])-1]
+    fit = functionclass(name, formula, *fitrange)
+    result = alpha.Fit(fit, "RS")
+    Npar = fit.GetNpar()
+    covariance = [[0.]*Npar for i in range(Npar)]
+    if result.Get():
+        covariance = [[result.CovMatrix(i, j) for j in range(Npar)] for i in range(Npar)]
+    return index, {
+        "formula":    formula,
+        "status":     int(result),
+        "parameters": [fit.GetParameter(i) for i in range(Npar)],
+        "errors":     [fit.GetParError(i) for i in range(Npar)],
+        "covariance": covariance,
+        "chi2":       fit.GetChisquare(),
+        "ndf":        fit.GetNDF(),
+        "chi2ndf":    fit.GetChisquare()/fit.GetNDF() if fit.GetNDF() > 0 else float("nan"),
+    }
+
+# Works for TH1, TH2 and TH3 (fit formulas are then TF2/TF3 formulas).
+# flow = "exclude": under- and overflow bins are not used (set to 0),
+# "include": they are predicted like all other bins, "fold": they are added
+# to the first/last bins (see common/histArrays.py)
+# The fits of the formulas run in parallel in a process pool (at most one
+# process per formula and CPU, setNumberOfProcesses(1) fits in this process).
+# The fit functions are evaluated at all bin centers at once with numpy (see
+# common/formulaArrays.py), formulas that can not be translated use TF1.Eval.
+# With setFitCache the fit results are stored on disk, keyed by the contents
+# and errors of the alpha histogram, the binning, formula and fit range, so
+# rerunning the same fits skips the fitting.
+# With setParameterSampling the parameters of the central fit are sampled
+# from its covariance matrix and the spread of alpha is added to the errors
+# of the prediction (uncertainty of the central fit itself).
 class backgroundAlpha:
-    def __init__(self):
+    def __init__(self, flow="exclude"):
+        if flow not in flowOptions:
+            print "[Error]: Unknown flow option %s, use 'include', 'exclude' or 'fold'." %(flow)
+            sys.exit(1)
+        self.__flow = flow
         self.__data_CR = ROOT.TH1F()
         self.__MC_CR = ROOT.TH1F()
         self.__MC_SR = ROOT.TH1F()
         self.__alpha_hist = ROOT.TH1F()
         self.__xmin = 0
         self.__xmax = 100000
+        self.__yrange = None
+        self.__zrange = None
         self.__fitfunctions = []
         self.__fitformulas = []
+        self.__fitresults = []
+        self.__nprocesses = None
+        self.__fitcache = None
+        self.__Nsamples = 0
+        self.__seed = 1
 
     def setDataCR(self, hist):
         self.__data_CR = hist.Clone()
@@ -27,9 +85,12 @@ class backgroundAlpha:
     def setFitFormula(self, formula):
         self.__fitformulas.append(formula)
 
-    def setFitRange(self, xmin, xmax):
+    # y and z ranges are only used for TH2/TH3, default is the full axis
+    def setFitRange(self, xmin, xmax, ymin=None, ymax=None, zmin=None, zmax=None):
         self.__xmin = xmin
         self.__xmax = xmax
+        self.__yrange = None if ymin is None else (ymin, ymax)
+        self.__zrange = None if zmin is None else (zmin, zmax)
 
     def getAlphaHist(self):
         return self.__alpha_hist
@@ -37,60 +98,166 @@ class backgroundAlpha:
     def getAlphaFunctions(self):
         return self.__fitfunctions
 
+    # Results of the last fits as plain data, same order as the formulas
+    def getFitResults(self):
+        return self.__fitresults
+
+    # Number of processes for the fits, None: number of CPUs
+    def setNumberOfProcesses(self, nprocesses):
+        self.__nprocesses = nprocesses
+
+    # Store fit results in directory, the least recently used results are
+    # removed when the cache is larger than maxMB. None disables the cache.
+    def setFitCache(self, directory, maxMB=100):
+        self.__fitcache = None if directory is None else DiskCache(directory, int(maxMB*1024*1024))
+
     ############################################################################
-    ## Error propagation for a ratio (c1+-e1)/(c2+-e2)
+    ## Error propagation for a ratio (c1+-e1)/(c2+-e2) of arrays,
+    ## bins with c2 = 0 get 0
     def __doErrorProgagationRatio(self, c1, e1, c2, e2):
-        error = 0.
-        ratio = 0.
-        if c2 != 0:
-            ratio = c1/c2
-            error = sqrt(e1/c2 * e1/c2 + c1*e2/(c2*c2) * c1*e2/(c2*c2))
+        nonzero = c2 != 0
+        c2 = np.where(nonzero, c2, 1.)
+        ratio = np.where(nonzero, c1/c2, 0.)
+        error = np.where(nonzero, np.sqrt(e1/c2 * e1/c2 + c1*e2/(c2*c2) * c1*e2/(c2*c2)), 0.)
         return ratio, error
 
     def __calculateAlphaHist(self):
-        Nbins = self.__data_CR.GetSize()-2
-        self.__alpha_hist = self.__MC_CR.Clone()
-        self.__alpha_hist.Reset()
-        for i in range(Nbins):
-            bin = i+1
-            c1 = self.__MC_CR.GetBinContent(bin)
-            e1 = self.__MC_CR.GetBinError(bin)
-            c2 = self.__MC_SR.GetBinContent(bin)
-            e2 = self.__MC_SR.GetBinError(bin)
-            ratio, error = self.__doErrorProgagationRatio(c1, e1, c2, e2)
-            self.__alpha_hist.SetBinContent(bin, ratio)
-            self.__alpha_hist.SetBinError(bin, error)
+        if getShape(self.__MC_CR) != getShape(self.__MC_SR) or getShape(self.__MC_CR) != getShape(self.__data_CR):
+            print "[Error]: Histograms of data CR, MC CR and MC SR need the same binning."
+            sys.exit(1)
+        c1 = getContents(self.__MC_CR, self.__flow)
+        e1 = getErrors(self.__MC_CR, self.__flow)
+        c2 = getContents(self.__MC_SR, self.__flow)
+        e2 = getErrors(self.__MC_SR, self.__flow)
+        ratio, error = self.__doErrorProgagationRatio(c1, e1, c2, e2)
+        self.__alpha_hist = makeHist(self.__MC_CR, ratio, error)
+
+    # Fit range of all axes as arguments for TF1/TF2/TF3
+    def __getFitRange(self):
+        fitrange = [self.__xmin, self.__xmax]
+        axes = [(self.__alpha_hist.GetYaxis(), self.__yrange), (self.__alpha_hist.GetZaxis(), self.__zrange)]
+        for (axis, axisrange) in axes[:self.__alpha_hist.GetDimension()-1]:
+            fitrange += list(axisrange) if axisrange is not None else [axis.GetXmin(), axis.GetXmax()]
+        return fitrange
 
+    # The alpha histogram and the formulas are sent to the workers as plain
+    # data, the results come back as soon as a fit is done
     def __doAlphaFit(self):
-        counter=1
-        for formula in self.__fitformulas:
-            fit = ROOT.TF1("fit"+str(counter), formula, self.__xmin, self.__xmax)
-            self.__alpha_hist.Fit("fit"+str(counter),"R")
+        # only the functions of the last fits are kept
+        self.__fitfunctions = []
+        hist = {
+            "name":     self.__alpha_hist.GetName(),
+            "edges":    getBinEdges(self.__alpha_hist),
+            "contents": getContents(self.__alpha_hist),
+            "errors":   getErrors(self.__alpha_hist),
+        }
+        fitrange = self.__getFitRange()
+        results = [None]*len(self.__fitformulas)
+        keys = [None]*len(self.__fitformulas)
+        jobs = []
+        for (i, formula) in enumerate(self.__fitformulas):
+            if self.__fitcache is not None:
+                keys[i] = hashKey("alphafit", hist["edges"], hist["contents"], hist["errors"], formula, [float(x) for x in fitrange])
+                results[i] = self.__fitcache.get(keys[i])
+                if results[i] is not None:
+                    print formula, "has a chi2 of", results[i]["chi2"], "(cached)"
+                    continue
+            jobs.append((i, "fit"+str(i+1), formula, fitrange, hist))
+        nprocesses = self.__nprocesses if self.__nprocesses is not None else multiprocessing.cpu_count()
+        nprocesses = min(nprocesses, len(jobs))
+        if nprocesses > 1:
+            pool = multiprocessing.Pool(nprocesses)
+            try:
+                for (index, result) in pool.imap_unordered(_fitFormula, jobs):
+                    results[index] = result
+                    print result["formula"], "has a chi2 of", result["chi2"]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                (index, result) = _fitFormula(job)
+                results[index] = result
+                print result["formula"], "has a chi2 of", result["chi2"]
+        if self.__fitcache is not None:
+            for (index, name, formula, jobrange, jobhist) in jobs:
+                self.__fitcache.put(keys[index], results[index])
+        self.__fitresults = results
+
+        # functions with the fitted parameters for the prediction
+        functionclass = [ROOT.TF1, ROOT.TF2, ROOT.TF3][self.__alpha_hist.GetDimension()-1]
+        for (i, result) in enumerate(results):
+            fit = functionclass("fit"+str(i+1), result["formula"], *fitrange)
+            for (j, (parameter, error)) in enumerate(zip(result["parameters"], result["errors"])):
+                fit.SetParameter(j, parameter)
+                fit.SetParError(j, error)
+            fit.SetChisquare(result["chi2"])
+            fit.SetNDF(result["ndf"])
+            # attached to the alpha histogram like after alpha_hist.Fit, the
+            # histogram deletes its functions, so python must not delete it
+            ROOT.SetOwnership(fit, False)
+            self.__alpha_hist.GetListOfFunctions().Add(fit)
             self.__fitfunctions.append(fit)
-            print formula, "has a chi2 of", fit.GetChisquare()
-            counter+=1
 
 
+    # Sample the parameters of the central fit Nsamples times from the fit
+    # covariance, the standard deviation of alpha in every bin is added to the
+    # uncertainty of the prediction. Nsamples = 0 disables the sampling.
+    def setParameterSampling(self, Nsamples=1000, seed=1):
+        self.__Nsamples = Nsamples
+        self.__seed = seed
+
+    # Standard deviation of the central fit function at the bin centers with
+    # parameters drawn from the covariance matrix, all samples are evaluated
+    # at once if the formula can be translated to numpy
+    def __sampleFitUncertainty(self, fit, formula, result, centers):
+        random = np.random.RandomState(self.__seed)
+        samples = random.multivariate_normal(result["parameters"], result["covariance"], self.__Nsamples)
+        evaluate = compileFormula(formula)
+        if evaluate is not None:
+            values = evaluate([parameter.reshape(-1, 1) for parameter in samples.T], *centers)
+        else:
+            sample = fit.Clone()
+            values = np.zeros((self.__Nsamples, len(centers[0])))
+            for i in range(self.__Nsamples):
+                for (j, parameter) in enumerate(samples[i]):
+                    sample.SetParameter(j, parameter)
+                values[i] = [sample.Eval(*[float(center[bin]) for center in centers]) for bin in range(len(centers[0]))]
+        return np.std(values, axis=0)
+
+    # Evaluate a fit function at the bin centers, vectorized if the formula
+    # can be translated to numpy, otherwise with TF1.Eval for every bin
+    def __evaluateFunction(self, fit, formula, centers):
+        evaluate = compileFormula(formula)
+        if evaluate is not None:
+            return evaluate([fit.GetParameter(i) for i in range(fit.GetNpar())], *centers)
+        return np.array([fit.Eval(*[float(center[bin]) for center in centers]) for bin in range(len(centers[0]))])
+
     def getPrediction(self):
         self.__calculateAlphaHist()
         self.__doAlphaFit()
         prediction = self.__data_CR.Clone()
-        Nbins = prediction.GetSize()-2
-        for i in range(Nbins):
-            bin = i+1
-            content = prediction.GetBinContent(bin)
-            error = prediction.GetBinError(bin)
-            bincenter = prediction.GetBinCenter(bin)
-            centralfactor = self.__fitfunctions[0].Eval(bincenter)
-            prediction.SetBinContent(bin, content*centralfactor)
-
-            maxdiff = 0
-            for i in range(len(self.__fitfunctions)):
-                if i==0: continue
-                diff = abs(self.__fitfunctions[0].Eval(bincenter) - self.__fitfunctions[i].Eval(bincenter))
-                if diff > maxdiff:
-                    maxdiff = diff
-            syserror = content*maxdiff
-            totalerror = sqrt( (error*centralfactor)*(error*centralfactor) + syserror*syserror )
-            prediction.SetBinError(bin,totalerror)
+        contents = getContents(self.__data_CR, self.__flow)
+        errors = getErrors(self.__data_CR, self.__flow)
+        used = np.ones(len(contents), dtype=bool)
+        if self.__flow != "include":
+            used = ~flowMask(getShape(prediction))
+        centers = [center[used] for center in getBinCenters(prediction)]
+        factors = [self.__evaluateFunction(fit, formula, centers) for (fit, formula) in zip(self.__fitfunctions, self.__fitformulas)]
+
+        # central factor from the first function, envelope of the others
+        centralfactor = factors[0]
+        maxdiff = np.zeros(len(centralfactor))
+        for factor in factors[1:]:
+            maxdiff = np.fmax(maxdiff, np.abs(centralfactor-factor))
+        syserror = contents[used]*maxdiff
+        staterror = errors[used]*centralfactor
+        newcontents = np.zeros(len(contents))
+        newerrors = np.zeros(len(contents))
+        newcontents[used] = contents[used]*centralfactor
+        fiterror = np.zeros(len(centralfactor))
+        if self.__Nsamples > 0:
+            fiterror = contents[used]*self.__sampleFitUncertainty(self.__fitfunctions[0], self.__fitformulas[0], self.__fitresults[0], centers)
+        newerrors[used] = np.sqrt(staterror*staterror + syserror*syserror + fiterror*fiterror)
+        setContents(prediction, newcontents, newerrors)
         return prediction
@@ -0,0 +1,149 @@
+"""
+Small on-disk cache for results that are expensive to compute (e.g. fits).
+Every entry is one pickle file in the cache directory, named after a hash of
+the key. The key is built from all inputs of the computation with hashKey,
+numpy arrays are hashed by their values. When the files in the directory are
+larger than maxBytes in total, the entries that were not used for the longest
+time are removed until 90% of maxBytes are left, so a full cache is not
+cleaned up again on every put. The total size is kept up to date on put and
+clear, the directory is only listed when the cache is opened and before an
+eviction (other processes may have added or used entries in the meantime).
+
+    cache = DiskCache("~/.cache/MyRootTools/fits", maxBytes=100*1024*1024)
+    key = hashKey(contents, errors, formula, fitrange)
+    result = cache.get(key)
+    if result is None:
+        result = fit(...)
+        cache.put(key, result)
+"""
+
+import os
+import errno
+import time
+import hashlib
+import pickle
+import tempfile
+import numpy as np
+
+
+################################################################################
+## Hash of all arguments, arrays are hashed by dtype, shape and values
+def hashKey(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            array = np.ascontiguousarray(part)
+            digest.update(("array %s %s:" %(array.dtype.str, array.shape)).encode())
+            digest.update(array.tobytes())
+        elif isinstance(part, (list, tuple)):
+            digest.update(("sequence %i:" %(len(part))).encode())
+            digest.update(hashKey(*part).encode())
+        else:
+            digest.update(("%s %r:" %(type(part).__name__, part)).encode())
+    return digest.hexdigest()
+
+
+class DiskCache:
+    def __init__(self, directory, maxBytes=100*1024*1024):
+        self.directory = os.path.expanduser(directory)
+        self.maxBytes = maxBytes
+        # other processes may create the directory at the same time
+        try:
+            os.makedirs(self.directory)
+        except OSError as error:
+            if error.errno != errno.EEXIST or not os.path.isdir(self.directory):
+                raise
+        self.__scan()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key+".pkl")
+
+    ############################################################################
+    ## Value stored for key, None if there is none (or it can not be read)
+    def get(self, key):
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # mark as recently used for the eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    ############################################################################
+    ## Store value for key (written to a temporary file first, so other
+    ## processes never read a half written entry)
+    def put(self, key, value):
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump(value, f, 2)
+        path = self.__path(key)
+        os.rename(temporary, path)
+        self.__add(path, os.path.getsize(path))
+        if self.__total > self.maxBytes:
+            self.__evict()
+
+    ############################################################################
+    ## Remove one entry, or all entries if key is None
+    def clear(self, key=None):
+        paths = [self.__path(key)] if key is not None else [entry[2] for entry in self.__entries()]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.__add(path, 0)
+
+    ############################################################################
+    ## (last use, size, path) of all entries
+    def __entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        return entries
+
+    ############################################################################
+    ## Index {path: size} and total size of all entries from the directory
+    def __scan(self):
+        entries = self.__entries()
+        self.__index = dict([(path, size) for (mtime, size, path) in entries])
+        self.__total = sum(self.__index.values())
+        return entries
+
+    ############################################################################
+    ## Set the size of one entry in the index, 0 removes it
+    def __add(self, path, size):
+        self.__total += size-self.__index.pop(path, 0)
+        if size > 0:
+            self.__index[path] = size
+
+    ############################################################################
+    ## Remove the least recently used entries until the cache fits into 90%
+    ## of maxBytes
+    def __evict(self):
+        entries = sorted(self.__scan())
+        for (mtime, size, path) in entries:
+            if self.__total <= 0.9*self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.__add(path, 0)
+
+    ############################################################################
+    ## Total size of all entries in bytes (entries written by other processes
+    ## since the last eviction are not included)
+    def size(self):
+        return self.__total
@@ -0,0 +1,94 @@
+"""
+Evaluate ROOT fit formulas (TF1/TF2/TF3 syntax) on numpy arrays.
+A formula like "[0]*exp([1]*x)+[2]*y^2" is translated once into a numpy
+expression and can then be evaluated for all bins at once instead of calling
+TF1.Eval for every bin. Supported are numbers, parameters [i], the variables
+x, y, z, the operators + - * / ^ and the usual math functions (also with the
+TMath:: prefix). For everything else (e.g. predefined functions like gaus or
+pol2, named parameters) compileFormula returns None and TF1.Eval has to be
+used instead.
+"""
+
+import re
+import numpy as np
+
+_functions = {
+    "exp":   "np.exp",   "log":   "np.log",   "log10": "np.log10", "sqrt": "np.sqrt",
+    "pow":   "np.power", "abs":   "np.abs",   "fabs":  "np.abs",   "sin":  "np.sin",
+    "cos":   "np.cos",   "tan":   "np.tan",   "asin":  "np.arcsin", "acos": "np.arccos",
+    "atan":  "np.arctan", "atan2": "np.arctan2", "sinh": "np.sinh", "cosh": "np.cosh",
+    "tanh":  "np.tanh",  "erf":   "_erf",
+    "TMath::Exp":  "np.exp",   "TMath::Log":  "np.log",   "TMath::Log10": "np.log10",
+    "TMath::Sqrt": "np.sqrt",  "TMath::Power": "np.power", "TMath::Abs":  "np.abs",
+    "TMath::Sin":  "np.sin",   "TMath::Cos":  "np.cos",   "TMath::Tan":   "np.tan",
+    "TMath::ATan": "np.arctan", "TMath::SinH": "np.sinh", "TMath::CosH":  "np.cosh",
+    "TMath::TanH": "np.tanh",  "TMath::Erf":  "_erf",
+}
+_constants = {"pi": "np.pi", "TMath::Pi()": "np.pi", "TMath::E()": "np.e"}
+_variables = {"x": "x", "y": "y", "z": "z"}
+
+_token = re.compile(r"\s*(?:"
+                    r"(?P<number>(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)|"
+                    r"(?P<parameter>\[\d+\])|"
+                    r"(?P<name>TMath::\w+(\(\))?|\w+)|"
+                    r"(?P<operator>[-+*/^(),]))")
+
+
+################################################################################
+## Error function for arrays (numpy has none, math.erf is for numbers)
+def _erf(values):
+    from math import erf
+    return np.vectorize(erf, otypes=[np.float64])(values)
+
+
+################################################################################
+## Translate a formula into a numpy expression with p (parameters) and x, y,
+## z (arrays) as variables, None if the formula is not supported
+def translateFormula(formula):
+    tokens = []
+    position = 0
+    formula = formula.strip()
+    while position < len(formula):
+        match = _token.match(formula, position)
+        if match is None or match.end() == position:
+            return None
+        position = match.end()
+        if match.group("number") is not None:
+            # always floating point numbers, like in C++ for 1./2
+            tokens.append(repr(float(match.group("number"))))
+        elif match.group("parameter") is not None:
+            tokens.append("p[%s]" %(match.group("parameter")[1:-1]))
+        elif match.group("name") is not None:
+            name = match.group("name")
+            if name in _constants:
+                tokens.append(_constants[name])
+            elif name in _variables:
+                tokens.append(_variables[name])
+            elif name in _functions and formula[position:].lstrip().startswith("("):
+                tokens.append(_functions[name])
+            else:
+                return None
+        else:
+            tokens.append("**" if match.group("operator") == "^" else match.group("operator"))
+    return "".join(tokens)
+
+
+################################################################################
+## Compile a formula into a function f(parameters, x, y=0., z=0.) that
+## returns an array, None if the formula is not supported. The parameters
+## can also be arrays, e.g. with shape (Nsamples, 1) for bin centers with
+## shape (Nbins,) the result has the shape (Nsamples, Nbins).
+def compileFormula(formula):
+    expression = translateFormula(formula)
+    if expression is None:
+        return None
+    try:
+        code = compile(expression, "<formula %s>" %(formula), "eval")
+    except SyntaxError:
+        return None
+    def evaluate(parameters, x, y=0., z=0.):
+        with np.errstate(all="ignore"):
+            values = eval(code, {"np": np, "_erf": _erf}, {"p": parameters, "x": x, "y": y, "z": z})
+        values = np.asarray(values, dtype=np.float64)
+        return np.broadcast_to(values, np.broadcast(values, x).shape).copy()
+    return evaluate
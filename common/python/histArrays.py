@@ -0,0 +1,173 @@
+"""
+Helpers to move the contents and errors of ROOT histograms into numpy arrays
+and back. The arrays contain all bins including under- and overflow in the
+internal bin order of ROOT, so they have the length hist.GetSize() and the
+array index is the global bin number. This is the same for TH1, TH2 and TH3,
+reshaped to getShape(hist) the arrays are indexed as [z][y][x].
+
+Under- and overflow bins can be handled in three ways (flow):
+    "include": used like all other bins
+    "exclude": set to 0
+    "fold":    added to the first/last bin of every axis and set to 0,
+               errors are added in quadrature
+"""
+
+import ROOT
+import numpy as np
+from array import array
+
+flowOptions = ["include", "exclude", "fold"]
+
+
+################################################################################
+## View a C array of a histogram as numpy array of length N
+def _asNumpy(buffer, N, dtype):
+    if hasattr(buffer, "reshape"):
+        # cppyy LowLevelView
+        buffer.reshape((N,))
+    elif hasattr(buffer, "SetSize"):
+        # buffer of the old PyROOT
+        buffer.SetSize(N)
+    return np.frombuffer(buffer, dtype=dtype, count=N).astype(np.float64)
+
+
+################################################################################
+## Storage type of the bin contents
+def _contentType(hist):
+    for (arraytype, dtype) in [("TArrayD", np.float64), ("TArrayF", np.float32), ("TArrayI", np.int32),
+                               ("TArrayS", np.int16), ("TArrayC", np.int8)]:
+        if hasattr(ROOT, arraytype) and isinstance(hist, getattr(ROOT, arraytype)):
+            return dtype
+    return None
+
+
+################################################################################
+## Number of bins per axis including under- and overflow as ([z],[y],x)
+def getShape(hist):
+    shape = [hist.GetNbinsX()+2]
+    if hist.GetDimension() > 1:
+        shape.insert(0, hist.GetNbinsY()+2)
+    if hist.GetDimension() > 2:
+        shape.insert(0, hist.GetNbinsZ()+2)
+    return tuple(shape)
+
+
+################################################################################
+## Apply the flow option to a flat array of bins with the given shape
+def applyFlow(values, shape, flow, quadrature=False):
+    if flow not in flowOptions:
+        raise RuntimeError("Unknown flow option %s, use 'include', 'exclude' or 'fold'" %(flow))
+    values = np.array(values, dtype=np.float64).reshape(shape)
+    if flow == "fold":
+        if quadrature:
+            values = values*values
+        for axis in range(len(shape)):
+            view = np.moveaxis(values, axis, 0)
+            view[1] += view[0]
+            view[-2] += view[-1]
+            view[0] = 0.
+            view[-1] = 0.
+        if quadrature:
+            values = np.sqrt(values)
+    values = values.reshape(-1)
+    if flow == "exclude":
+        values[flowMask(shape)] = 0.
+    return values
+
+
+################################################################################
+## Flat mask that is True for all under- and overflow bins
+def flowMask(shape):
+    mask = np.zeros(shape, dtype=bool)
+    for axis in range(len(shape)):
+        view = np.moveaxis(mask, axis, 0)
+        view[0] = True
+        view[-1] = True
+    return mask.reshape(-1)
+
+
+################################################################################
+## Bin contents as float64 array
+def getContents(hist, flow="include"):
+    N = hist.GetSize()
+    hist.BufferEmpty()
+    dtype = _contentType(hist)
+    contents = None
+    if dtype is not None:
+        try:
+            contents = _asNumpy(hist.GetArray(), N, dtype)
+        except (TypeError, ValueError, AttributeError):
+            pass
+    if contents is None:
+        contents = np.array([hist.GetBinContent(i) for i in range(N)], dtype=np.float64)
+    if flow == "include":
+        return contents
+    return applyFlow(contents, getShape(hist), flow)
+
+
+################################################################################
+## Bin errors as float64 array, the same as GetBinError for every bin
+def getErrors(hist, flow="include"):
+    N = hist.GetSize()
+    hist.BufferEmpty()
+    errors = None
+    if hist.GetSumw2N() > 0:
+        try:
+            errors = np.sqrt(_asNumpy(hist.GetSumw2().GetArray(), N, np.float64))
+        except (TypeError, ValueError, AttributeError):
+            pass
+    elif hist.GetBinErrorOption() == ROOT.TH1.kNormal:
+        errors = np.sqrt(np.abs(getContents(hist)))
+    if errors is None:
+        errors = np.array([hist.GetBinError(i) for i in range(N)], dtype=np.float64)
+    if flow == "include":
+        return errors
+    return applyFlow(errors, getShape(hist), flow, quadrature=True)
+
+
+################################################################################
+## Bin centers of all global bins as a list with one array per axis
+def getBinCenters(hist):
+    shape = getShape(hist)
+    axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:len(shape)]
+    centers = [np.array([axis.GetBinCenter(i) for i in range(axis.GetNbins()+2)]) for axis in axes]
+    # meshgrid in [z][y][x] order, like the global bins
+    grids = np.meshgrid(*reversed(centers), indexing="ij")
+    return [grid.reshape(-1) for grid in reversed(grids)]
+
+
+################################################################################
+## Set contents (and errors) of all bins from arrays
+def setContents(hist, contents, errors=None):
+    hist.SetContent(np.ascontiguousarray(contents, dtype=np.float64))
+    if errors is not None:
+        hist.SetError(np.ascontiguousarray(errors, dtype=np.float64))
+
+
+################################################################################
+## New histogram with the binning of template filled from arrays
+def makeHist(template, contents, errors=None):
+    hist = template.Clone()
+    hist.Reset()
+    setContents(hist, contents, errors)
+    return hist
+
+
+################################################################################
+## Bin edges of all axes as a list of lists ([x, y, z] up to the dimension)
+def getBinEdges(hist):
+    axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+    return [[axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins()+2)] for axis in axes]
+
+
+################################################################################
+## New TH1D/TH2D/TH3D from bin edges (as from getBinEdges) and arrays, e.g.
+## to rebuild a histogram from plain data in another process
+def makeHistFromArrays(name, edges, contents, errors=None):
+    histclass = [ROOT.TH1D, ROOT.TH2D, ROOT.TH3D][len(edges)-1]
+    binning = []
+    for axisedges in edges:
+        binning += [len(axisedges)-1, array("d", axisedges)]
+    hist = histclass(name, name, *binning)
+    setContents(hist, contents, errors)
+    return hist
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Benchmark of the ttbar reconstruction as a function of the jet multiplicity.
+Synthetic events with seeded kinematics are reconstructed with the per-event
+class (exhaustive, lazy, pruned and top-k search) and with ttbarRecoBatch.
+For every (path, chi2 mode, number of jets) events/s, hypotheses/s and the
+peak memory above the memory used before the reconstruction are reported.
+Every case runs in its own python process, so the peak memory of one case
+does not depend on the cases before.
+
+Examples:
+    python benchmarkTTbarReco.py
+    python benchmarkTTbarReco.py --jets 4 8 12 --save reference.json
+    python benchmarkTTbarReco.py --compare reference.json --tolerance 0.3
+
+With --compare the exit code is 1 if a case is slower than the reference by
+more than the tolerance. The per-event class needs ROOT and python 2,
+without them only the batch path is run. Cases that fail are reported and
+skipped.
+"""
+
+from __future__ import print_function
+import os,sys
+import argparse
+import json
+import resource
+import subprocess
+import gc
+import numpy as np
+from timeit                              import default_timer as timer
+from MyRootTools.ttbarReconstruction.neutrinoSolver import solveNeutrinoPz
+from MyRootTools.ttbarReconstruction.ttbarRecoBatch import ttbarRecoBatch
+
+perEventPaths = ["exhaustive", "lazy", "pruned", "topk"]
+allPaths = perEventPaths + ["batch"]
+
+
+################################################################################
+## Events with Njets jets, the same seed always gives the same events
+def generateEvents(Nevents, Njets, seed):
+    r = np.random.RandomState(seed*1000+Njets)
+    def vectors(N, ptscale, mass):
+        pt  = r.exponential(ptscale, N)+20.
+        eta = r.uniform(-2.4, 2.4, N)
+        phi = r.uniform(-np.pi, np.pi, N)
+        px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+        return px, py, pz, np.sqrt(px*px+py*py+pz*pz+mass*mass)
+    lepton = vectors(Nevents, 40., 0.1)
+    met = vectors(Nevents, 50., 0.)[:2]
+    jets = vectors(Nevents*Njets, 60., 10.)
+    return lepton, met, jets
+
+
+################################################################################
+## Number of hypotheses: neutrino solutions x jet permutations
+def countHypotheses(lepton, met, Njets):
+    isComplex = solveNeutrinoPz(lepton[0], lepton[1], lepton[2], lepton[3], met[0], met[1])[2]
+    Nneutrinos = int(np.sum(np.where(isComplex, 1, 2)))
+    Npermutations = Njets*(Njets-1)*(Njets-2)*(Njets-3)
+    return Nneutrinos*Npermutations, Nneutrinos
+
+
+################################################################################
+## Current resident memory of this process in MB
+def _rss():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages*resource.getpagesize()/1024./1024.
+
+################################################################################
+## Reset the peak resident memory of this process to the current one (Linux),
+## False if this is not possible
+def _resetPeak():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+################################################################################
+## Peak resident memory since the last reset in MB
+def _peakRSS():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])/1024.
+
+
+################################################################################
+## Measure the peak memory of the reconstruction: the resident memory peak
+## above the memory before the start, or if the peak can not be reset (no
+## Linux) the peak of the python and numpy allocations (tracemalloc, python 3
+## only, does not see the memory of ROOT). nan if neither is possible.
+class _PeakMemory:
+    def start(self):
+        gc.collect()
+        self.method = None
+        if _resetPeak():
+            self.method = "rss"
+            self.before = _rss()
+            return
+        try:
+            import tracemalloc
+        except ImportError:
+            return
+        self.method = "tracemalloc"
+        tracemalloc.start()
+
+    def stop(self):
+        if self.method == "rss":
+            return _peakRSS()-self.before
+        if self.method == "tracemalloc":
+            import tracemalloc
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak/1024./1024.
+        return float("nan")
+
+
+################################################################################
+## Run one case in this process and return the measurements
+def runCase(path, mode, Njets, Nevents, seed, k):
+    lepton, met, jets = generateEvents(Nevents, Njets, seed)
+    Nhypotheses, Nneutrinos = countHypotheses(lepton, met, Njets)
+    if path == "batch":
+        njets = np.full(Nevents, Njets, dtype=np.int64)
+    else:
+        import ROOT
+        from MyRootTools.ttbarReconstruction.ttbarReco import ttbarReco
+        events = []
+        for i in range(Nevents):
+            lep = ROOT.TLorentzVector(lepton[0][i], lepton[1][i], lepton[2][i], lepton[3][i])
+            mis = ROOT.TLorentzVector(met[0][i], met[1][i], 0., np.hypot(met[0][i], met[1][i]))
+            js = [ROOT.TLorentzVector(*[float(x[i*Njets+j]) for x in jets]) for j in range(Njets)]
+            events.append((lep, mis, js))
+    memory = _PeakMemory()
+    memory.start()
+    start = timer()
+    if path == "batch":
+        reco = ttbarRecoBatch(lepton, met, jets, njets)
+        reco.changeMode(mode)
+        reco.reconstruct()
+    else:
+        options = {
+            "exhaustive": dict(),
+            "lazy":       dict(lazy=True),
+            "pruned":     dict(search="pruned"),
+            "topk":       dict(k=k),
+        }[path]
+        for (lep, mis, js) in events:
+            reco = ttbarReco(lep, mis, js)
+            reco.changeMode(mode)
+            reco.reconstruct(**options)
+    elapsed = timer()-start
+    peak = memory.stop()
+    result = {}
+    result["path"] = path
+    result["mode"] = mode
+    result["njets"] = Njets
+    result["events"] = Nevents
+    result["neutrinos"] = Nneutrinos
+    result["hypotheses"] = Nhypotheses
+    result["time"] = elapsed
+    result["events_per_s"] = Nevents/elapsed
+    result["hypotheses_per_s"] = Nhypotheses/elapsed
+    result["peak_mb"] = peak
+    return result
+
+
+################################################################################
+## Run one case in a new python process, None if the case failed
+def runIsolated(path, mode, Njets, Nevents, seed, k):
+    command = [sys.executable, os.path.abspath(__file__), "--case", path, mode, str(Njets), str(Nevents),
+               "--seed", str(seed), "--k", str(k)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        return None
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def hasROOT():
+    try:
+        import ROOT
+        return True
+    except ImportError:
+        return False
+
+
+################################################################################
+## The per-event class is python 2 code and needs ROOT
+def hasPerEvent():
+    return sys.version_info[0] == 2 and hasROOT()
+
+
+################################################################################
+## Compare to a reference, returns the number of regressions
+def compare(results, reference, tolerance):
+    key = lambda r: (r["path"], r["mode"], r["njets"])
+    reference = dict([(key(r), r) for r in reference])
+    Nregressions = 0
+    for r in results:
+        if key(r) not in reference:
+            continue
+        ratio = r["events_per_s"]/reference[key(r)]["events_per_s"]
+        if ratio < 1.-tolerance:
+            print("[Warning]: %s %s %i jets is slower than the reference: %.2f x" %(r["path"], r["mode"], r["njets"], ratio))
+            Nregressions += 1
+    return Nregressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of ttbarReco and ttbarRecoBatch")
+    parser.add_argument("--jets", type=int, nargs="+", default=[4, 5, 6, 7, 8, 10, 12], help="jet multiplicities")
+    parser.add_argument("--modes", nargs="+", default=["normal", "topdiff"], help="chi2 modes")
+    parser.add_argument("--paths", nargs="+", default=allPaths, choices=allPaths, help="reconstruction paths")
+    parser.add_argument("--events", type=int, default=2000, help="events per case for the batch path")
+    parser.add_argument("--events-per-event", type=int, default=20, dest="eventsPerEvent", help="events per case for the per-event paths")
+    parser.add_argument("--k", type=int, default=5, help="number of hypotheses for the top-k path")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic events")
+    parser.add_argument("--no-isolate", action="store_true", dest="noIsolate", help="run all cases in this process")
+    parser.add_argument("--save", default=None, help="write the results to a json file")
+    parser.add_argument("--compare", default=None, help="json file with reference results")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown with --compare")
+    parser.add_argument("--case", nargs=4, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # single case in a subprocess, print the result as json
+    if args.case is not None:
+        (path, mode, Njets, Nevents) = args.case
+        print(json.dumps(runCase(path, mode, int(Njets), int(Nevents), args.seed, args.k)))
+        sys.exit(0)
+
+    paths = args.paths
+    if not hasPerEvent():
+        print("[Warning]: The per-event class needs ROOT and python 2, only the batch path is run")
+        paths = [path for path in paths if path == "batch"]
+
+    results = []
+    print("%-10s %-8s %5s %7s %12s %14s %10s" %("path", "mode", "jets", "events", "events/s", "hypotheses/s", "peak MB"))
+    for mode in args.modes:
+        for Njets in args.jets:
+            for path in paths:
+                Nevents = args.events if path == "batch" else args.eventsPerEvent
+                if args.noIsolate:
+                    try:
+                        r = runCase(path, mode, Njets, Nevents, args.seed, args.k)
+                    except Exception as error:
+                        print("[Warning]: %s" %(error))
+                        r = None
+                else:
+                    r = runIsolated(path, mode, Njets, Nevents, args.seed, args.k)
+                if r is None:
+                    print("[Warning]: Benchmark case %s %s %i jets failed, skipped" %(path, mode, Njets))
+                    continue
+                results.append(r)
+                print("%-10s %-8s %5i %7i %12.1f %14.0f %10.1f" %(path, mode, Njets, Nevents, r["events_per_s"], r["hypotheses_per_s"], r["peak_mb"]))
+                sys.stdout.flush()
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        if compare(results, reference, args.tolerance) > 0:
+            sys.exit(1)
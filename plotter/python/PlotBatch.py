@@ -0,0 +1,231 @@
+"""
+Make many plots with the Plotter in one go. Every plot is described by a
+dictionary (spec), histograms that are used in many plots can be given once
+as inputs and are referenced in the specs by their name. The global style is
+set once for all plots and ROOT runs in batch mode.
+
+    batch = PlotBatch(inputs={"ttbar_mT": h1, "data_mT": h2},
+                      defaults={"lumi": 138, "drawRatio": True})
+    batch.addPlot({
+        "name":            "mT_SR",
+        "options":         {"xtitle": "m_{T} [GeV]", "log": True},
+        "backgrounds":     [("ttbar_mT", "t#bar{t}", ROOT.kAzure+7)],
+        "signals":         [(hsig, "Signal", ROOT.kRed, 2)],
+        "data":            "data_mT",
+        "systematics":     [(up, down, "JES", "t#bar{t}")],
+        "normSystematics": [("t#bar{t}", 0.05)],
+        "texts":           [(0.2, 0.8, "SR")],
+        "xrange":          (0, 500),
+        "yrange":          (0.1, 1000),
+    })
+    timings = batch.run()
+
+Only "name" is required. "options" are attributes of the Plotter (set after
+the defaults and before the histograms are added, so rebin and divideByWidth
+work as usual). Backgrounds, signals, texts and systematics take the same
+arguments as the Plotter functions, data is a histogram or (histogram,
+legendtext). run() returns the timings of every plot.
+
+With run(nprocesses=N) the plots are distributed over N processes. The
+worker processes are forked, so the inputs are not copied or pickled, and
+every worker has its own gROOT/gStyle and runs in batch mode. The objects of
+every plot are named after the position of the spec, so the output does not
+depend on the number of processes.
+
+With setRenderCache plots that did not change since the last run are not
+drawn again (see Plotter.setRenderCache), forceDraw in the defaults or
+options draws them anyway.
+
+The option cloneInputs = False avoids copies of the input histograms, but
+the plotters then change them (colors for every plot, rebin and
+divideByWidth again for every plot). Do not combine it with rebin or
+divideByWidth if inputs are shared by several plots.
+"""
+
+from __future__ import print_function
+import ROOT,sys
+import multiprocessing
+from itertools                           import count
+from timeit                              import default_timer as timer
+from MyRootTools.plotter.Plotter         import Plotter, setPlotStyle
+from MyRootTools.common.diskCache        import DiskCache
+
+# PlotBatch used by the worker processes (inherited when forking)
+_workerBatch = None
+
+
+################################################################################
+## Set up a worker process: batch mode, style and new Plotter ids
+def _initWorker():
+    ROOT.gROOT.SetBatch(True)
+    setPlotStyle()
+    Plotter._ids = count(0)
+
+
+################################################################################
+## Draw one plot in a worker process, errors are sent back to the main process
+def _renderPlot(index):
+    try:
+        return index, _workerBatch._PlotBatch__renderPlot(index)
+    except SystemExit:
+        return index, None
+
+
+specKeys = ["name", "options", "backgrounds", "signals", "data", "systematics", "normSystematics", "texts", "xrange", "yrange"]
+
+
+class PlotBatch:
+    def __init__(self, inputs=None, defaults=None):
+        self.inputs = dict(inputs) if inputs is not None else {}        # Histograms shared by the plots
+        self.defaults = dict(defaults) if defaults is not None else {}  # Plotter options for all plots
+        self.verbose = True                                             # Print timings?
+        self.__specs = []
+        self.__names = set()
+        self.__timings = []
+        self.__renderCache = None
+
+    ############################################################################
+    # Use a render cache for all plots (see Plotter.setRenderCache), the
+    # cache directory is created here once and shared by all plots/workers
+    def setRenderCache(self, directory, maxMB=10):
+        self.__renderCache = None if directory is None else DiskCache(directory, int(maxMB*1024*1024))
+
+    ############################################################################
+    # Add a histogram that can be used in the specs by its name
+    def addInput(self, name, hist):
+        self.inputs[name] = hist
+
+    ############################################################################
+    # Add one plot, see the module description for the spec
+    def addPlot(self, spec):
+        if "name" not in spec:
+            print("[Error]: Plot spec needs a name.")
+            sys.exit(1)
+        unknown = [key for key in spec if key not in specKeys]
+        if len(unknown) > 0:
+            print("[Error]: Unknown keys %s in plot spec %s." %(", ".join(unknown), spec["name"]))
+            sys.exit(1)
+        if spec["name"] in self.__names:
+            print("[Error]: Plot %s is already added." %(spec["name"]))
+            sys.exit(1)
+        self.__names.add(spec["name"])
+        self.__specs.append(spec)
+
+    ############################################################################
+    # Add a list of plots
+    def addPlots(self, specs):
+        for spec in specs:
+            self.addPlot(spec)
+
+    ############################################################################
+    # Timings of the last run as list of dictionaries with name, setup
+    # (adding histograms), draw and total time in seconds and skipped (True
+    # if the plot was unchanged in the render cache)
+    def getTimings(self):
+        return self.__timings
+
+    ############################################################################
+    # Private, get a histogram from the inputs if a name is given
+    def __resolve(self, hist, plotname):
+        if not isinstance(hist, str):
+            return hist
+        if hist not in self.inputs:
+            print("[Error]: Input %s used in plot %s does not exist." %(hist, plotname))
+            sys.exit(1)
+        return self.inputs[hist]
+
+    ############################################################################
+    # Private, set up a Plotter for one spec
+    def __setupPlotter(self, index):
+        spec = self.__specs[index]
+        name = spec["name"]
+        plotter = Plotter(name, setStyle=False, id="batch%i_" %(index))
+        options = dict(self.defaults)
+        options.update(spec.get("options", {}))
+        for (option, value) in options.items():
+            if not hasattr(plotter, option):
+                print("[Error]: Unknown Plotter option %s in plot %s." %(option, name))
+                sys.exit(1)
+            setattr(plotter, option, value)
+        if self.__renderCache is not None:
+            plotter.setRenderCache(self.__renderCache)
+        for background in spec.get("backgrounds", []):
+            plotter.addBackground(self.__resolve(background[0], name), *background[1:])
+        for signal in spec.get("signals", []):
+            plotter.addSignal(self.__resolve(signal[0], name), *signal[1:])
+        if spec.get("data") is not None:
+            data = spec["data"] if isinstance(spec["data"], (tuple, list)) else (spec["data"],)
+            plotter.addData(self.__resolve(data[0], name), *data[1:])
+        for systematic in spec.get("systematics", []):
+            plotter.addSystematic(self.__resolve(systematic[0], name), self.__resolve(systematic[1], name), *systematic[2:])
+        for normSystematic in spec.get("normSystematics", []):
+            plotter.addNormSystematic(*normSystematic)
+        for text in spec.get("texts", []):
+            plotter.addText(*text)
+        if spec.get("xrange") is not None:
+            plotter.setCustomXRange(*spec["xrange"])
+        if spec.get("yrange") is not None:
+            plotter.setCustomYRange(*spec["yrange"])
+        return plotter
+
+    ############################################################################
+    # Private, set up and draw one plot, returns the timing
+    def __renderPlot(self, index):
+        spec = self.__specs[index]
+        start = timer()
+        plotter = self.__setupPlotter(index)
+        setup = timer()
+        plotter.draw()
+        end = timer()
+        if self.verbose:
+            print("Plot %s done in %.3f s" %(spec["name"], end-start))
+            sys.stdout.flush()
+        return {"name": spec["name"], "setup": setup-start, "draw": end-setup, "total": end-start, "skipped": plotter.drawSkipped}
+
+    ############################################################################
+    # Draw all plots, in this process (nprocesses=1) or distributed over a
+    # pool of nprocesses worker processes (None: number of CPUs).
+    # Returns the timings in the order of the specs.
+    def run(self, nprocesses=1):
+        global _workerBatch
+        if nprocesses is None:
+            nprocesses = multiprocessing.cpu_count()
+        nprocesses = min(nprocesses, len(self.__specs))
+        self.__timings = [None]*len(self.__specs)
+        if nprocesses > 1:
+            # the workers need fork to inherit the inputs
+            context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+            _workerBatch = self
+            pool = context.Pool(nprocesses, initializer=_initWorker)
+            failed = []
+            try:
+                for (index, timing) in pool.imap_unordered(_renderPlot, range(len(self.__specs))):
+                    if timing is None:
+                        failed.append(self.__specs[index]["name"])
+                    self.__timings[index] = timing
+            finally:
+                pool.close()
+                pool.join()
+                _workerBatch = None
+            if len(failed) > 0:
+                print("[Error]: Plots %s failed." %(", ".join(failed)))
+                sys.exit(1)
+        else:
+            ROOT.gROOT.SetBatch(True)
+            setPlotStyle()
+            for index in range(len(self.__specs)):
+                self.__timings[index] = self.__renderPlot(index)
+        if self.verbose:
+            self.printTimings()
+        return self.__timings
+
+    ############################################################################
+    # Print the timings of the last run
+    def printTimings(self):
+        print("%-40s %10s %10s %10s" %("plot", "setup [s]", "draw [s]", "total [s]"))
+        for timing in self.__timings:
+            print("%-40s %10.3f %10.3f %10.3f%s" %(timing["name"], timing["setup"], timing["draw"], timing["total"], " (unchanged)" if timing["skipped"] else ""))
+        print("%-40s %10.3f %10.3f %10.3f" %("all %i plots" %(len(self.__timings)),
+                                             sum([t["setup"] for t in self.__timings]),
+                                             sum([t["draw"] for t in self.__timings]),
+                                             sum([t["total"] for t in self.__timings])))
@@ -10,20 +10,54 @@ Systematic uncertainties are plugged in as variaitons of single backgrounds and
 treated internally in the plotter.
 
 Some parameters can be changed in order to customize the plot.
+
+With setRenderCache a hash of everything that goes into the plot (histograms,
+systematics, texts, styles and all parameters) is stored on disk after
+drawing. If draw() is called again with the same inputs and the pdf is still
+there, the plot is not drawn again. Set forceDraw = True to draw anyway.
+Parameters that can not be hashed (e.g. ROOT objects) are an error.
+
+All histograms are cloned when they are added. With cloneInputs = False the
+plotter uses the given histograms directly (and changes them: colors, rebin,
+divideByWidth). Systematics are always stored as arrays of the differences
+to the backgrounds, not as histograms.
 """
 
 
 import ROOT,os,sys
 import array as arr
+import numpy as np
 from math                                import sqrt
 from itertools                           import count
+from MyRootTools.common.histArrays       import getContents, getErrors, getBinCenters, getBinEdges
+from MyRootTools.common.diskCache        import DiskCache, hashKey
+
+# Increase when the drawing changes, so plots in the render cache are redrawn
+renderCacheVersion = 2
+
+# Types of parameters that go into the render cache key
+try:
+    _plainTypes = (bool, int, long, float, str, unicode, np.number, np.bool_)
+except NameError:
+    _plainTypes = (bool, int, float, str, np.number, np.bool_)
+
+
+################################################################################
+## Global drawing options, set by every Plotter (unless setStyle=False)
+def setPlotStyle():
+    ROOT.gStyle.SetLegendBorderSize(0)
+    ROOT.gStyle.SetPadTickX(1)
+    ROOT.gStyle.SetPadTickY(1)
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gStyle.SetEndErrorSize(0)
 
 
 class Plotter:
     _ids = count(0)
-    def __init__(self, name):
-        # Keep track of instances of this class to have unique canvas names
-        self.id = next(self._ids)
+    def __init__(self, name, setStyle=True, id=None):
+        # Keep track of instances of this class to have unique canvas names,
+        # PlotBatch sets its own ids
+        self.id = next(self._ids) if id is None else id
         self.debug = False
 
         # Check if plotter is run with pyroot or python and ROOT bindings
@@ -32,12 +66,9 @@ class Plotter:
         else:
             self.isPYROOT = False
 
-        # A few global drawing options
-        ROOT.gStyle.SetLegendBorderSize(0)
-        ROOT.gStyle.SetPadTickX(1)
-        ROOT.gStyle.SetPadTickY(1)
-        ROOT.gStyle.SetOptStat(0)
-        ROOT.gStyle.SetEndErrorSize(0)
+        # A few global drawing options (PlotBatch sets them only once)
+        if setStyle:
+            setPlotStyle()
 
         # Some parameters that can be changed
         self.plotname = name                        # Name of the pdf file
@@ -62,6 +93,9 @@ class Plotter:
         self.horizontalErrors = False               # show horizontal error bars for data?
         self.logoAbovePlot = False                  # Put CMS logo above pad?
         self.customBinLabels = None                 # Make custom bin labels
+        self.cloneInputs = True                     # clone input histograms? False: the plotter takes ownership (sets colors, rebins, scales)
+        self.forceDraw = False                      # draw even if the plot is in the render cache?
+        self.drawSkipped = False                    # set by draw(): was the plot taken from the render cache?
 
         # Internal parameters that are set automatically
         self.__legend = ROOT.TLegend()                # Legend
@@ -72,8 +106,12 @@ class Plotter:
         self.__hasBackground = False                  # Keep track if backgrounds have been added
         self.__doSystematics = False                  # Keep track if systematics have been added
         self.__backgrounds = []                       # Hists and infos of all backgrounds
-        self.__sysDeltas = []                         # List of systematic shifts
-        self.__sysnames = []                          # List of systematic names
+        self.__sysnames = []                          # List of systematic names (one entry per added systematic)
+        self.__sysNuisances = []                      # Names of the systematics in the delta arrays
+        self.__sysSlots = []                          # Background name of every slot in the delta arrays
+        self.__sysFilled = []                         # Slots that are set for every systematic
+        self.__sysEntries = []                        # (systematic, slot, deltaUp, deltaDown) of every added systematic
+        self.__sysDeltas = None                       # Up/down shifts as arrays (systematic x background slot x bin)
         self.__signals = []                           # Hists and infos of all signals
         self.__data = {}                              # Hist and info of data
         self.__stack = ROOT.THStack()                 # Stack for backgrounds
@@ -94,12 +132,21 @@ class Plotter:
         self.__MarginBottom = 0.48                    # Pad Margin Bottom
         self.__MarginLeft = 0.19                      # Pad Margin Left
         self.__MarginRight = 0.05                     # Pad Margin Right
+        self.__textSpecs = []                         # Arguments of all text boxes (for the render cache)
+        self.__renderCache = None                     # DiskCache of drawn plots
+
 
+    ############################################################################
+    # Private, clone an input histogram unless the plotter owns the inputs
+    def __takeInput(self, hist):
+        if self.cloneInputs:
+            return hist.Clone()
+        return hist
 
     ############################################################################
     # Add backgrounds that are merged to a stack and displayed as filled areas
     def addBackground(self, hist_, legendtext, color):
-        hist = hist_.Clone()
+        hist = self.__takeInput(hist_)
         if self.debug: print("Add background")
         if self.rebin > 1:
             hist.Rebin(self.rebin)
@@ -131,7 +178,7 @@ class Plotter:
     ############################################################################
     # Add signals that are displayed as lines
     def addSignal(self, hist_, legendtext, color, lineStyle=1, lineWidth=2):
-        hist = hist_.Clone()
+        hist = self.__takeInput(hist_)
         if self.debug: print("Add signal")
         if self.rebin > 1:
             hist.Rebin(self.rebin)
@@ -170,7 +217,7 @@ class Plotter:
     # Add data that are displayed with markers,
     # only one data histogram is allowed
     def addData(self, hist_, legendtext="Data"):
-        hist = hist_.Clone()
+        hist = self.__takeInput(hist_)
         if self.debug: print("Add data")
         if self.rebin > 1:
             hist.Rebin(self.rebin)
@@ -204,49 +251,94 @@ class Plotter:
                 sys.exit(1)
 
     ############################################################################
-    # Add systematic
+    # Add systematic, only the differences to the background are stored (as
+    # arrays), the up/down histograms are only cloned if they have to be
+    # rebinned or divided by the bin width (and cloneInputs is True)
     def addSystematic(self, up_, down_, sysname, bkgname, from_norm=False):
-        up = up_.Clone()
-        down = down_.Clone()
         if self.debug: print("Add systematic")
-        if not from_norm:
-            # If this function is called from 'addNormSystematic()', do not
-            # rebin again
-            if self.rebin > 1:
-                up.Rebin(self.rebin)
-                down.Rebin(self.rebin)
+        # If this function is called from 'addNormSystematic()', do not
+        # rebin again
+        up = self.__getSystematicContents(up_, rebin=not from_norm)
+        down = self.__getSystematicContents(down_, rebin=not from_norm)
+        self.__addSystematicContents(up, down, sysname, bkgname)
+
+    ############################################################################
+    # Private, bin contents of a systematic variation after rebinning and
+    # dividing by the bin width
+    def __getSystematicContents(self, hist, rebin=True):
+        rebin = rebin and self.rebin > 1
+        if not rebin and not self.divideByWidth:
+            return getContents(hist)
+        hist = self.__takeInput(hist)
+        if rebin:
+            hist.Rebin(self.rebin)
         if self.divideByWidth:
-            up.Scale(1, "width")
-            down.Scale(1, "width")
+            hist.Scale(1, "width")
+        return getContents(hist)
+
+    ############################################################################
+    # Private, store the differences of up/down contents to a background
+    def __addSystematicContents(self, up, down, sysname, bkgname):
         self.__doSystematics = True
         foundBackground = False
         for bkg in self.__backgrounds:
             if bkg["name"] == bkgname:
                 foundBackground = True
-                deltaUp = up.Clone()
-                deltaUp.Add(bkg["hist"], -1)
-                deltaDown = down.Clone()
-                deltaDown.Add(bkg["hist"], -1)
-
-                self.__sysDeltas.append( (sysname, bkgname, deltaUp, deltaDown) )
+                central = getContents(bkg["hist"])
+                if len(up) != len(central) or len(down) != len(central):
+                    print("[Error]: Systematic %s does not have the same number of bins as background %s." %(sysname, bkgname))
+                    sys.exit(1)
+                self.__addSysDelta(sysname, bkgname, up-central, down-central)
                 self.__sysnames.append(sysname)
         if not foundBackground:
             print("[Error]: Trying to add %s systematic to %s, but could not find a background with name %s"%(sysname, bkgname, bkgname))
             sys.exit(1)
 
     ############################################################################
-    # Add a normalization uncertainty
+    # Private, store the shifts of one systematic and background. In the
+    # delta arrays every systematic has one row and every background one slot
+    # (a background gets another slot if the same systematic is added twice).
+    # The arrays are only built when they are needed.
+    def __addSysDelta(self, sysname, bkgname, deltaUp, deltaDown):
+        if sysname not in self.__sysNuisances:
+            self.__sysNuisances.append(sysname)
+            self.__sysFilled.append(set())
+        n = self.__sysNuisances.index(sysname)
+        free = [i for (i, name) in enumerate(self.__sysSlots) if name == bkgname and i not in self.__sysFilled[n]]
+        if len(free) == 0:
+            self.__sysSlots.append(bkgname)
+            free = [len(self.__sysSlots)-1]
+        self.__sysFilled[n].add(free[0])
+        self.__sysEntries.append( (n, free[0], deltaUp, deltaDown) )
+        self.__sysDeltas = None
+
+    ############################################################################
+    # Private, up and down shifts as arrays (systematic x background slot x bin)
+    def __getSysDeltas(self):
+        if self.__sysDeltas is None and len(self.__sysEntries) > 0:
+            shape = (len(self.__sysNuisances), len(self.__sysSlots), len(self.__sysEntries[0][2]))
+            deltaUp = np.zeros(shape)
+            deltaDown = np.zeros(shape)
+            for (n, slot, up, down) in self.__sysEntries:
+                deltaUp[n, slot] = up
+                deltaDown[n, slot] = down
+            self.__sysDeltas = (deltaUp, deltaDown)
+        return self.__sysDeltas
+
+    ############################################################################
+    # Add a normalization uncertainty, the shifts are calculated from the
+    # background contents without cloning. The background is already rebinned
+    # and divided by the bin width, so the shifts are not divided again.
     def addNormSystematic(self, bkgname, size):
         self.__doSystematics = True
         foundBackground = False
         for bkg in self.__backgrounds:
             if bkg["name"] == bkgname:
                 foundBackground = True
-                up   = bkg["hist"].Clone()
-                down = bkg["hist"].Clone()
-                up.Scale(1.0+size)
-                down.Scale(1.0-size)
-                self.addSystematic(up, down, bkgname+"_norm", bkgname, from_norm=True)
+                central = getContents(bkg["hist"])
+                up   = central*(1.0+size)
+                down = central*(1.0-size)
+                self.__addSystematicContents(up, down, bkgname+"_norm", bkgname)
         if not foundBackground:
             print("[Error]: Trying to add normalization systematic to %s, but could not find a background with name %s" %(bkgname, bkgname))
             sys.exit(1)
@@ -277,6 +369,17 @@ class Plotter:
         latex.SetX(x)
         latex.SetY(y)
         self.__latexTexts.append(latex)
+        self.__textSpecs.append( (x, y, text, font, size) )
+
+    ############################################################################
+    # Skip drawing plots that did not change since they were drawn the last
+    # time. The cache keeps at most maxMB on disk, directory None disables it.
+    # A DiskCache can be given instead of the directory to share it.
+    def setRenderCache(self, directory, maxMB=10):
+        if directory is None or isinstance(directory, DiskCache):
+            self.__renderCache = directory
+        else:
+            self.__renderCache = DiskCache(directory, int(maxMB*1024*1024))
 
     ############################################################################
     # Return the TGraph with total uncertaintis
@@ -295,6 +398,56 @@ class Plotter:
         elif label == "left":
             self.__MarginLeft *= factor
 
+    ############################################################################
+    # Private, True for numbers, strings and lists of them (no ROOT objects)
+    def __isPlainValue(self, value):
+        if isinstance(value, (tuple, list)):
+            return all([self.__isPlainValue(v) for v in value])
+        return value is None or isinstance(value, _plainTypes)
+
+    ############################################################################
+    # Private, all drawing attributes of a histogram for the render cache
+    def __getHistStyle(self, hist):
+        style = [hist.GetFillColor(), hist.GetFillStyle(), hist.GetLineColor(), hist.GetLineStyle(), hist.GetLineWidth(),
+                 hist.GetMarkerColor(), hist.GetMarkerStyle(), hist.GetMarkerSize()]
+        # colors with transparency (SetFillColorAlpha) have their own color index,
+        # the alpha is added explicitly in case the color table changes
+        for index in [hist.GetFillColor(), hist.GetLineColor()]:
+            color = ROOT.gROOT.GetColor(index)
+            style.append(color.GetAlpha() if color else 1.)
+        return style
+
+    ############################################################################
+    # Private, hash of all inputs of the plot: histograms (binning, contents,
+    # errors, colors), systematics, texts and all parameters of this class
+    def __getRenderKey(self):
+        parts = ["plot", renderCacheVersion]
+        ignore = ["id", "debug", "forceDraw", "drawSkipped", "cloneInputs"]
+        # fill the cache of the shifts first, so the key does not depend on
+        # whether it was filled before
+        sysDeltas = self.__getSysDeltas()
+        for name in sorted(vars(self).keys()):
+            value = getattr(self, name)
+            if name in ignore:
+                continue
+            if self.__isPlainValue(value):
+                parts += [name, value]
+            elif not name.startswith("_Plotter__"):
+                # parameters have to be in the key, otherwise changes are missed
+                print("[Error]: Option %s = %r can not be used in the render cache key." %(name, value))
+                sys.exit(1)
+        hists = [(bkg["name"], bkg["hist"]) for bkg in self.__backgrounds]
+        hists += [(sig["name"], sig["hist"]) for sig in self.__signals]
+        for sig in self.__signals:
+            parts += [sig["name"], sig["color"], sig["linestyle"], sig["linewidth"]]
+        if self.__hasData:
+            hists.append( (self.__data["name"], self.__data["hist"]) )
+        for (name, hist) in hists:
+            parts += [name, getBinEdges(hist), getContents(hist), getErrors(hist), self.__getHistStyle(hist)]
+        if sysDeltas is not None:
+            parts += [self.__sysNuisances, self.__sysSlots, self.__sysnames, sysDeltas[0], sysDeltas[1]]
+        return hashKey(*parts)
+
     ############################################################################
     # Private function to set the binning for current plot
     def __storeBinning(self):
@@ -379,46 +532,39 @@ class Plotter:
     # Private, add up all sys variations and MC stat
     # Use central for up/down if no Systematics are set
     def __getTotalUncertainty(self):
-        for i in range(self.__Nbins):
-            bin = i+1
-            bincenter = self.__bkgtotal.GetXaxis().GetBinCenter(bin)
-            bincontent = self.__bkgtotal.GetBinContent(bin)
-            self.__errorhist.SetPoint(bin, bincenter, bincontent)
-            staterr = self.__bkgtotal.GetBinError(bin)
-            totalErrSquared_up   = pow(staterr, 2)
-            totalErrSquared_down = pow(staterr, 2)
-            # Go through all uncertainties and add up shifts connected to the
-            # same sys but different backgrounds
-            for sys in self.__sysnames:
-                shift_up = 0
-                shift_down = 0
-                for (sysname, bkgname, deltaUp, deltaDown) in self.__sysDeltas:
-                    if sys == sysname:
-                        dup = deltaUp.GetBinContent(bin)
-                        ddown = deltaDown.GetBinContent(bin)
-                        # case where up and down variations are in opposite directions
-                        if dup > 0 and ddown < 0:
-                            shift_up += dup
-                            shift_down += ddown
-                        elif dup < 0 and ddown > 0:
-                            shift_up += ddown
-                            shift_down += dup
-                        elif dup > 0 and ddown > 0:
-                            shift_up += dup if abs(dup) > abs(ddown) else ddown
-                        elif dup < 0 and ddown < 0:
-                            shift_down += dup if abs(dup) > abs(ddown) else ddown
-                totalErrSquared_up += pow(shift_up, 2)
-                totalErrSquared_down += pow(shift_down, 2)
-            # if the total error is 0.0, the plotter does weird stuff, so
-            # set to super small value > 0
-            if totalErrSquared_up < pow(10, -20):
-                totalErrSquared_up = pow(10, -20)
-            if totalErrSquared_down < pow(10, -20):
-                totalErrSquared_down = pow(10, -20)
-            # Get X errors:
-            ex_low = self.__bkgtotal.GetXaxis().GetBinCenter(bin) - self.__bkgtotal.GetXaxis().GetBinLowEdge(bin)
-            ex_up =  self.__bkgtotal.GetXaxis().GetBinUpEdge(bin) - self.__bkgtotal.GetXaxis().GetBinCenter(bin)
-            self.__errorhist.SetPointError(bin, ex_low, ex_up, sqrt(totalErrSquared_down), sqrt(totalErrSquared_up))
+        bins = np.arange(1, self.__Nbins+1)
+        contents = getContents(self.__bkgtotal)[bins]
+        staterr = getErrors(self.__bkgtotal)[bins]
+        totalErrSquared_up   = staterr*staterr
+        totalErrSquared_down = staterr*staterr
+        if self.__getSysDeltas() is not None:
+            # Add up shifts connected to the same sys but different backgrounds,
+            # arrays are (systematic x background x bin)
+            dup = self.__getSysDeltas()[0][:, :, bins]
+            ddown = self.__getSysDeltas()[1][:, :, bins]
+            larger = np.where(np.abs(dup) > np.abs(ddown), dup, ddown)
+            # case where up and down variations are in opposite directions
+            opposite1 = (dup > 0) & (ddown < 0)
+            opposite2 = (dup < 0) & (ddown > 0)
+            bothUp = (dup > 0) & (ddown > 0)
+            bothDown = (dup < 0) & (ddown < 0)
+            shift_up = np.where(opposite1, dup, np.where(opposite2, ddown, np.where(bothUp, larger, 0.))).sum(axis=1)
+            shift_down = np.where(opposite1, ddown, np.where(opposite2, dup, np.where(bothDown, larger, 0.))).sum(axis=1)
+            # every systematic counts once for every time it was added
+            counts = np.array([self.__sysnames.count(name) for name in self.__sysNuisances], dtype=np.float64).reshape(-1, 1)
+            totalErrSquared_up = totalErrSquared_up + np.sum(counts*shift_up*shift_up, axis=0)
+            totalErrSquared_down = totalErrSquared_down + np.sum(counts*shift_down*shift_down, axis=0)
+        # if the total error is 0.0, the plotter does weird stuff, so
+        # set to super small value > 0
+        totalErrSquared_up = np.maximum(totalErrSquared_up, pow(10, -20))
+        totalErrSquared_down = np.maximum(totalErrSquared_down, pow(10, -20))
+        # Get X errors, point 0 is not used
+        centers = getBinCenters(self.__bkgtotal)[0][bins]
+        edges = np.array(getBinEdges(self.__bkgtotal)[0])
+        ex_low = centers-edges[:-1]
+        ex_up = edges[1:]-centers
+        points = [np.concatenate(([0.], values)) for values in [centers, contents, ex_low, ex_up, np.sqrt(totalErrSquared_down), np.sqrt(totalErrSquared_up)]]
+        self.__errorhist = ROOT.TGraphAsymmErrors(self.__Nbins+1, *[arr.array('d', values) for values in points])
     ############################################################################
     # Private, create the ratio plot
     def __getRatio(self, h1, h2, color=None, linestyle=1, linewidth=2):
@@ -707,6 +853,15 @@ class Plotter:
     # It takes care of which objects exist (backgrounds, signals, data) and
     # all cosmetics are steered from here
     def draw(self):
+        self.drawSkipped = False
+        plotname = os.path.join(self.plot_dir, self.plotname+".pdf")
+        if self.__renderCache is not None:
+            key = self.__getRenderKey()
+            entry = self.__renderCache.get(key)
+            if not self.forceDraw and entry is not None and os.path.exists(plotname) and os.path.getsize(plotname) == entry["size"] and os.path.getmtime(plotname) == entry["mtime"]:
+                if self.debug: print("Plot is unchanged, skip drawing")
+                self.drawSkipped = True
+                return
         if self.debug: print("Store binning")
         self.__storeBinning()
         if self.debug: print("Create canvas and pads")
@@ -848,8 +1003,9 @@ class Plotter:
 
         # Save plot
         if self.debug: print("Save plot")
-        plotname = os.path.join(self.plot_dir, self.plotname+".pdf")
         canvas.Print(plotname)
+        if self.__renderCache is not None and os.path.exists(plotname):
+            self.__renderCache.put(key, {"plot": plotname, "size": os.path.getsize(plotname), "mtime": os.path.getmtime(plotname)})
 
 
 ###################################################################
@@ -0,0 +1,50 @@
+"""
+Make the modules importable as MyRootTools.<directory>.<module> without
+installing the package: every <directory>/python of the repository becomes a
+subpackage of MyRootTools. An installed MyRootTools is used if there is one.
+"""
+
+import os
+import sys
+import types
+import numpy as np
+import pytest
+
+try:
+    import MyRootTools
+except ImportError:
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    package = types.ModuleType("MyRootTools")
+    package.__path__ = []
+    sys.modules["MyRootTools"] = package
+    for name in sorted(os.listdir(repository)):
+        directory = os.path.join(repository, name, "python")
+        if not os.path.isdir(directory):
+            continue
+        subpackage = types.ModuleType("MyRootTools."+name)
+        subpackage.__path__ = [directory]
+        sys.modules["MyRootTools."+name] = subpackage
+        setattr(package, name, subpackage)
+
+
+################################################################################
+## Seeded events for the ttbar reconstruction: lepton = (px, py, pz, E),
+## met = (px, py) and jets = (px, py, pz, E) with the jets of all events in
+## flat arrays and njets jets per event. The same seed gives the same events.
+def _makeTTbarEvents(njets, seed=1):
+    r = np.random.RandomState(seed)
+    def vectors(N, ptscale, mass):
+        pt  = r.exponential(ptscale, N)+20.
+        eta = r.uniform(-2.4, 2.4, N)
+        phi = r.uniform(-np.pi, np.pi, N)
+        px, py, pz = pt*np.cos(phi), pt*np.sin(phi), pt*np.sinh(eta)
+        return px, py, pz, np.sqrt(px*px+py*py+pz*pz+mass*mass)
+    lepton = vectors(len(njets), 40., 0.1)
+    met = vectors(len(njets), 50., 0.)[:2]
+    jets = vectors(int(np.sum(njets)), 60., 10.)
+    return lepton, met, jets, np.asarray(njets)
+
+
+@pytest.fixture
+def makeTTbarEvents():
+    return _makeTTbarEvents
@@ -0,0 +1,186 @@
+import sys
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+if sys.version_info[0] > 2:
+    pytest.skip("backgroundABCD is python 2 code", allow_module_level=True)
+
+from MyRootTools.backgroundABCD.backgroundABCD      import BackgroundABCD
+from MyRootTools.backgroundABCD.backgroundABCDBatch import BackgroundABCDBatch
+
+
+def makeHist(name, contents, errors=None):
+    hist = ROOT.TH1D(name, name, len(contents)-2, 0., float(len(contents)-2))
+    for (i, content) in enumerate(contents):
+        hist.SetBinContent(i, content)
+        hist.SetBinError(i, np.sqrt(abs(content)) if errors is None else errors[i])
+    return hist
+
+
+def binContents(hist):
+    return np.array([hist.GetBinContent(i) for i in range(hist.GetSize())])
+
+
+################################################################################
+## Inputs of one distribution for BackgroundABCDBatch, named variations of A
+## and B are random shifts of the nominal contents
+def makeInputs(name, Nbins, seed, variationsA=(), variationsB=()):
+    r = np.random.RandomState(seed)
+    contents = dict([(region, r.uniform(20., 200., Nbins+2)) for region in ["A", "B", "C"]])
+    contents["A"][3] = 0.            # bin without transfer factor
+    inputs = dict([(region, makeHist(name+region, contents[region])) for region in ["A", "B", "C"]])
+    inputs["backgroundsC"] = [makeHist(name+"bkgC", r.uniform(0., 10., Nbins+2))]
+    for (region, variations) in [("A", variationsA), ("B", variationsB)]:
+        inputs["variations"+region] = {}
+        for variation in variations:
+            up = contents[region]*r.uniform(1., 1.2, Nbins+2)
+            down = contents[region]*r.uniform(0.85, 1., Nbins+2)
+            inputs["variations"+region][variation] = (makeHist(name+region+variation+"up", up), makeHist(name+region+variation+"down", down))
+    return inputs
+
+
+def singleABCD(inputs):
+    abcd = BackgroundABCD()
+    abcd.setSampleRegionA(inputs["A"])
+    abcd.setSampleRegionB(inputs["B"])
+    abcd.setSampleRegionC(inputs["C"])
+    for hist in inputs["backgroundsC"]:
+        abcd.addBackgroundRegionC(hist)
+    for (variation, (up, down)) in inputs["variationsA"].items():
+        abcd.addUncertaintyRegionA(up, down, variation)
+    for (variation, (up, down)) in inputs["variationsB"].items():
+        abcd.addUncertaintyRegionB(up, down, variation)
+    return abcd
+
+
+def test_batch_matches_single():
+    inputs = {
+        "mT": makeInputs("mT", 8, 1, ["JES", "PDF"], ["JES"]),
+        "pt": makeInputs("pt", 5, 2, [], ["JES", "lumi"]),
+        "HT": makeInputs("HT", 3, 3),
+    }
+    predictions, breakdown = BackgroundABCDBatch(inputs).getBackgroundPredictions()
+    assert sorted(predictions.keys()) == ["HT", "mT", "pt"]
+    for (name, distribution) in inputs.items():
+        abcd = singleABCD(distribution)
+        for (batch, single) in zip(predictions[name], abcd.getBackgroundPrediction()):
+            assert np.allclose(binContents(batch), binContents(single), rtol=1e-12, atol=1e-12)
+        # same sources with the same uncertainty, variations that do not
+        # exist for this distribution give 0
+        single = abcd.getUncertaintyBreakdown()
+        assert set(single.keys()) <= set(breakdown.keys())
+        for source in breakdown:
+            expected = binContents(single[source]) if source in single else 0.
+            assert np.allclose(binContents(breakdown[source][name]), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_named_variations_are_correlated():
+    # the same relative shift of A and B cancels in the TF if both have the
+    # same name, with different names both shifts add up
+    contents = {"A": np.array([0., 50., 80., 0.]), "B": np.array([0., 10., 40., 0.]), "C": np.array([0., 30., 60., 0.])}
+    def inputs(nameA, nameB):
+        distribution = dict([(region, makeHist(region, values)) for (region, values) in contents.items()])
+        distribution["variationsA"] = {nameA: (makeHist("upA", 1.1*contents["A"]), makeHist("downA", 0.9*contents["A"]))}
+        distribution["variationsB"] = {nameB: (makeHist("upB", 1.1*contents["B"]), makeHist("downB", 0.9*contents["B"]))}
+        return distribution
+    correlated = BackgroundABCDBatch({"x": inputs("JES", "JES"), "y": inputs("JES", "JES")}).getBackgroundPredictions()[1]
+    assert sorted(correlated.keys()) == ["A:stat", "B:stat", "C:stat", "JES"]
+    for name in ["x", "y"]:
+        assert np.allclose(binContents(correlated["JES"][name]), 0., atol=1e-12)
+    uncorrelated = BackgroundABCDBatch({"x": inputs("JES_A", "JES_B")}).getBackgroundPredictions()[1]
+    tf = contents["B"][1:3]/contents["A"][1:3]
+    expectedA = (tf/1.1*0.1+tf/0.9*0.1)/2*contents["C"][1:3]
+    assert np.allclose(binContents(uncorrelated["JES_A"]["x"])[1:3], expectedA, rtol=1e-12)
+    assert np.allclose(binContents(uncorrelated["JES_B"]["x"])[1:3], 0.1*tf*contents["C"][1:3], rtol=1e-12)
+
+
+def test_breakdown_adds_up_to_band():
+    inputs = {
+        "mT": makeInputs("mT", 8, 1, ["JES", "PDF"], ["JES"]),
+        "pt": makeInputs("pt", 5, 2, [], ["lumi"]),
+    }
+    predictions, breakdown = BackgroundABCDBatch(inputs).getBackgroundPredictions()
+    assert sorted(breakdown.keys()) == ["A:stat", "B:stat", "C:stat", "JES", "PDF", "lumi"]
+    for name in inputs:
+        (prediction, up, down) = [binContents(hist) for hist in predictions[name]]
+        total = np.sqrt(sum([binContents(breakdown[source][name])**2 for source in breakdown]))
+        assert np.allclose(up-prediction, total, rtol=1e-12, atol=1e-12)
+        assert np.allclose(prediction-down, total, rtol=1e-12, atol=1e-12)
+        single = singleABCD(inputs[name]).getUncertaintyBreakdown()
+        total = np.sqrt(sum([binContents(hist)**2 for hist in single.values()]))
+        assert np.allclose(up-prediction, total, rtol=1e-12, atol=1e-12)
+
+
+def test_toys_reproducible():
+    inputs = makeInputs("mT", 6, 4, ["JES"], ["JES", "PDF"])
+    results = []
+    for (seed, maxToyEntries) in [(3, 10000000), (3, 2000), (3, 4000), (4, 10000000)]:
+        abcd = singleABCD(inputs)
+        abcd.maxToyEntries = maxToyEntries         # 2000 and 4000: blocks of 1 and 2 bins
+        results.append([binContents(hist) for hist in abcd.getBackgroundPredictionToys(Ntoys=2000, seed=seed)])
+    for result in results[1:3]:
+        assert np.array_equal(result, results[0])
+    assert not np.array_equal(results[3][1], results[0][1])
+    assert np.array_equal(results[3][0], results[0][0])
+
+
+@pytest.mark.parametrize("shiftUp, shiftDown", [(0.1, 0.1), (0.2, 0.05), (0.05, -0.03)])
+def test_breakdown_adds_up_for_variations(shiftUp, shiftDown):
+    # symmetric, asymmetric and one-sided (up and down in the same direction)
+    # variations, named in A and B and without a name
+    contents = dict([(region, np.random.RandomState(i).uniform(20., 200., 8)) for (i, region) in enumerate("ABC")])
+    contents["A"][2] = 0.
+    abcd = BackgroundABCD()
+    abcd.setSampleRegionA(makeHist("A", contents["A"]))
+    abcd.setSampleRegionB(makeHist("B", contents["B"]))
+    abcd.setSampleRegionC(makeHist("C", contents["C"]))
+    for (region, add) in [("A", abcd.addUncertaintyRegionA), ("B", abcd.addUncertaintyRegionB)]:
+        up = makeHist("up", contents[region]*(1.+shiftUp))
+        down = makeHist("down", contents[region]*(1.-shiftDown))
+        add(up, down, "JES")
+        add(makeHist("up2", contents[region]*(1.+2.*shiftUp)), makeHist("down2", contents[region]*(1.-shiftDown)))
+    add(up, down, "PDF")
+    breakdown = abcd.getUncertaintyBreakdown()
+    assert sorted(breakdown.keys()) == ["A:stat", "B:stat", "C:stat", "JES", "PDF", "uncorrelated"]
+    (prediction, up, down) = [binContents(hist) for hist in abcd.getBackgroundPrediction()]
+    total = np.sqrt(sum([binContents(hist)**2 for hist in breakdown.values()]))
+    assert np.allclose(up-prediction, total, rtol=1e-12, atol=1e-12)
+    assert np.allclose(prediction-down, total, rtol=1e-12, atol=1e-12)
+    assert total[2] == 0.
+
+
+def test_transfer_factor_cache_is_reset():
+    abcd = BackgroundABCD()
+    abcd.setSampleRegionA(makeHist("A", [0., 10., 20., 0.]))
+    abcd.setSampleRegionB(makeHist("B", [0., 5., 40., 0.]))
+    abcd.setSampleRegionC(makeHist("C", [0., 2., 3., 0.]))
+    assert np.allclose(binContents(abcd.getTransferFactor()), [0., 0.5, 2., 0.])
+    # a new A or B, and new variations change the cached TF
+    abcd.setSampleRegionB(makeHist("B", [0., 10., 10., 0.]))
+    assert np.allclose(binContents(abcd.getTransferFactor()), [0., 1., 0.5, 0.])
+    abcd.setSampleRegionA(makeHist("A", [0., 20., 20., 0.]))
+    assert np.allclose(binContents(abcd.getTransferFactor()), [0., 0.5, 0.5, 0.])
+    for add in [abcd.addUncertaintyRegionA, abcd.addUncertaintyRegionB]:
+        tf = abcd.getTransferFactor()
+        add(makeHist("up", [0., 30., 30., 0.]), makeHist("down", [0., 10., 10., 0.]))
+        assert abcd.getTransferFactor().GetBinError(1) > tf.GetBinError(1)
+    tf = abcd.getTransferFactor()
+    abcd.addUncertaintyRegionA(makeHist("up", [0., 22., 22., 0.]), makeHist("down", [0., 18., 18., 0.]), "JES")
+    assert abcd.getTransferFactor().GetBinError(1) > tf.GetBinError(1)
+    # C is not part of the TF, a new C changes the prediction only
+    abcd.setSampleRegionC(makeHist("C", [0., 4., 6., 0.]))
+    assert np.allclose(binContents(abcd.getBackgroundPrediction()[0]), [0., 2., 3., 0.])
+
+
+@pytest.mark.parametrize("flow, expected", [("exclude", [0., 1., 0.]), ("fold", [0., 11./4., 0.]), ("include", [2., 1., 4.])])
+def test_flow_one_bin(flow, expected):
+    # one bin with under- and overflow, TF = 1 in the bin, 2 in the underflow
+    # and 4 in the overflow, folded B/A = (2+1+8)/(1+1+2)
+    abcd = BackgroundABCD(flow)
+    abcd.setSampleRegionA(makeHist("A", [1., 1., 2.]))
+    abcd.setSampleRegionB(makeHist("B", [2., 1., 8.]))
+    abcd.setSampleRegionC(makeHist("C", [1., 1., 1.]))
+    assert np.allclose(binContents(abcd.getTransferFactor()), expected)
+    prediction = binContents(abcd.getBackgroundPrediction()[0])
+    assert np.allclose(prediction, np.array(expected)*(3. if flow == "fold" else 1.))
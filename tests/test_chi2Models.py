@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from MyRootTools.ttbarReconstruction.chi2Models     import chi2Model, chi2Normal, chi2TopDiff, getChi2Model, supportsLostJet
+from MyRootTools.ttbarReconstruction.ttbarRecoBatch import ttbarRecoBatch
+
+
+class chi2NoLostJet(chi2Model):
+    def __call__(self, Mtoplep, Mtophad, MWhad):
+        return (Mtoplep-Mtophad)**2
+
+
+def test_supportsLostJet():
+    assert supportsLostJet(chi2Normal())
+    assert supportsLostJet(chi2TopDiff())
+    assert not supportsLostJet(chi2NoLostJet())
+
+
+def test_topdiff_lostJet():
+    model = chi2TopDiff(Mtlep_sigma=16., Mtlep_mean=171., Mthad_lost=(130., 30.))
+    assert model.lostJet(171., 130.) == 0.
+    assert model.lostJet(187., 100.) == pytest.approx(2.)
+    Mtoplep = np.array([150., 171., 200.])
+    Mtophad = np.array([130., 90., 160.])
+    assert np.allclose(model.lostJet(Mtoplep, Mtophad), [model.lostJet(a, b) for (a, b) in zip(Mtoplep, Mtophad)])
+
+
+@pytest.mark.parametrize("mode", ["normal", "topdiff"])
+def test_batch_lostJet(mode, makeTTbarEvents):
+    njets = [3, 4, 3, 5, 2, 3]
+    lepton, met, jets, njets = makeTTbarEvents(njets, 3)
+    batch = ttbarRecoBatch(lepton, met, jets, njets)
+    batch.changeMode(mode)
+    batch.setLostJet()
+    batch.reconstruct()
+    model = getChi2Model(mode)
+    assert list(batch.valid) == [n >= 3 for n in njets]
+    for i in np.flatnonzero(njets == 3):
+        best = batch.best_hypothesis
+        assert best["WhadDecay2"][i] == -1
+        assert best["chi2"][i] == pytest.approx(model.lostJet(best["toplep"][i], best["tophad"][i]), rel=1e-12)
+
+
+@pytest.mark.parametrize("mode", ["normal", "topdiff"])
+def test_batch_lostJet_off(mode, makeTTbarEvents):
+    lepton, met, jets, njets = makeTTbarEvents([3, 4], 3)
+    batch = ttbarRecoBatch(lepton, met, jets, njets)
+    batch.changeMode(mode)
+    batch.reconstruct()
+    assert list(batch.valid) == [False, True]
+
+
+def test_model_without_lostJet_is_rejected(makeTTbarEvents):
+    batch = ttbarRecoBatch(*makeTTbarEvents([3, 4]))
+    batch.changeMode(chi2NoLostJet())
+    with pytest.raises(RuntimeError):
+        batch.setLostJet()
+    batch.changeMode("normal")
+    batch.setLostJet()
+    with pytest.raises(RuntimeError):
+        batch.changeMode(chi2NoLostJet())
+    batch.setLostJet(False)
+    batch.changeMode(chi2NoLostJet())
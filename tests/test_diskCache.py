@@ -0,0 +1,65 @@
+import os
+import numpy as np
+
+from MyRootTools.common.diskCache import DiskCache, hashKey
+
+
+def test_hashKey():
+    a = np.arange(5, dtype=np.float64)
+    assert hashKey(a, "x", [1, 2]) == hashKey(a.copy(), "x", [1, 2])
+    assert hashKey(a) != hashKey(a.astype(np.float32))
+    assert hashKey(a) != hashKey(a.reshape(5, 1))
+    assert hashKey([1, 2], 3) != hashKey([1], 2, 3)
+    assert hashKey(1) != hashKey(1.)
+
+
+def test_get_put(tmpdir):
+    cache = DiskCache(str(tmpdir.join("cache")))
+    assert cache.get("a") is None
+    cache.put("a", {"chi2": 1.5, "parameters": [1., 2.]})
+    assert cache.get("a") == {"chi2": 1.5, "parameters": [1., 2.]}
+    # a second instance (e.g. in another process) sees the same entries
+    assert DiskCache(str(tmpdir.join("cache"))).get("a")["chi2"] == 1.5
+
+
+def test_eviction(tmpdir):
+    value = "x"*1000
+    cache = DiskCache(str(tmpdir), maxBytes=3500)
+    for (i, key) in enumerate(["a", "b", "c"]):
+        cache.put(key, value)
+        os.utime(os.path.join(str(tmpdir), key+".pkl"), (1000+i, 1000+i))
+    # "a" is used, so "b" is the least recently used entry
+    assert cache.get("a") == value
+    cache.put("d", value)
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in ["a", "c", "d"]] == [value]*3
+    assert cache.size() <= 3500
+
+
+def test_clear(tmpdir):
+    cache = DiskCache(str(tmpdir))
+    for key in ["a", "b", "c"]:
+        cache.put(key, key)
+    cache.clear("b")
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    cache.clear()
+    assert cache.size() == 0
+    assert [cache.get(key) for key in ["a", "c"]] == [None, None]
+    cache.clear("missing")
+
+
+def test_size_limit(tmpdir, monkeypatch):
+    cache = DiskCache(str(tmpdir), maxBytes=20000)
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listed.append(path) or listdir(path))
+    for i in range(200):
+        cache.put("key%i" %(i), np.arange(i%50, dtype=np.float64))
+        assert cache.size() <= 20000
+        assert cache.size() == sum([os.path.getsize(os.path.join(str(tmpdir), name)) for name in listdir(str(tmpdir))])
+    # the directory is only listed before an eviction, not on every put
+    assert 0 < len(listed) < 50
+    assert cache.get("key199") is not None
+    # a new instance finds the same entries
+    assert DiskCache(str(tmpdir), maxBytes=20000).size() == cache.size()
@@ -0,0 +1,98 @@
+import math
+import sys
+import numpy as np
+import pytest
+
+from MyRootTools.common.formulaArrays import translateFormula, compileFormula
+
+
+@pytest.mark.parametrize("formula, expression", [
+    ("[0]+[1]*x^2+1/2*x",         "p[0]+p[1]*x**2.0+1.0/2.0*x"),
+    ("[0]*exp([1]*x)",            "p[0]*np.exp(p[1]*x)"),
+    ("TMath::Exp(-x)*TMath::Pi()", "np.exp(-x)*np.pi"),
+    ("x*y*z+[1]",                 "x*y*z+p[1]"),
+    ("1e-3*x",                    "0.001*x"),
+])
+def test_translate(formula, expression):
+    assert translateFormula(formula) == expression
+
+
+@pytest.mark.parametrize("formula", ["gaus", "pol2", "[0]*gaus(0)", "[p0]*x", "x>1", "exp"])
+def test_unsupported(formula):
+    assert translateFormula(formula) is None
+    assert compileFormula(formula) is None
+
+
+def test_values():
+    x = np.array([0.5, 1., 2., 4.])
+    cases = [
+        ("[0]+[1]*x^2+1/2*x", [1., 2.],  lambda p, x: p[0]+p[1]*x**2+0.5*x),
+        ("[0]*exp([1]*x)",    [3., -.5], lambda p, x: p[0]*math.exp(p[1]*x)),
+        ("[0]*pow(x,[1])",    [2., 1.5], lambda p, x: p[0]*x**p[1]),
+        ("sqrt(x)+log(x)",    [],        lambda p, x: math.sqrt(x)+math.log(x)),
+        ("[0]*erf(x-[1])",    [2., 1.],  lambda p, x: p[0]*math.erf(x-p[1])),
+    ]
+    for (formula, parameters, function) in cases:
+        values = compileFormula(formula)(parameters, x)
+        assert values.shape == x.shape
+        assert np.allclose(values, [function(parameters, v) for v in x], rtol=1e-14, atol=0.)
+
+
+def test_constant_and_2d():
+    x = np.array([1., 2., 3.])
+    y = np.array([2., 0., -1.])
+    assert np.array_equal(compileFormula("[0]")([4.], x), [4., 4., 4.])
+    assert np.allclose(compileFormula("[0]*x+[1]*y^2")([2., 3.], x, y), 2.*x+3.*y**2)
+
+
+def test_parameter_samples():
+    # parameters with shape (Nsamples, 1) give values with shape (Nsamples, Nbins)
+    x = np.linspace(0., 1., 5)
+    samples = np.array([[1., 2.], [3., 4.], [5., 6.]])
+    values = compileFormula("[0]+[1]*x")([p.reshape(-1, 1) for p in samples.T], x)
+    assert values.shape == (3, 5)
+    for (i, (p0, p1)) in enumerate(samples):
+        assert np.allclose(values[i], p0+p1*x)
+
+
+@pytest.mark.parametrize("formula", ["[0]*exp([1]*x)+[2]", "[0]+[1]*x^2+[2]*sqrt(x)", "[0]*TMath::Erf((x-[1])/[2])"])
+def test_parameter_samples_match_TF1(formula):
+    ROOT = pytest.importorskip("ROOT")
+    x = np.linspace(0.5, 4., 8)
+    samples = np.random.RandomState(2).normal([1., -0.5, 2.], 0.1, (20, 3))
+    values = compileFormula(formula)([p.reshape(-1, 1) for p in samples.T], x)
+    assert values.shape == (20, 8)
+    function = ROOT.TF1("function", formula, 0., 5.)
+    for (i, parameters) in enumerate(samples):
+        for (j, parameter) in enumerate(parameters):
+            function.SetParameter(j, parameter)
+        assert np.allclose(values[i], [function.Eval(v) for v in x], rtol=1e-12, atol=1e-14)
+
+
+def test_fallback_to_TF1():
+    # pol1 can not be translated and is evaluated with TF1.Eval, the
+    # prediction and the sampled fit uncertainty are the same as for the
+    # translated [0]+[1]*x
+    ROOT = pytest.importorskip("ROOT")
+    if sys.version_info[0] > 2:
+        pytest.skip("backgroundAlpha is python 2 code")
+    from MyRootTools.backgroundAlpha.backgroundAlpha import backgroundAlpha
+    def hist(name, contents):
+        h = ROOT.TH1D(name, name, len(contents), 0., float(len(contents)))
+        for (i, content) in enumerate(contents):
+            h.SetBinContent(i+1, content)
+            h.SetBinError(i+1, math.sqrt(content))
+        return h
+    predictions = []
+    for formula in ["[0]+[1]*x", "pol1"]:
+        assert (compileFormula(formula) is None) == (formula == "pol1")
+        alpha = backgroundAlpha()
+        alpha.setDataCR(hist("data", [50., 60., 55., 70., 65., 80.]))
+        alpha.setMCCR(hist("mcCR", [100., 110., 120., 125., 140., 150.]))
+        alpha.setMCSR(hist("mcSR", [200., 190., 185., 170., 165., 150.]))
+        alpha.setFitFormula(formula)
+        alpha.setNumberOfProcesses(1)
+        alpha.setParameterSampling(200, seed=3)
+        prediction = alpha.getPrediction()
+        predictions.append([(prediction.GetBinContent(i), prediction.GetBinError(i)) for i in range(1, 7)])
+    assert np.allclose(predictions[0], predictions[1], rtol=1e-6)
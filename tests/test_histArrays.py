@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+
+from MyRootTools.common.histArrays       import applyFlow, flowMask
+
+
+def test_flowMask():
+    assert list(flowMask((4,))) == [True, False, False, True]
+    assert list(flowMask((3,))) == [True, False, True]
+    mask = flowMask((3, 4)).reshape(3, 4)
+    assert np.array_equal(mask, [[True]*4, [True, False, False, True], [True]*4])
+
+
+@pytest.mark.parametrize("shape", [(5,), (3,), (3, 4), (4, 3, 3)])
+def test_fold_and_exclude(shape):
+    values = np.random.RandomState(1).uniform(1., 2., np.prod(shape))
+    inner = ~flowMask(shape)
+    excluded = applyFlow(values, shape, "exclude")
+    assert np.array_equal(excluded[inner], values[inner])
+    assert np.all(excluded[~inner] == 0.)
+    folded = applyFlow(values, shape, "fold")
+    assert np.all(folded[~inner] == 0.)
+    assert folded.sum() == pytest.approx(values.sum(), rel=1e-14)
+    errors = applyFlow(values, shape, "fold", quadrature=True)
+    assert np.sum(errors*errors) == pytest.approx(np.sum(values*values), rel=1e-14)
+    assert np.array_equal(applyFlow(values, shape, "include"), values)
+
+
+def test_fold_one_bin():
+    # with one bin under- and overflow both go into the same bin
+    assert np.array_equal(applyFlow([1., 2., 4.], (3,), "fold"), [0., 7., 0.])
+    assert np.allclose(applyFlow([1., 2., 2.], (3,), "fold", quadrature=True), [0., 3., 0.])
+    folded = applyFlow(np.arange(12.), (3, 4), "fold").reshape(3, 4)
+    assert np.array_equal(folded[1], [0., np.arange(12.).reshape(3, 4)[:, :2].sum(), np.arange(12.).reshape(3, 4)[:, 2:].sum(), 0.])
+
+
+def test_unknown_flow():
+    with pytest.raises(RuntimeError):
+        applyFlow([1., 2., 3.], (3,), "ignore")
@@ -0,0 +1,49 @@
+import numpy as np
+
+from MyRootTools.ttbarReconstruction.neutrinoSolver import solveNeutrinoPz
+
+
+def wMass(lepton, met, pz):
+    energy = lepton[3]+np.sqrt(met[0]**2+met[1]**2+pz**2)
+    px, py, pz = lepton[0]+met[0], lepton[1]+met[1], lepton[2]+pz
+    return np.sqrt(energy**2-px**2-py**2-pz**2)
+
+
+def test_real_solutions():
+    # lepton (px, py, pz, E) with mass 0, MET in the same direction
+    lepton = (30., 20., 40., np.sqrt(30.**2+20.**2+40.**2))
+    met = (25., 10.)
+    pz1, pz2, isComplex, pzFirst, pzSecond = solveNeutrinoPz(*(lepton+met))
+    assert not isComplex
+    assert pz1 != pz2
+    assert np.allclose([wMass(lepton, met, pz1), wMass(lepton, met, pz2)], 80.399, rtol=1e-10)
+    # the first solution has the larger neutrino energy
+    assert abs(pzFirst) > abs(pzSecond)
+    assert sorted([pzFirst, pzSecond]) == sorted([pz1, pz2])
+
+
+def test_complex_solution():
+    # lepton and MET back to back with a transverse mass above the W mass
+    lepton = (60., 0., 10., np.sqrt(60.**2+10.**2))
+    met = (-70., 0.)
+    pz1, pz2, isComplex, pzFirst, pzSecond = solveNeutrinoPz(*(lepton+met))
+    assert isComplex
+    # only the real part is kept, both solutions are identical
+    assert pz1 == pz2 == pzFirst == pzSecond
+    A = -(lepton[0]**2+lepton[1]**2)
+    B = (80.399**2/2+lepton[0]*met[0]+lepton[1]*met[1])*lepton[2]
+    assert np.isclose(pz1, -B/A, rtol=1e-12)
+
+
+def test_arrays_match_single_events():
+    r = np.random.RandomState(3)
+    N = 200
+    lepton = [r.normal(0., 50., N), r.normal(0., 50., N), r.normal(0., 80., N)]
+    lepton.append(np.sqrt(lepton[0]**2+lepton[1]**2+lepton[2]**2))
+    met = [r.normal(0., 60., N), r.normal(0., 60., N)]
+    arrays = solveNeutrinoPz(*(lepton+met))
+    assert 0 < np.sum(arrays[2]) < N            # real and complex events
+    for i in range(N):
+        single = solveNeutrinoPz(*[x[i] for x in lepton+met])
+        for (array, value) in zip(arrays, single):
+            assert array[i] == value
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+
+from MyRootTools.plotter.Plotter         import Plotter
+from MyRootTools.plotter.PlotBatch       import PlotBatch
+from MyRootTools.common.histArrays       import getContents, getErrors
+
+
+def makeHist(name, contents):
+    hist = ROOT.TH1D(name, name, len(contents)-2, 0., float(len(contents)-2))
+    for (i, content) in enumerate(contents):
+        hist.SetBinContent(i, content)
+        hist.SetBinError(i, np.sqrt(content))
+    return hist
+
+
+################################################################################
+## Shared inputs and two plots that use them with different options
+def makeSpecs():
+    r = np.random.RandomState(7)
+    inputs = dict([(name, makeHist(name, r.uniform(20., 100., 10))) for name in ["ttbar", "wjets", "data", "up", "down"]])
+    signal = makeHist("signal", r.uniform(1., 10., 10))
+    specs = [
+        {"name": "plain",
+         "backgrounds": [("ttbar", "t#bar{t}", ROOT.kAzure), ("wjets", "W+jets", ROOT.kRed)],
+         "data": "data",
+         "systematics": [("up", "down", "JES", "t#bar{t}")],
+         "normSystematics": [("W+jets", 0.1)]},
+        {"name": "rebinned",
+         "options": {"rebin": 2, "divideByWidth": True, "drawRatio": True},
+         "backgrounds": [("ttbar", "t#bar{t}", ROOT.kAzure)],
+         "signals": [(signal, "Signal", ROOT.kRed, 2)],
+         "data": ("data", "Data 2018"),
+         "systematics": [("up", "down", "JES", "t#bar{t}")],
+         "texts": [(0.2, 0.8, "SR")]},
+    ]
+    return inputs, specs
+
+
+def makePlotter(spec, inputs, plot_dir):
+    plotter = Plotter(spec["name"], setStyle=False)
+    plotter.plot_dir = plot_dir
+    for (option, value) in spec.get("options", {}).items():
+        setattr(plotter, option, value)
+    resolve = lambda hist: inputs[hist] if isinstance(hist, str) else hist
+    for background in spec.get("backgrounds", []):
+        plotter.addBackground(resolve(background[0]), *background[1:])
+    for signal in spec.get("signals", []):
+        plotter.addSignal(resolve(signal[0]), *signal[1:])
+    data = spec["data"] if isinstance(spec["data"], tuple) else (spec["data"],)
+    plotter.addData(resolve(data[0]), *data[1:])
+    for systematic in spec.get("systematics", []):
+        plotter.addSystematic(resolve(systematic[0]), resolve(systematic[1]), *systematic[2:])
+    for normSystematic in spec.get("normSystematics", []):
+        plotter.addNormSystematic(*normSystematic)
+    for text in spec.get("texts", []):
+        plotter.addText(*text)
+    return plotter
+
+
+################################################################################
+## Everything a drawn plot depends on: the render key (contents, errors and
+## styles of all histograms, systematics and options) and the total band
+def snapshot(plotter):
+    band = plotter.getTotalSystematic()
+    N = band.GetN()
+    return (plotter._Plotter__getRenderKey(),
+            [getContents(bkg["hist"]).tolist()+getErrors(bkg["hist"]).tolist() for bkg in plotter._Plotter__backgrounds],
+            [band.GetY()[i] for i in range(N)],
+            [band.GetErrorYhigh(i) for i in range(N)],
+            [band.GetErrorYlow(i) for i in range(N)])
+
+
+def test_batch_matches_plotter(tmpdir, monkeypatch):
+    snapshots = {}
+    draw = Plotter.draw
+    def recordDraw(plotter):
+        draw(plotter)
+        snapshots[plotter.plotname] = snapshot(plotter)
+    monkeypatch.setattr(Plotter, "draw", recordDraw)
+
+    inputs, specs = makeSpecs()
+    batch = PlotBatch(inputs, defaults={"plot_dir": str(tmpdir)})
+    batch.verbose = False
+    batch.addPlots(specs)
+    batch.run()
+    fromBatch = dict(snapshots)
+    snapshots.clear()
+    for spec in specs:
+        makePlotter(spec, inputs, str(tmpdir)).draw()
+    assert sorted(fromBatch.keys()) == ["plain", "rebinned"]
+    for name in fromBatch:
+        assert fromBatch[name] == snapshots[name]
+    # the shared inputs are not changed by the plots
+    assert getContents(inputs["ttbar"]).tolist() == getContents(makeSpecs()[0]["ttbar"]).tolist()
+
+
+def test_parallel_batch_matches_plotter(tmpdir):
+    # plots drawn by the workers are found in the render cache by plotters
+    # with the same inputs, so they have the same render key
+    inputs, specs = makeSpecs()
+    batch = PlotBatch(inputs, defaults={"plot_dir": str(tmpdir)})
+    batch.verbose = False
+    batch.setRenderCache(str(tmpdir.join("cache")))
+    batch.addPlots(specs)
+    assert [timing["skipped"] for timing in batch.run(nprocesses=2)] == [False, False]
+    for spec in specs:
+        plotter = makePlotter(spec, inputs, str(tmpdir))
+        plotter.setRenderCache(str(tmpdir.join("cache")))
+        plotter.draw()
+        assert plotter.drawSkipped
@@ -0,0 +1,211 @@
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+
+from MyRootTools.plotter.Plotter import Plotter
+
+
+def makeHist(name, contents, errors=None):
+    hist = ROOT.TH1D(name, name, len(contents)-2, 0., float(len(contents)-2))
+    for (i, content) in enumerate(contents):
+        hist.SetBinContent(i, content)
+        hist.SetBinError(i, np.sqrt(abs(content)) if errors is None else errors[i])
+    return hist
+
+
+################################################################################
+## Total uncertainty computed bin by bin as in the original loop of the
+## Plotter, sysDeltas are (sysname, up-central, down-central) for every call
+## of addSystematic
+def referenceUncertainty(total, sysnames, sysDeltas):
+    up, down = [], []
+    for bin in range(1, total.GetNbinsX()+1):
+        up2 = down2 = total.GetBinError(bin)**2
+        for sys in sysnames:
+            shift_up = 0
+            shift_down = 0
+            for (sysname, deltaUp, deltaDown) in sysDeltas:
+                if sys == sysname:
+                    dup = deltaUp[bin]
+                    ddown = deltaDown[bin]
+                    if dup > 0 and ddown < 0:
+                        shift_up += dup
+                        shift_down += ddown
+                    elif dup < 0 and ddown > 0:
+                        shift_up += ddown
+                        shift_down += dup
+                    elif dup > 0 and ddown > 0:
+                        shift_up += dup if abs(dup) > abs(ddown) else ddown
+                    elif dup < 0 and ddown < 0:
+                        shift_down += dup if abs(dup) > abs(ddown) else ddown
+            up2 += shift_up**2
+            down2 += shift_down**2
+        up.append(np.sqrt(max(up2, 1e-20)))
+        down.append(np.sqrt(max(down2, 1e-20)))
+    return np.array(up), np.array(down)
+
+
+################################################################################
+## Plotter with two backgrounds and systematics that cover all cases: shifts
+## in opposite and the same direction, one systematic for both backgrounds,
+## one systematic added twice to the same background and a zero shift
+def makePlotter(cloneInputs=True, Nbins=12, seed=4):
+    r = np.random.RandomState(seed)
+    plotter = Plotter("test", setStyle=False)
+    plotter.cloneInputs = cloneInputs
+    backgrounds = {}
+    for name in ["ttbar", "wjets"]:
+        backgrounds[name] = r.uniform(50., 150., Nbins+2)
+        plotter.addBackground(makeHist(name, backgrounds[name]), name, ROOT.kAzure)
+    sysDeltas = []
+    for (sysname, bkgname) in [("JES", "ttbar"), ("JES", "wjets"), ("PDF", "ttbar"), ("PDF", "ttbar"), ("lumi", "wjets")]:
+        deltaUp = r.normal(0., 10., Nbins+2)
+        deltaDown = r.normal(0., 10., Nbins+2)
+        deltaDown[3] = 0.
+        if sysname == "lumi":
+            deltaUp[:] = deltaDown[:] = 0.
+        central = backgrounds[bkgname]
+        plotter.addSystematic(makeHist("up", central+deltaUp), makeHist("down", central+deltaDown), sysname, bkgname)
+        sysDeltas.append( (sysname, deltaUp, deltaDown) )
+    return plotter, sysDeltas
+
+
+def totalUncertainty(plotter):
+    plotter._Plotter__storeBinning()
+    total = plotter._Plotter__backgrounds[0]["hist"].Clone("total")
+    for bkg in plotter._Plotter__backgrounds[1:]:
+        total.Add(bkg["hist"])
+    plotter._Plotter__bkgtotal = total
+    plotter._Plotter__getTotalUncertainty()
+    graph = plotter.getTotalSystematic()
+    Nbins = total.GetNbinsX()
+    up = np.array([graph.GetErrorYhigh(i) for i in range(1, Nbins+1)])
+    down = np.array([graph.GetErrorYlow(i) for i in range(1, Nbins+1)])
+    y = np.array([graph.GetY()[i] for i in range(1, Nbins+1)])
+    return total, y, up, down
+
+
+def test_total_uncertainty_matches_loop():
+    plotter, sysDeltas = makePlotter()
+    total, y, up, down = totalUncertainty(plotter)
+    sysnames = [sysname for (sysname, deltaUp, deltaDown) in sysDeltas]
+    refUp, refDown = referenceUncertainty(total, sysnames, sysDeltas)
+    assert np.allclose(y, [total.GetBinContent(i) for i in range(1, total.GetNbinsX()+1)], rtol=1e-14)
+    assert np.allclose(up, refUp, rtol=1e-12)
+    assert np.allclose(down, refDown, rtol=1e-12)
+
+
+def test_total_uncertainty_without_systematics():
+    plotter = Plotter("test", setStyle=False)
+    plotter.addBackground(makeHist("bkg", [0., 4., 0., 9., 0.], [0., 2., 0., 3., 0.]), "bkg", ROOT.kAzure)
+    total, y, up, down = totalUncertainty(plotter)
+    assert np.allclose(up, [2., 1e-10, 3.])
+    assert np.allclose(down, [2., 1e-10, 3.])
+
+
+def test_cloneInputs_false_gives_same_band():
+    plotter, sysDeltas = makePlotter(cloneInputs=True)
+    band = totalUncertainty(plotter)[1:]
+    plotter, sysDeltas = makePlotter(cloneInputs=False)
+    assert np.array_equal(band, totalUncertainty(plotter)[1:])
+
+
+def test_inputs_are_cloned_or_used():
+    contents = [0., 4., 8., 0.]
+    for cloneInputs in [True, False]:
+        plotter = Plotter("test", setStyle=False)
+        plotter.cloneInputs = cloneInputs
+        plotter.divideByWidth = True
+        hist = ROOT.TH1D("bkg", "bkg", 2, np.array([0., 1., 3.]))
+        for (i, content) in enumerate(contents):
+            hist.SetBinContent(i, content)
+        plotter.addBackground(hist, "bkg", ROOT.kAzure)
+        assert (plotter._Plotter__backgrounds[0]["hist"] is hist) != cloneInputs
+        assert hist.GetBinContent(2) == (8. if cloneInputs else 4.)
+
+
+def test_norm_systematic():
+    for divideByWidth in [False, True]:
+        plotter = Plotter("test", setStyle=False)
+        plotter.divideByWidth = divideByWidth
+        hist = ROOT.TH1D("bkg", "bkg", 3, np.array([0., 1., 3., 7.]))
+        for (i, content) in enumerate([0., 10., 20., 40., 0.]):
+            hist.SetBinContent(i, content)
+            hist.SetBinError(i, 0.)
+        plotter.addBackground(hist, "bkg", ROOT.kAzure)
+        plotter.addNormSystematic("bkg", 0.1)
+        total, y, up, down = totalUncertainty(plotter)
+        expected = np.array([10., 10., 10.]) if divideByWidth else np.array([10., 20., 40.])
+        assert np.allclose(y, expected)
+        assert np.allclose(up, 0.1*expected)
+        assert np.allclose(down, 0.1*expected)
+
+
+################################################################################
+## Render cache: draw a plotter into tmpdir and return whether it was skipped
+def drawCached(plotter, tmpdir):
+    plotter.plot_dir = str(tmpdir)
+    plotter.setRenderCache(str(tmpdir.join("cache")))
+    plotter.draw()
+    return plotter.drawSkipped
+
+
+def test_render_cache_hit(tmpdir):
+    assert not drawCached(makePlotter()[0], tmpdir)
+    plot = tmpdir.join("test.pdf")
+    (content, mtime) = (plot.read(), plot.mtime())
+    assert drawCached(makePlotter()[0], tmpdir)
+    assert (plot.read(), plot.mtime()) == (content, mtime)
+    # the plot is drawn again if it is forced or the file was changed
+    plotter = makePlotter()[0]
+    plotter.forceDraw = True
+    assert not drawCached(plotter, tmpdir)
+    plot.write("changed")
+    assert not drawCached(makePlotter()[0], tmpdir)
+    assert drawCached(makePlotter()[0], tmpdir)
+
+
+def test_render_cache_miss(tmpdir):
+    assert not drawCached(makePlotter()[0], tmpdir)
+    def changedStyle():
+        plotter = makePlotter()[0]
+        plotter._Plotter__backgrounds[1]["hist"].SetLineStyle(2)
+        return plotter
+    def changedSystematic():
+        plotter = makePlotter()[0]
+        plotter.addNormSystematic("wjets", 0.1)
+        return plotter
+    def changedOption(option, value):
+        plotter = makePlotter()[0]
+        setattr(plotter, option, value)
+        return plotter
+    changes = [
+        makePlotter(seed=5)[0],                     # other contents
+        changedStyle(),
+        changedSystematic(),
+        changedOption("divideByWidth", True),
+        changedOption("xtitle", "m_{T}"),
+    ]
+    for plotter in changes:
+        assert not drawCached(plotter, tmpdir)
+    # the last plot is in the cache, the first one was overwritten
+    assert drawCached(changedOption("xtitle", "m_{T}"), tmpdir)
+    assert not drawCached(makePlotter()[0], tmpdir)
+
+
+def test_render_cache_cloneInputs(tmpdir):
+    # cloneInputs does not change the plot, so it is not part of the key,
+    # but the changes of the inputs it causes are (e.g. divideByWidth)
+    assert not drawCached(makePlotter(cloneInputs=True)[0], tmpdir)
+    assert drawCached(makePlotter(cloneInputs=False)[0], tmpdir)
+    plotter = makePlotter(cloneInputs=False)[0]
+    key = plotter._Plotter__getRenderKey()
+    plotter.cloneInputs = True
+    assert plotter._Plotter__getRenderKey() == key
+    skipped = []
+    for cloneInputs in [True, False]:
+        plotter = makePlotter(cloneInputs=cloneInputs)[0]
+        plotter.divideByWidth = True
+        skipped.append(drawCached(plotter, tmpdir))
+    assert skipped == [False, True]
@@ -0,0 +1,60 @@
+import sys
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+if sys.version_info[0] > 2:
+    pytest.skip("ttbarReco is python 2 code", allow_module_level=True)
+
+from MyRootTools.ttbarReconstruction.ttbarReco      import ttbarReco
+from MyRootTools.ttbarReconstruction.ttbarRecoBatch import ttbarRecoBatch
+
+
+def reconstructPerEvent(lepton, met, jets, njets, mode, lostJet=False):
+    results = []
+    offset = 0
+    for i in range(len(njets)):
+        lep = ROOT.TLorentzVector(lepton[0][i], lepton[1][i], lepton[2][i], lepton[3][i])
+        mis = ROOT.TLorentzVector(met[0][i], met[1][i], 0., np.hypot(met[0][i], met[1][i]))
+        js = [ROOT.TLorentzVector(*[float(x[offset+j]) for x in jets]) for j in range(njets[i])]
+        offset += njets[i]
+        reco = ttbarReco(lep, mis, js, exitOnFailure=False)
+        reco.changeMode(mode)
+        reco.setLostJet(lostJet)
+        reco.reconstruct()
+        results.append(reco)
+    return results
+
+
+@pytest.mark.parametrize("lostJet", [False, True])
+@pytest.mark.parametrize("mode", ["normal", "topdiff"])
+def test_batch_matches_per_event(mode, lostJet, makeTTbarEvents):
+    njets = [4, 5, 6, 3, 7, 4, 5, 2, 6, 4]*3
+    lepton, met, jets, njets = makeTTbarEvents(njets)
+    batch = ttbarRecoBatch(lepton, met, jets, njets)
+    batch.changeMode(mode)
+    batch.setLostJet(lostJet)
+    batch.maxHypotheses = 500        # several chunks per jet multiplicity
+    batch.reconstruct()
+    single = reconstructPerEvent(lepton, met, jets, njets, mode, lostJet)
+
+    assert list(batch.valid) == [reco.valid for reco in single]
+    offsets = np.cumsum(njets)-njets
+    for (i, reco) in enumerate(single):
+        if not reco.valid:
+            assert np.isnan(batch.best_hypothesis["chi2"][i]) and np.isnan(reco.best_chi2)
+            assert np.isnan(batch.minimax[i]) and np.isnan(reco.minimax)
+            assert batch.best_hypothesis["blep"][i] == -1
+            continue
+        best = reco.best_hypothesis
+        assert reco.best_chi2 == best["chi2"]
+        assert batch.best_hypothesis["chi2"][i] == pytest.approx(best["chi2"], rel=1e-12)
+        assert batch.minimax[i] == pytest.approx(reco.minimax, rel=1e-12)
+        assert batch.best_hypothesis["toplep"][i] == pytest.approx(best["toplep"].M(), rel=1e-9)
+        assert batch.best_hypothesis["tophad"][i] == pytest.approx(best["tophad"].M(), rel=1e-9)
+        for name in ["blep", "bhad", "WhadDecay1", "WhadDecay2"]:
+            if best[name] is None:
+                assert lostJet and njets[i] == 3 and batch.best_hypothesis[name][i] == -1
+                continue
+            jet = offsets[i]+batch.best_hypothesis[name][i]
+            assert (jets[0][jet], jets[2][jet]) == (best[name].Px(), best[name].Pz())
@@ -0,0 +1,64 @@
+import sys
+import numpy as np
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+if sys.version_info[0] > 2:
+    pytest.skip("ttbarReco is python 2 code", allow_module_level=True)
+
+from MyRootTools.ttbarReconstruction.ttbarReco import ttbarReco
+
+
+################################################################################
+## One event with Njets jets as TLorentzVectors, with duplicates = True the
+## last jets are copies of the first ones, so there are hypotheses with
+## exactly the same chi2
+def makeEvent(makeTTbarEvents, Njets, seed, duplicates=False):
+    (lepton, met, jets, njets) = makeTTbarEvents([Njets], seed)
+    jets = [[float(x[j]) for x in jets] for j in range(Njets)]
+    if duplicates:
+        jets = jets[:Njets//2] + jets[:Njets-Njets//2]
+    lepton = ROOT.TLorentzVector(*[float(x[0]) for x in lepton])
+    met = ROOT.TLorentzVector(float(met[0][0]), float(met[1][0]), 0., float(np.hypot(met[0][0], met[1][0])))
+    return lepton, met, [ROOT.TLorentzVector(*jet) for jet in jets]
+
+
+def reconstruct(event, mode, **options):
+    reco = ttbarReco(*event)
+    reco.changeMode(mode)
+    reco.reconstruct(**options)
+    return reco
+
+
+def sameHypothesis(h1, h2):
+    names = ["blep", "bhad", "WhadDecay1", "WhadDecay2"]
+    return h1["chi2"] == h2["chi2"] and h1["neutrino"].Pz() == h2["neutrino"].Pz() and all([h1[name] is h2[name] for name in names])
+
+
+@pytest.mark.parametrize("mode", ["normal", "topdiff"])
+@pytest.mark.parametrize("duplicates", [False, True])
+def test_pruned_matches_exhaustive(mode, duplicates, makeTTbarEvents):
+    for Njets in [4, 5, 6, 7, 8]:
+        for seed in range(5):
+            event = makeEvent(makeTTbarEvents, Njets, seed, duplicates)
+            exhaustive = reconstruct(event, mode)
+            pruned = reconstruct(event, mode, search="pruned")
+            assert pruned.minimax == exhaustive.minimax
+            assert sameHypothesis(pruned.best_hypothesis, exhaustive.best_hypothesis)
+
+
+@pytest.mark.parametrize("duplicates", [False, True])
+def test_pruned_topk_matches_exhaustive_ranking(duplicates, makeTTbarEvents):
+    k = 10
+    for Njets in [4, 6, 8]:
+        event = makeEvent(makeTTbarEvents, Njets, 12, duplicates)
+        exhaustive = reconstruct(event, "normal", lazy=True)
+        pruned = reconstruct(event, "normal", search="pruned", k=k)
+        # exhaustive ranking, ties in the order of the exhaustive search
+        order = np.argsort(exhaustive.all_hypotheses.chi2, kind="mergesort")[:k]
+        if duplicates:
+            chi2 = exhaustive.all_hypotheses.chi2
+            assert len(np.unique(chi2[order])) < k
+        assert len(pruned.top_hypotheses) == k
+        for (hypothesis, i) in zip(pruned.top_hypotheses, order):
+            assert sameHypothesis(hypothesis, exhaustive.all_hypotheses[i])
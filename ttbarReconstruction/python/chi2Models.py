@@ -0,0 +1,136 @@
+"""
+Chi2 models for the ttbar reconstruction.
+A model scores hypotheses from the masses of the leptonic top, the hadronic
+top and the hadronic W. Only arithmetic operators are used, so the same model
+works on single numbers (ttbarReco) and on whole arrays of masses
+(ttbarRecoBatch). All constants are computed once when the model is created.
+
+User-defined models derive from chi2Model and implement __call__. The bound
+functions are used to skip hypotheses in the pruned search and have to be
+lower bounds of the chi2, the default of 0 disables the pruning.
+Models that support events with a lost jet (only 3 jets, one W decay jet
+missing) also implement lostJet.
+"""
+
+from math                                import sqrt
+
+
+def _squaredPull(value, mean, sigma):
+    pull = (value-mean)/sigma
+    return pull*pull
+
+
+class chi2Model:
+    def __init__(self, b_disc=(1.0, 0.4)):
+        (self.b_disc_mean, self.b_disc_sigma) = b_disc
+
+    def __call__(self, Mtoplep, Mtophad, MWhad):
+        raise NotImplementedError("A chi2 model has to implement __call__(Mtoplep, Mtophad, MWhad)")
+
+    # chi2 for a lost jet hypothesis, Mtophad is the mass of bhad+Wdecay1
+    def lostJet(self, Mtoplep, Mtophad):
+        raise NotImplementedError("This chi2 model does not support lost jet hypotheses")
+
+    # Term for the b-tag score of blep or bhad
+    def bdiscTerm(self, bdisc):
+        return _squaredPull(bdisc, self.b_disc_mean, self.b_disc_sigma)
+
+    # Lower bound of the chi2 from the hadronic W only
+    def boundWhad(self, MWhad):
+        return 0.
+
+    # Lower bound of the chi2 from the hadronic top and W
+    def boundHadronic(self, Mtophad, MWhad):
+        return 0.
+
+    # Lower bound of the chi2 from the leptonic top only
+    def boundLeptonic(self, Mtoplep):
+        return 0.
+
+
+################################################################################
+## chi2 = toplep + tophad + Whad mass terms
+## For a lost jet: toplep + partially reconstructed tophad (bhad+Wdecay1)
+class chi2Normal(chi2Model):
+    def __init__(self, Mtlep=(171., 16.), Mthad=(171., 17.), MWhad=(83., 11.), b_disc=(1.0, 0.4), Mthad_lost=(130., 30.)):
+        chi2Model.__init__(self, b_disc)
+        (self.Mtlep_mean, self.Mtlep_sigma) = Mtlep
+        (self.Mthad_mean, self.Mthad_sigma) = Mthad
+        (self.MWhad_mean, self.MWhad_sigma) = MWhad
+        (self.Mthad_lost_mean, self.Mthad_lost_sigma) = Mthad_lost
+
+    def toplepTerm(self, Mtoplep):
+        return _squaredPull(Mtoplep, self.Mtlep_mean, self.Mtlep_sigma)
+
+    def tophadTerm(self, Mtophad):
+        return _squaredPull(Mtophad, self.Mthad_mean, self.Mthad_sigma)
+
+    def WhadTerm(self, MWhad):
+        return _squaredPull(MWhad, self.MWhad_mean, self.MWhad_sigma)
+
+    def __call__(self, Mtoplep, Mtophad, MWhad):
+        return self.toplepTerm(Mtoplep)+self.tophadTerm(Mtophad)+self.WhadTerm(MWhad)
+
+    def lostJet(self, Mtoplep, Mtophad):
+        return self.toplepTerm(Mtoplep)+_squaredPull(Mtophad, self.Mthad_lost_mean, self.Mthad_lost_sigma)
+
+    # (a+b)+c >= b+c >= c also holds with floating point rounding since all
+    # terms are positive, so the bounds never skip the best hypothesis
+    def boundWhad(self, MWhad):
+        return self.WhadTerm(MWhad)
+
+    def boundHadronic(self, Mtophad, MWhad):
+        return self.tophadTerm(Mtophad)+self.WhadTerm(MWhad)
+
+    def boundLeptonic(self, Mtoplep):
+        return self.toplepTerm(Mtoplep)
+
+
+################################################################################
+## chi2 = (toplep - tophad) + Whad mass terms
+## For a lost jet there is no full tophad to compare with: toplep mass term +
+## partially reconstructed tophad (bhad+Wdecay1) as in chi2Normal
+class chi2TopDiff(chi2Model):
+    def __init__(self, Mtlep_sigma=16., Mthad_sigma=17., MWhad=(83., 11.), b_disc=(1.0, 0.4), Mtlep_mean=171., Mthad_lost=(130., 30.)):
+        chi2Model.__init__(self, b_disc)
+        self.Mtdiff_sigma = sqrt(Mtlep_sigma*Mtlep_sigma+Mthad_sigma*Mthad_sigma)
+        (self.MWhad_mean, self.MWhad_sigma) = MWhad
+        (self.Mtlep_mean, self.Mtlep_sigma) = (Mtlep_mean, Mtlep_sigma)
+        (self.Mthad_lost_mean, self.Mthad_lost_sigma) = Mthad_lost
+
+    def topdiffTerm(self, Mtoplep, Mtophad):
+        return _squaredPull(Mtoplep-Mtophad, 0., self.Mtdiff_sigma)
+
+    def WhadTerm(self, MWhad):
+        return _squaredPull(MWhad, self.MWhad_mean, self.MWhad_sigma)
+
+    def __call__(self, Mtoplep, Mtophad, MWhad):
+        return self.topdiffTerm(Mtoplep, Mtophad)+self.WhadTerm(MWhad)
+
+    def lostJet(self, Mtoplep, Mtophad):
+        return _squaredPull(Mtoplep, self.Mtlep_mean, self.Mtlep_sigma)+_squaredPull(Mtophad, self.Mthad_lost_mean, self.Mthad_lost_sigma)
+
+    def boundWhad(self, MWhad):
+        return self.WhadTerm(MWhad)
+
+    def boundHadronic(self, Mtophad, MWhad):
+        return self.WhadTerm(MWhad)
+
+
+################################################################################
+## Does the model implement lostJet?
+def supportsLostJet(model):
+    method = model.__class__.lostJet
+    return getattr(method, "__func__", method) is not getattr(chi2Model.lostJet, "__func__", chi2Model.lostJet)
+
+
+################################################################################
+## Get a model from its name or return the model itself
+def getChi2Model(mode):
+    if isinstance(mode, chi2Model):
+        return mode
+    if mode == "normal":
+        return chi2Normal()
+    if mode == "topdiff":
+        return chi2TopDiff()
+    raise RuntimeError("Unknown chi2 mode %s, use 'normal', 'topdiff' or a chi2Model" %(mode))
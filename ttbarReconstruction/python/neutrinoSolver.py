@@ -0,0 +1,46 @@
+"""
+Analytic solution for the neutrino pz from the W mass constraint.
+Works on single numbers as well as on arrays of lepton and MET components,
+so that the per-event and the batch reconstruction use the same solver
+without creating ROOT objects.
+"""
+
+import numpy as np
+
+
+################################################################################
+## Solve (lepton + neutrino).M() = mass_w for the neutrino pz.
+## The neutrino px and py are taken from MET.
+## Returns both solutions, a flag for a complex discriminant and the solutions
+## ordered by neutrino energy (first/second) as used by ttbarReco.
+## For a complex discriminant only the real part is kept and both solutions
+## are identical.
+def solveNeutrinoPz(lep_px, lep_py, lep_pz, lep_e, met_px, met_py, mass_w=80.399):
+    lep_px = np.asarray(lep_px, dtype=np.float64)
+    lep_py = np.asarray(lep_py, dtype=np.float64)
+    lep_pz = np.asarray(lep_pz, dtype=np.float64)
+    lep_e  = np.asarray(lep_e, dtype=np.float64)
+    met_px = np.asarray(met_px, dtype=np.float64)
+    met_py = np.asarray(met_py, dtype=np.float64)
+
+    # construct variables for solving the system
+    mu = mass_w * mass_w / 2 + (lep_px*met_px + lep_py*met_py + 0.)
+    A = - (lep_px*lep_px + lep_py*lep_py + 0.)
+    B = mu * lep_pz
+    C = mu * mu - lep_e * lep_e * (met_px*met_px + met_py*met_py + 0.)
+    discriminant = B * B - A * C
+    isComplex = discriminant <= 0
+
+    # both solutions, only the real part for a complex discriminant
+    sqrtdisc = np.sqrt(np.where(isComplex, 0., discriminant))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pz1 = np.where(isComplex, -B / A, (-B - sqrtdisc) / A)
+        pz2 = np.where(isComplex, -B / A, (-B + sqrtdisc) / A)
+
+    # order by neutrino energy, the first solution has the larger energy
+    e1 = np.sqrt(met_px*met_px + met_py*met_py + pz1*pz1)
+    e2 = np.sqrt(met_px*met_px + met_py*met_py + pz2*pz2)
+    first = e1 > e2
+    pzFirst  = np.where(first, pz1, pz2)
+    pzSecond = np.where(first, pz2, pz1)
+    return pz1, pz2, isComplex, pzFirst, pzSecond
@@ -4,83 +4,340 @@ This is a ttbar reconstruction class
 
 
 import ROOT,os,sys
+import numpy as np
+import heapq
 from math                                import sqrt
+from MyRootTools.ttbarReconstruction.neutrinoSolver import solveNeutrinoPz
+from MyRootTools.ttbarReconstruction.chi2Models     import getChi2Model, supportsLostJet
+
+
+################################################################################
+## Plain float versions of TLorentzVector sums and masses, the operations are
+## done in the same order as in ROOT to get identical results
+def _components(vec):
+    return (vec.Px(), vec.Py(), vec.Pz(), vec.E())
+
+def _add(v1, v2):
+    return (v1[0]+v2[0], v1[1]+v2[1], v1[2]+v2[2], v1[3]+v2[3])
+
+def _mass(v):
+    mm = v[3]*v[3]-(v[0]*v[0]+v[1]*v[1]+v[2]*v[2])
+    return -sqrt(-mm) if mm < 0. else sqrt(mm)
+
+
+################################################################################
+## Container for hypotheses that only keeps the indices (neutrino, blep, bhad,
+## WhadDecay1, WhadDecay2), chi2 and masses in flat arrays.
+## The four-vectors of a hypothesis are only built when it is accessed.
+class ttbarHypotheses:
+    def __init__(self, build, indices, chi2, Mtoplep, Mtophad, MWhad):
+        self.indices = indices
+        self.chi2    = chi2
+        self.Mtoplep = Mtoplep
+        self.Mtophad = Mtophad
+        self.MWhad   = MWhad
+        self.__build = build
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.__build(self.indices[i], float(self.chi2[i]))
+
+    def __iter__(self):
+        for i in range(len(self.indices)):
+            yield self[i]
 
 
 class ttbarReco:
-    def __init__(self, lepton, met, jets):
+    # exitOnFailure = False: events with too few jets do not stop the job,
+    # reconstruct() sets valid = False, minimax = NaN, best_chi2 = NaN and no
+    # best_hypothesis (like invalid events in ttbarRecoBatch)
+    def __init__(self, lepton, met, jets, btags=None, exitOnFailure=True):
         self.__lepton = lepton
         self.__met = met
         self.__jets = jets
-        self.__mode = "normal"
+        self.__btags = btags
+        self.__bRestrict = False
+        self.__bChi2 = False
+        self.__bWorkingPoint = 0.5
+        self.__exitOnFailure = exitOnFailure
+        self.__lostJet = False
+        self.__isLostJet = False
+        self.__model = getChi2Model("normal")
+        self.mass_w = 80.399
         self.all_hypotheses = []
         self.best_hypothesis = None
+        self.best_chi2 = None                       # chi2 of best_hypothesis, NaN if there is none
         self.minimax = None
-        if len(self.__jets)<4:
-            print "[Error]: TTbar reconstruction needs at least 4 jets!"
-            sys.exit(1)
-        
-            
-            
+        self.top_hypotheses = []
+        self.valid = None
+        self.__neutrinos = []
+
+    # mode can be "normal", "topdiff" or a chi2Model
     def changeMode(self, mode):
-        self.__mode = mode
+        model = getChi2Model(mode)
+        if self.__lostJet and not supportsLostJet(model):
+            raise RuntimeError("The chi2 model %s does not support lost jet hypotheses" %(model.__class__.__name__))
+        self.__model = model
+
+    # Use the b-tag scores given to the constructor:
+    # restrict = True: only jets with a score >= workingpoint can be blep/bhad,
+    # if less than two jets pass, the two jets with the highest scores are used
+    # chi2term = True: add a b-discriminant term for blep and bhad to the chi2
+    def setBTagging(self, restrict=False, chi2term=False, workingpoint=0.5):
+        if self.__btags is None:
+            raise RuntimeError("b-tagging needs the b-tag scores of all jets in the constructor")
+        if len(self.__btags) != len(self.__jets):
+            raise RuntimeError("Number of b-tag scores does not match the number of jets")
+        self.__bRestrict = restrict
+        self.__bChi2 = chi2term
+        self.__bWorkingPoint = workingpoint
+
+    # Events with exactly 3 jets are reconstructed with one lost W decay jet:
+    # tophad = bhad+WhadDecay1, Whad = WhadDecay1 and WhadDecay2 = None.
+    # The chi2 model has to implement lostJet.
+    def setLostJet(self, enable=True):
+        if enable and not supportsLostJet(self.__model):
+            raise RuntimeError("The chi2 model %s does not support lost jet hypotheses" %(self.__model.__class__.__name__))
+        self.__lostJet = enable
+
+    # Indices of the jets that can be used as blep or bhad
+    def __getBCandidates(self, jets):
+        if not self.__bRestrict:
+            return list(range(len(jets)))
+        candidates = [i for i in range(len(jets)) if self.__btags[i] >= self.__bWorkingPoint]
+        if len(candidates) < 2:
+            candidates = sorted(sorted(range(len(jets)), key=lambda i: -self.__btags[i])[:2])
+        return candidates
         
         
-    # Calculate chi2 from all reconstructed objects
-    def __calculate_chi2(self, toplep, tophad, Whad, mode):
-        Mtlep_mean   = 171.
-        Mtlep_sigma  =  16.
-        Mthad_mean   = 171.
-        Mthad_sigma  =  17.
-        MWhad_mean   =  83.
-        MWhad_sigma  =  11.
-        Mtdiff_sigma = sqrt(pow(Mtlep_sigma,2)+pow(Mthad_sigma,2))
-        b_disc_mean  = 1.0
-        b_disc_sigma = 0.4
-        toplepterm  = pow((toplep.M()-Mtlep_mean)/Mtlep_sigma,2)
-        tophadterm  = pow((tophad.M()-Mthad_mean)/Mthad_sigma,2)
-        Whadterm    = pow((  Whad.M()-MWhad_mean)/MWhad_sigma,2)
-        topdiffterm = pow((toplep.M()-tophad.M())/Mtdiff_sigma,2)
-        if mode=="topdiff":
-            chi2 = topdiffterm+Whadterm
+    # Calculate chi2 from the masses of all reconstructed objects
+    # and the b-tag scores of blep and bhad (if the b-tag term is used).
+    # Works on single hypotheses as well as on arrays of hypotheses.
+    def __calculate_chi2(self, Mtoplep, Mtophad, MWhad, bdisc_blep=None, bdisc_bhad=None):
+        if self.__isLostJet:
+            chi2 = self.__model.lostJet(Mtoplep, Mtophad)
+        else:
+            chi2 = self.__model(Mtoplep, Mtophad, MWhad)
+        if self.__bChi2:
+            chi2 = chi2+self.__model.bdiscTerm(bdisc_blep)+self.__model.bdiscTerm(bdisc_bhad)
+        return chi2
+
+    # b-tag scores of blep and bhad as arguments for __calculate_chi2
+    def __getBDisc(self, blep, bhad):
+        if not self.__bChi2:
+            return None, None
+        return self.__btags[blep], self.__btags[bhad]
+
+    # Construct one hypothesis with all four-vectors from its indices
+    # (neutrino, blep, bhad, WhadDecay1, WhadDecay2), WhadDecay2 = -1 is a
+    # lost jet
+    def __buildHypothesis(self, index, chi2):
+        (n, i, j, k, l) = index
+        lepton   = self.__lepton
+        neutrino = self.__neutrinos[n]
+        blep     = self.__jets[i]
+        bhad     = self.__jets[j]
+        Wdecay1  = self.__jets[k]
+        Wdecay2  = self.__jets[l] if l >= 0 else None
+        hypo = {}
+        # decay products from lep top
+        hypo['lepton']       = lepton
+        hypo['neutrino']     = neutrino
+        hypo['blep']         = blep
+        # decay products from had top
+        hypo['bhad']         = bhad
+        hypo['WhadDecay1']   = Wdecay1
+        hypo['WhadDecay2']   = Wdecay2
+        # tops and Ws
+        hypo['toplep']       = lepton + neutrino + blep
+        hypo['Wlep']         = neutrino + blep
+        if Wdecay2 is None:
+            hypo['tophad']   = bhad + Wdecay1
+            hypo['Whad']     = ROOT.TLorentzVector(Wdecay1)
         else:
-            chi2 = toplepterm+tophadterm+Whadterm
-        return chi2        
+            hypo['tophad']   = bhad + Wdecay1 + Wdecay2
+            hypo['Whad']     = Wdecay1 + Wdecay2
+
+        hypo['chi2']         = chi2
+        return hypo
+
+    # Masses of all leptonic tops (neutrino, blep), hadronic tops
+    # (bhad, Wdecay1, Wdecay2) and hadronic Ws (Wdecay1, Wdecay2).
+    # They are calculated from the vector components in the same order as
+    # with TLorentzVector, so they are identical to the ROOT masses.
+    def __massTables(self, lepton, neutrinos, jets):
+        lep = _components(lepton)
+        nus = [_components(neutrino) for neutrino in neutrinos]
+        vecs = [_components(jet) for jet in jets]
+        Njets = len(jets)
+        Mtoplep = {}
+        for n, nu in enumerate(nus):
+            lepnu = _add(lep, nu)
+            for i in range(Njets):
+                Mtoplep[(n,i)] = _mass(_add(lepnu, vecs[i]))
+        MWhad = {}
+        for k in range(Njets):
+            for l in range(k+1, Njets):
+                MWhad[(k,l)] = _mass(_add(vecs[k], vecs[l]))
+                MWhad[(l,k)] = MWhad[(k,l)]
+        Mtophad = {}
+        for j in range(Njets):
+            for k in range(Njets):
+                if k == j:
+                    continue
+                bW1 = _add(vecs[j], vecs[k])
+                for l in range(Njets):
+                    if l == j or l == k:
+                        continue
+                    Mtophad[(j,k,l)] = _mass(_add(bW1, vecs[l]))
+        # with a lost jet (WhadDecay2 = -1) only bhad+Wdecay1 and Wdecay1
+        if self.__isLostJet:
+            for j in range(Njets):
+                MWhad[(j,-1)] = _mass(vecs[j])
+                for k in range(Njets):
+                    if k != j:
+                        Mtophad[(j,k,-1)] = _mass(_add(vecs[j], vecs[k]))
+        return Mtoplep, Mtophad, MWhad
 
     # Construct all hypotheses from reconstructed neutrinos, lepton and
     # all possible jet permutations
-    def __constructHypotheses(self, lepton, neutrinos, jet_permutations):
-        hypotheses = []
-        for neutrino in neutrinos:
-            for (blep,bhad,Wdecay1,Wdecay2) in jet_permutations:
-                hypo = {}
-                # decay products from lep top
-                hypo['lepton']       = lepton
-                hypo['neutrino']     = neutrino
-                hypo['blep']         = blep
-                # decay products from had top
-                hypo['bhad']         = bhad
-                hypo['WhadDecay1']   = Wdecay1
-                hypo['WhadDecay2']   = Wdecay2
-                # tops and Ws
-                hypo['toplep']       = lepton + neutrino + blep
-                hypo['Wlep']         = neutrino + blep
-                hypo['tophad']       = bhad + Wdecay1 + Wdecay2
-                hypo['Whad']         = Wdecay1 + Wdecay2
-
-                hypo['chi2']         = self.__calculate_chi2(hypo['toplep'],hypo['tophad'],hypo['Whad'],"normal")
-                hypotheses.append(hypo)
-        return hypotheses
-
-    # Get all possible jet permutations:
+    def __constructHypotheses(self, lepton, neutrinos, jets):
+        Mtoplep, Mtophad, MWhad = self.__massTables(lepton, neutrinos, jets)
+        indices = []
+        for n in range(len(neutrinos)):
+            for (i,j,k,l) in self.__getGetPermutations(jets):
+                indices.append( (n,i,j,k,l) )
+        Mtoplep_h = np.array([Mtoplep[(n,i)] for (n,i,j,k,l) in indices])
+        Mtophad_h = np.array([Mtophad[(j,k,l)] for (n,i,j,k,l) in indices])
+        MWhad_h   = np.array([MWhad[(k,l)] for (n,i,j,k,l) in indices])
+        # score all hypotheses at once
+        bdisc_blep, bdisc_bhad = None, None
+        if self.__bChi2:
+            btags = np.asarray(self.__btags, dtype=np.float64)
+            bdisc_blep = btags[[i for (n,i,j,k,l) in indices]]
+            bdisc_bhad = btags[[j for (n,i,j,k,l) in indices]]
+        chi2 = self.__calculate_chi2(Mtoplep_h, Mtophad_h, MWhad_h, bdisc_blep, bdisc_bhad)
+        return ttbarHypotheses(self.__buildHypothesis, indices, chi2, Mtoplep_h, Mtophad_h, MWhad_h)
+
+    # Search for the k best hypotheses without building all of them.
+    # Wdecay1 and Wdecay2 are only combined once per jet pair and hypotheses
+    # are skipped if a part of their chi2 is already larger than the k-th
+    # best chi2 found so far. The lower bounds of the chi2 model are used for
+    # the hadronic W, the hadronic side and the leptonic side. The b-tag terms
+    # of bhad and blep are added to the hadronic and leptonic bounds.
+    # Since the masses are identical to the ROOT masses and ties are resolved
+    # in the order of the exhaustive search, the ranking and the minimax value
+    # are the same as for the exhaustive search.
+    def __searchPruned(self, lepton, neutrinos, jets, k):
+        model = self.__model
+        Mtoplep, Mtophad, MWhad = self.__massTables(lepton, neutrinos, jets)
+        Njets = len(jets)
+        bjets = self.__getBCandidates(jets)
+        bterms = [0.]*Njets
+        if self.__bChi2:
+            bterms = [model.bdiscTerm(self.__btags[i]) for i in range(Njets)]
+
+        # leptonic tops for all (neutrino, blep), sorted by bound
+        toplep_bounds = sorted([(model.boundLeptonic(mass)+bterms[i], n, i) for ((n,i), mass) in Mtoplep.items() if i in bjets])
+
+        # hadronic Ws for all jet pairs, sorted by bound
+        Whad_bounds = sorted([(model.boundWhad(mass), W1, W2) for ((W1,W2), mass) in MWhad.items() if W1 < W2])
+
+        # find the k best hypotheses
+        heap = []
+        for (Whadbound, W1, W2) in Whad_bounds:
+            if Whadbound > self.__thresholdTopK(heap, k):
+                break
+            for j in bjets:
+                if j == W1 or j == W2:
+                    continue
+                for (Wdecay1, Wdecay2) in [(W1,W2), (W2,W1)]:
+                    mhad = Mtophad[(j,Wdecay1,Wdecay2)]
+                    mW = MWhad[(Wdecay1,Wdecay2)]
+                    if model.boundHadronic(mhad, mW)+bterms[j] > self.__thresholdTopK(heap, k):
+                        continue
+                    for (leptonicbound, n, i) in toplep_bounds:
+                        if leptonicbound > self.__thresholdTopK(heap, k):
+                            break
+                        if i == j or i == W1 or i == W2:
+                            continue
+                        chi2 = self.__calculate_chi2(Mtoplep[(n,i)], mhad, mW, *self.__getBDisc(i,j))
+                        self.__pushTopK(heap, k, chi2, (n, i, j, Wdecay1, Wdecay2))
+
+        # minimax: for a given (neutrino, blep) the smallest tophad mass of all
+        # jet triples without blep gives min[max(mlep, mhad)]
+        sorted_tophad = sorted([(mass, triple) for (triple, mass) in Mtophad.items() if triple[0] in bjets])
+        minMass = 100000
+        for (leptonicbound, n, i) in toplep_bounds:
+            for (mass, triple) in sorted_tophad:
+                if i not in triple:
+                    break
+            maxMass = Mtoplep[(n,i)] if Mtoplep[(n,i)] > mass else mass
+            if maxMass < minMass:
+                minMass = maxMass
+
+        return self.__sortTopK(heap), minMass
+
+    # Scan all hypotheses in the order of the exhaustive search but only keep
+    # the k best ones, minimax is calculated on the fly
+    def __scanTopK(self, lepton, neutrinos, jets, k):
+        Mtoplep, Mtophad, MWhad = self.__massTables(lepton, neutrinos, jets)
+        heap = []
+        minMass = 100000
+        for n in range(len(neutrinos)):
+            for (i,j,W1,W2) in self.__getGetPermutations(jets):
+                mlep = Mtoplep[(n,i)]
+                mhad = Mtophad[(j,W1,W2)]
+                chi2 = self.__calculate_chi2(mlep, mhad, MWhad[(W1,W2)], *self.__getBDisc(i,j))
+                self.__pushTopK(heap, k, chi2, (n,i,j,W1,W2))
+                maxMass = mlep if mlep > mhad else mhad
+                if maxMass < minMass:
+                    minMass = maxMass
+        return self.__sortTopK(heap), minMass
+
+    # Keep the k hypotheses with the lowest chi2 in a heap. The worst of them
+    # (largest chi2, for ties the last one in the exhaustive search) is on top
+    # and gets replaced by better hypotheses.
+    def __pushTopK(self, heap, k, chi2, index):
+        entry = (-chi2, tuple([-x for x in index]))
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    # chi2 a hypothesis has to beat to enter the heap
+    def __thresholdTopK(self, heap, k):
+        if len(heap) < k:
+            return float("inf")
+        return -heap[0][0]
+
+    # List of (chi2, index) sorted from best to worst
+    def __sortTopK(self, heap):
+        return sorted([(-chi2, tuple([-x for x in index])) for (chi2, index) in heap])
+
+
+    # Get all possible jet permutations as indices, one after the other:
     def __getGetPermutations(self, jets):
         # Set maximum number of jets
         Njetsmax = len(jets)
+        # Only b candidates can be blep and bhad
+        bjets = self.__getBCandidates(jets)
+        # With a lost jet only (blep,bhad,Wdecay1), Wdecay2 = -1
+        if self.__isLostJet:
+            for i in bjets:
+                for j in bjets:
+                    if j == i:
+                        continue
+                    for k in range(Njetsmax):
+                        if k != i and k != j:
+                            yield (i, j, k, -1)
+            return
         # Find all possible solutions for the 4 missing jets
         # (blep,bhad,Wdecay1,Wdecay2)
-        jet_permutations = []
-        for i in range(Njetsmax):
-            for j in range(Njetsmax):
+        for i in bjets:
+            for j in bjets:
                 if j == i:
                     continue
                 for k in range(Njetsmax):
@@ -89,52 +346,26 @@ class ttbarReco:
                     for l in range(Njetsmax):
                         if l==i or l==j or l==k:
                             continue
-                        jet_i = jets[i]
-                        jet_j = jets[j]
-                        jet_k = jets[k]
-                        jet_l = jets[l]
-                        jet_permutations.append( (jet_i, jet_j, jet_k, jet_l) )
-        return jet_permutations
+                        yield (i, j, k, l)
 
 
 
     # Get the neutrino 
     def __reconstructNeutrino(self, lepton, met):
-        Wlep = ROOT.TLorentzVector()    
-        # get relevant observables and constants
-        lepton_pT = ROOT.TVector3(lepton.Px(), lepton.Py(), 0)
-        neutrino_pT = ROOT.TVector3(met.Px(), met.Py(), 0)
-        mass_w = 80.399
-        
-        # construct variables for solving the system
-        mu = mass_w * mass_w / 2 + lepton_pT * neutrino_pT
-        A = - (lepton_pT * lepton_pT)
-        B = mu * lepton.Pz()
-        C = mu * mu - lepton.E() * lepton.E() * (neutrino_pT * neutrino_pT)
-        discriminant = B * B - A * C
-        
+        pz1, pz2, isComplex, pzFirst, pzSecond = solveNeutrinoPz(lepton.Px(), lepton.Py(), lepton.Pz(), lepton.E(),
+                                                                 met.Px(), met.Py(), self.mass_w)
         # Now get all neutrino solutions
         neutrinos = []
-        if discriminant <= 0:
+        if isComplex:
             # Take only real part of the solution for pz:
+            pzs = [pzFirst]
+        else:
+            pzs = [pzFirst, pzSecond]
+        for pz in pzs:
             neutrino = ROOT.TLorentzVector()
-            neutrino.SetPxPyPzE(met.Px(),met.Py(),-B / A,0)
+            neutrino.SetPxPyPzE(met.Px(),met.Py(),float(pz),0)
             neutrino.SetE(neutrino.P())
             neutrinos.append(neutrino)
-        else:
-            discriminant = sqrt(discriminant)
-            neutrino1 = ROOT.TLorentzVector()
-            neutrino1.SetPxPyPzE(met.Px(),met.Py(),(-B - discriminant) / A,0)
-            neutrino1.SetE(neutrino1.P())
-            neutrino2 = ROOT.TLorentzVector()
-            neutrino2.SetPxPyPzE(met.Px(),met.Py(),(-B + discriminant) / A,0)
-            neutrino2.SetE(neutrino2.P())
-            if neutrino1.E() > neutrino2.E():
-                neutrinos.append(neutrino1)
-                neutrinos.append(neutrino2)
-            else:
-                neutrinos.append(neutrino2)
-                neutrinos.append(neutrino1)
 
         # there is either one solution or two 
         return neutrinos
@@ -143,31 +374,61 @@ class ttbarReco:
     # minimax variable is contructed as follows:
     # min[ max(mhad1, mlep1), max(mhad2, mlep2), ...]
     # the number indicates the index of the hypothesis 
-    def __calculateMinimax(self, hypotheses):
+    def __calculateMinimax(self, Mtoplep, Mtophad):
         minMass = 100000 
-        for hypo in hypotheses:
-            toplep = hypo['toplep']
-            tophad = hypo['tophad']
-            maxMass = toplep.M() if toplep.M() > tophad.M() else tophad.M()
-            if maxMass < minMass:
-                minMass = maxMass
+        if len(Mtoplep) > 0:
+            minMass = min(minMass, float(np.maximum(Mtoplep, Mtophad).min()))
         return minMass
 
-    def reconstruct(self):
+    # search = "exhaustive": build all hypotheses and store them in all_hypotheses
+    # search = "pruned": only find best_hypothesis and minimax
+    # lazy = True: all_hypotheses only keeps indices, chi2 and masses, the
+    # four-vectors of a hypothesis are built when it is accessed
+    # k = N: only keep the N best hypotheses (sorted by chi2) in top_hypotheses,
+    # all_hypotheses is not filled
+    # Lost jet events are always searched exhaustively (at most 12 hypotheses)
+    def reconstruct(self, search="exhaustive", lazy=False, k=None):
+        if search not in ["exhaustive", "pruned"]:
+            raise RuntimeError("Unknown search mode %s, use 'exhaustive' or 'pruned'" %(search))
+        if k is not None and k < 1:
+            raise RuntimeError("Number of hypotheses to keep has to be at least 1")
+        self.all_hypotheses = []
+        self.top_hypotheses = []
+        self.best_hypothesis = None
+        self.best_chi2 = float("nan")
+        # check the number of jets
+        Njets = len(self.__jets)
+        self.__isLostJet = self.__lostJet and Njets == 3
+        self.valid = Njets >= 4 or self.__isLostJet
+        if not self.valid:
+            if self.__exitOnFailure:
+                print "[Error]: TTbar reconstruction needs at least %i jets!" %(3 if self.__lostJet else 4)
+                sys.exit(1)
+            self.minimax = float("nan")
+            return
         # get neutrino solutions
         neutrinos = self.__reconstructNeutrino(self.__lepton, self.__met)
-        # get jet permutations
-        jet_permutations = self.__getGetPermutations(self.__jets)
-        # get all possible ttbar hypotheses
-        self.all_hypotheses = self.__constructHypotheses(self.__lepton, neutrinos, jet_permutations)
+        self.__neutrinos = neutrinos
+        if search == "pruned" or k is not None:
+            if search == "pruned" and not self.__isLostJet:
+                ranking, self.minimax = self.__searchPruned(self.__lepton, neutrinos, self.__jets, 1 if k is None else k)
+            else:
+                ranking, self.minimax = self.__scanTopK(self.__lepton, neutrinos, self.__jets, 1 if k is None else k)
+            if k is not None:
+                self.top_hypotheses = [self.__buildHypothesis(index, chi2) for (chi2, index) in ranking]
+            if len(ranking) > 0 and ranking[0][0] < 1000000:
+                (chi2, index) = ranking[0]
+                self.best_hypothesis = self.top_hypotheses[0] if k is not None else self.__buildHypothesis(index, chi2)
+                self.best_chi2 = chi2
+            return
+        # get all possible ttbar hypotheses from all jet permutations
+        hypotheses = self.__constructHypotheses(self.__lepton, neutrinos, self.__jets)
+        self.all_hypotheses = hypotheses if lazy else list(hypotheses)
         # find best hypothesis
-        chi2min = 1000000
-        for hypo in self.all_hypotheses:
-            if hypo['chi2'] < chi2min:
-                chi2min = hypo['chi2']
-                self.best_hypothesis = hypo 
+        if len(hypotheses) > 0:
+            ibest = int(np.argmin(hypotheses.chi2))
+            if hypotheses.chi2[ibest] < 1000000:
+                self.best_hypothesis = self.all_hypotheses[ibest]
+                self.best_chi2 = float(hypotheses.chi2[ibest])
         # calculate minimax observable
-        self.minimax = self.__calculateMinimax(self.all_hypotheses)   
-        
-                
-                
+        self.minimax = self.__calculateMinimax(hypotheses.Mtoplep, hypotheses.Mtophad)
@@ -0,0 +1,218 @@
+"""
+This is a columnar version of the ttbar reconstruction class.
+Instead of one event made of TLorentzVectors it takes arrays of four-vector
+components for many events at once (e.g. read from NanoAOD) and returns the
+best hypothesis of every event as arrays.
+Jets are given as flat arrays together with the number of jets per event.
+For identical inputs the results are the same as the ones of ttbarReco.
+Events that cannot be reconstructed (too few jets) have valid = False, a NaN
+chi2 and -1 as jet indices.
+"""
+
+import numpy as np
+from itertools                           import permutations
+from MyRootTools.ttbarReconstruction.neutrinoSolver import solveNeutrinoPz
+from MyRootTools.ttbarReconstruction.chi2Models     import getChi2Model, supportsLostJet
+
+
+################################################################################
+## Convert pt, eta, phi, mass into px, py, pz, E
+def toCartesian(pt, eta, phi, mass):
+    pt   = np.asarray(pt, dtype=np.float64)
+    eta  = np.asarray(eta, dtype=np.float64)
+    phi  = np.asarray(phi, dtype=np.float64)
+    mass = np.asarray(mass, dtype=np.float64)
+    px = pt*np.cos(phi)
+    py = pt*np.sin(phi)
+    pz = pt*np.sinh(eta)
+    e  = np.sqrt(px*px+py*py+pz*pz+mass*mass)
+    return px, py, pz, e
+
+
+################################################################################
+## Invariant mass in the same way as TLorentzVector::M()
+def _mass(px, py, pz, e):
+    mm = e*e-(px*px+py*py+pz*pz)
+    return np.where(mm < 0., -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm)))
+
+
+class ttbarRecoBatch:
+    # The same order as the loops in ttbarReco.__getGetPermutations
+    # (blep,bhad,Wdecay1,Wdecay2)
+    _permutations = {}
+
+    def __init__(self, lepton, met, jets, njets, btags=None):
+        # lepton = (px, py, pz, E), met = (px, py), jets = (px, py, pz, E)
+        # with the jets of all events in flat arrays and njets jets per event,
+        # btags are the b-tag scores of the jets in the same flat format
+        self.__lepton = [np.asarray(x, dtype=np.float64) for x in lepton]
+        self.__met = [np.asarray(x, dtype=np.float64) for x in met]
+        self.__jets = [np.asarray(x, dtype=np.float64) for x in jets]
+        self.__njets = np.asarray(njets, dtype=np.int64)
+        self.__btags = None if btags is None else np.asarray(btags, dtype=np.float64)
+        self.__bRestrict = False
+        self.__bChi2 = False
+        self.__bWorkingPoint = 0.5
+        self.__lostJet = False
+        self.__offsets = np.concatenate(([0], np.cumsum(self.__njets)[:-1])).astype(np.int64)
+        self.__Nevents = len(self.__njets)
+        self.__model = getChi2Model("normal")
+        self.mass_w = 80.399
+        self.maxHypotheses = 2000000                # hypotheses per chunk, limits memory
+        self.best_hypothesis = None
+        self.minimax = None
+        self.valid = None
+
+    # mode can be "normal", "topdiff" or a chi2Model
+    def changeMode(self, mode):
+        model = getChi2Model(mode)
+        if self.__lostJet and not supportsLostJet(model):
+            raise RuntimeError("The chi2 model %s does not support lost jet hypotheses" %(model.__class__.__name__))
+        self.__model = model
+
+    # Same options as ttbarReco.setBTagging
+    def setBTagging(self, restrict=False, chi2term=False, workingpoint=0.5):
+        if self.__btags is None:
+            raise RuntimeError("b-tagging needs the b-tag scores of all jets in the constructor")
+        if len(self.__btags) != len(self.__jets[0]):
+            raise RuntimeError("Number of b-tag scores does not match the number of jets")
+        self.__bRestrict = restrict
+        self.__bChi2 = chi2term
+        self.__bWorkingPoint = workingpoint
+
+    # Same as ttbarReco.setLostJet, events with exactly 3 jets get WhadDecay2 = -1
+    def setLostJet(self, enable=True):
+        if enable and not supportsLostJet(self.__model):
+            raise RuntimeError("The chi2 model %s does not support lost jet hypotheses" %(self.__model.__class__.__name__))
+        self.__lostJet = enable
+
+    ############################################################################
+    ## Index table of all (blep,bhad,Wdecay1,Wdecay2) for Njets,
+    ## with a lost jet Wdecay2 is -1
+    def __getPermutations(self, Njets, lostJet=False):
+        if (Njets, lostJet) not in self._permutations:
+            if lostJet:
+                perms = np.array(list(permutations(range(Njets), 3)), dtype=np.int64)
+                perms = np.hstack((perms, np.full((len(perms), 1), -1, dtype=np.int64)))
+            else:
+                perms = np.array(list(permutations(range(Njets), 4)), dtype=np.int64)
+            self._permutations[(Njets, lostJet)] = perms
+        return self._permutations[(Njets, lostJet)]
+
+    ############################################################################
+    ## Calculate chi2 from the masses of all reconstructed objects with the
+    ## chi2 model, all hypotheses are scored at once
+    def __calculate_chi2(self, Mtoplep, Mtophad, MWhad, bdisc_blep=None, bdisc_bhad=None, lostJet=False):
+        if lostJet:
+            chi2 = self.__model.lostJet(Mtoplep, Mtophad)
+        else:
+            chi2 = self.__model(Mtoplep, Mtophad, MWhad)
+        if self.__bChi2:
+            chi2 = chi2+self.__model.bdiscTerm(bdisc_blep)+self.__model.bdiscTerm(bdisc_bhad)
+        return chi2
+
+    ############################################################################
+    ## Jets that can be used as blep or bhad, if less than two jets pass the
+    ## working point the two jets with the highest scores are used
+    def __getBCandidates(self, btags):
+        if not self.__bRestrict:
+            return np.ones(btags.shape, dtype=bool)
+        candidates = btags >= self.__bWorkingPoint
+        leading = np.argsort(-btags, axis=1, kind='mergesort')[:,:2]
+        fallback = np.zeros(btags.shape, dtype=bool)
+        np.put_along_axis(fallback, leading, True, axis=1)
+        useFallback = candidates.sum(axis=1) < 2
+        return np.where(useFallback[:,None], fallback, candidates)
+
+    ############################################################################
+    ## Reconstruct all events with the same number of jets
+    def __reconstructMultiplicity(self, events, Njets, result, lostJet=False):
+        perms = self.__getPermutations(Njets, lostJet)
+        (iblep, ibhad, iW1, iW2) = perms.T
+        jetidx = self.__offsets[events][:,None] + np.arange(Njets)[None,:]
+        jpx, jpy, jpz, je = [x[jetidx] for x in self.__jets]
+        lpx, lpy, lpz, le = [x[events] for x in self.__lepton]
+        mpx, mpy = [x[events] for x in self.__met]
+        # both neutrino solutions ordered by energy, the second one does not
+        # exist for a complex discriminant
+        pz1, pz2, isComplex, pzFirst, pzSecond = solveNeutrinoPz(lpx, lpy, lpz, le, mpx, mpy, self.mass_w)
+        nupz = np.stack((pzFirst, pzSecond), axis=1)
+        nue = np.sqrt((mpx*mpx + mpy*mpy)[:,None] + nupz*nupz)
+        nuexists = np.stack((np.ones_like(isComplex), ~isComplex), axis=1)
+
+        # leptonic top for every neutrino and blep: ((lepton+neutrino)+blep)
+        lnpx = (lpx + mpx)[:,None]
+        lnpy = (lpy + mpy)[:,None]
+        lnpz = lpz[:,None] + nupz
+        lne  = le[:,None] + nue
+        Mtoplep = _mass(lnpx[:,:,None] + jpx[:,None,:], lnpy[:,:,None] + jpy[:,None,:],
+                        lnpz[:,:,None] + jpz[:,None,:], lne[:,:,None] + je[:,None,:])
+        # hadronic W for every pair: (Wdecay1+Wdecay2)
+        MWhad = _mass(jpx[:,:,None] + jpx[:,None,:], jpy[:,:,None] + jpy[:,None,:],
+                      jpz[:,:,None] + jpz[:,None,:], je[:,:,None] + je[:,None,:])
+
+        # chi2 of all hypotheses, ordered (neutrino, permutation)
+        Mtoplep_h = Mtoplep[:,:,iblep]
+        if lostJet:
+            # only (bhad+Wdecay1) and Wdecay1
+            Mtophad_h = MWhad[:,ibhad,iW1][:,None,:]
+            MWhad_h = _mass(jpx, jpy, jpz, je)[:,iW1][:,None,:]
+        else:
+            # hadronic top for every triple: ((bhad+Wdecay1)+Wdecay2)
+            Mtophad = _mass(*[(x[:,:,None] + x[:,None,:])[:,:,:,None] + x[:,None,None,:]
+                              for x in (jpx, jpy, jpz, je)])
+            Mtophad_h = Mtophad[:,ibhad,iW1,iW2][:,None,:]
+            MWhad_h = MWhad[:,iW1,iW2][:,None,:]
+        bdisc_blep, bdisc_bhad = None, None
+        allowed = nuexists[:,:,None]
+        if self.__btags is not None:
+            jb = self.__btags[jetidx]
+            bdisc_blep = jb[:,iblep][:,None,:]
+            bdisc_bhad = jb[:,ibhad][:,None,:]
+            bcandidates = self.__getBCandidates(jb)
+            allowed = allowed & (bcandidates[:,iblep] & bcandidates[:,ibhad])[:,None,:]
+        chi2 = self.__calculate_chi2(Mtoplep_h, Mtophad_h, MWhad_h, bdisc_blep, bdisc_bhad, lostJet)
+        chi2 = np.where(allowed, chi2, np.inf)
+        chi2 = chi2.reshape(len(events), -1)
+        best = np.argmin(chi2, axis=1)
+        ibest = np.arange(len(events))
+        inu, iperm = np.divmod(best, len(perms))
+
+        # minimax: min[max(mlep, mhad)] over all hypotheses
+        maxMass = np.maximum(Mtoplep_h, Mtophad_h)
+        maxMass = np.where(allowed, maxMass, np.inf)
+
+        result["chi2"][events]       = chi2[ibest, best]
+        result["minimax"][events]    = maxMass.reshape(len(events), -1).min(axis=1)
+        result["neutrino"][events]   = inu
+        result["blep"][events]       = iblep[iperm]
+        result["bhad"][events]       = ibhad[iperm]
+        result["WhadDecay1"][events] = iW1[iperm]
+        result["WhadDecay2"][events] = iW2[iperm]
+        result["toplep"][events]     = Mtoplep_h[ibest, inu, iperm]
+        result["tophad"][events]     = Mtophad_h[ibest, 0, iperm]
+        result["Whad"][events]       = MWhad_h[ibest, 0, iperm]
+        result["neutrino_pz"][events] = nupz[ibest, inu]
+
+    def reconstruct(self):
+        result = {}
+        for name in ["chi2", "minimax", "toplep", "tophad", "Whad", "neutrino_pz"]:
+            result[name] = np.full(self.__Nevents, np.nan)
+        for name in ["neutrino", "blep", "bhad", "WhadDecay1", "WhadDecay2"]:
+            result[name] = np.full(self.__Nevents, -1, dtype=np.int64)
+        # Events with less than 4 jets cannot be reconstructed, except for
+        # events with 3 jets if lost jets are enabled
+        self.valid = self.__njets >= 4
+        if self.__lostJet:
+            self.valid = self.valid | (self.__njets == 3)
+        # Process events grouped by jet multiplicity and in chunks that keep
+        # the number of hypotheses in memory below maxHypotheses
+        for Njets in np.unique(self.__njets[self.valid]):
+            lostJet = Njets == 3
+            events = np.nonzero(self.__njets == Njets)[0]
+            Nhypotheses = 2*len(self.__getPermutations(Njets, lostJet))
+            chunksize = max(1, self.maxHypotheses//Nhypotheses)
+            for start in range(0, len(events), chunksize):
+                self.__reconstructMultiplicity(events[start:start+chunksize], Njets, result, lostJet)
+        self.minimax = result.pop("minimax")
+        self.best_hypothesis = result
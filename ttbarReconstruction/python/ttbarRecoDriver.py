@@ -0,0 +1,274 @@
+"""
+Driver that runs the ttbar reconstruction over a whole sample.
+The input TTree or RNTuple is read in chunks of entries with RDataFrame,
+the chunks are reconstructed with ttbarRecoBatch in a pool of worker
+processes and the results are written to a tree that can be used as friend
+of the input tree (same number of entries in the same order).
+Every chunk is stored in its own file first, so an interrupted job can be
+resumed and only the missing chunks are processed again.
+
+Input columns are RDataFrame expressions, e.g. "Muon_pt[0]" for the lepton
+or "Jet_pt" for the jets. Events in which the lepton expressions are not
+defined (no lepton) should be protected in the expression, e.g.
+"nMuon > 0 ? Muon_pt[0] : 0.f". Events that cannot be reconstructed are
+kept in the output with valid = 0, events with 3 jets can be reconstructed
+with a lost jet (setLostJet).
+"""
+
+from __future__ import print_function
+import ROOT,os,sys
+import json
+import multiprocessing
+import numpy as np
+from MyRootTools.ttbarReconstruction.ttbarRecoBatch import ttbarRecoBatch, toCartesian
+from MyRootTools.ttbarReconstruction.chi2Models     import getChi2Model, supportsLostJet
+
+
+################################################################################
+## RDataFrame over the entries [start, stop). For TTrees the entry range is
+## given to the dataset (ROOT >= 6.30), so the chunk is read directly. With
+## Range all entries before start are looped over again in every chunk, this
+## is only the fallback for RNTuples and older ROOT versions.
+def _chunkDataFrame(config, start, stop):
+    experimental = getattr(ROOT.RDF, "Experimental", None)
+    if config["isTree"] and hasattr(experimental, "RDatasetSpec") and hasattr(experimental.RDatasetSpec, "WithGlobalRange"):
+        spec = experimental.RDatasetSpec()
+        spec.AddSample(experimental.RSample("chunk", config["treename"], config["filename"]))
+        spec.WithGlobalRange(experimental.RDatasetSpec.REntryRange(start, stop))
+        return ROOT.RDataFrame(spec)
+    return ROOT.RDataFrame(config["treename"], config["filename"]).Range(start, stop)
+
+
+################################################################################
+## Reconstruct the entries [start, stop) and write them to chunkfile.
+## This runs in the worker processes, so it only gets plain data.
+def _processChunk(args):
+    (config, start, stop, chunkfile) = args
+    ROOT.gROOT.SetBatch(True)
+    df = _chunkDataFrame(config, start, stop)
+    columns = {}
+    for name, expression in config["columns"].items():
+        if expression is None:
+            continue
+        df = df.Define("_ttbarReco_"+name, expression)
+        columns["_ttbarReco_"+name] = name
+    df = df.Define("_ttbarReco_njets", "(int)(%s).size()" %(config["columns"]["jet_pt"]))
+    columns["_ttbarReco_njets"] = "njets"
+    data = df.AsNumpy(list(columns.keys()))
+    data = dict([(columns[key], value) for (key, value) in data.items()])
+
+    # jets are RVecs per event, flatten them
+    jetcolumns = ["jet_pt", "jet_eta", "jet_phi", "jet_mass", "jet_btag"]
+    for name in jetcolumns:
+        if name in data:
+            data[name] = np.concatenate([np.asarray(v, dtype=np.float64) for v in data[name]] + [np.zeros(0)])
+
+    lepton = toCartesian(data["lepton_pt"], data["lepton_eta"], data["lepton_phi"], data["lepton_mass"])
+    met_pt = np.asarray(data["met_pt"], dtype=np.float64)
+    met_phi = np.asarray(data["met_phi"], dtype=np.float64)
+    met = (met_pt*np.cos(met_phi), met_pt*np.sin(met_phi))
+    jets = toCartesian(data["jet_pt"], data["jet_eta"], data["jet_phi"], data["jet_mass"])
+    reco = ttbarRecoBatch(lepton, met, jets, data["njets"], data.get("jet_btag", None))
+    reco.changeMode(config["mode"])
+    reco.mass_w = config["mass_w"]
+    if config["btagging"] is not None:
+        reco.setBTagging(*config["btagging"])
+    reco.setLostJet(config["lostjet"])
+    reco.reconstruct()
+
+    output = {}
+    output["valid"] = reco.valid.astype(np.int32)
+    output["chi2"] = reco.best_hypothesis["chi2"]
+    output["minimax"] = reco.minimax
+    output["Mtoplep"] = reco.best_hypothesis["toplep"]
+    output["Mtophad"] = reco.best_hypothesis["tophad"]
+    output["MWhad"] = reco.best_hypothesis["Whad"]
+    output["neutrino_pz"] = reco.best_hypothesis["neutrino_pz"]
+    for name in ["neutrino", "blep", "bhad", "WhadDecay1", "WhadDecay2"]:
+        output[name] = reco.best_hypothesis[name].astype(np.int32)
+    output = dict([(config["prefix"]+name, np.ascontiguousarray(value)) for (name, value) in output.items()])
+
+    # write to a temporary file first, a chunk file only exists if complete
+    if hasattr(ROOT.RDF, "FromNumpy"):
+        outdf = ROOT.RDF.FromNumpy(output)
+    else:
+        outdf = ROOT.RDF.MakeNumpyDataFrame(output)
+    outdf.Snapshot(config["outtreename"], chunkfile+".tmp")
+    os.rename(chunkfile+".tmp", chunkfile)
+    return start, stop
+
+
+class ttbarRecoDriver:
+    def __init__(self, filename, treename, outfilename, outtreename="ttbarReco"):
+        self.__filename = filename
+        self.__treename = treename
+        self.__outfilename = outfilename
+        self.__outtreename = outtreename
+        self.__columns = {
+            "lepton_pt": None, "lepton_eta": None, "lepton_phi": None, "lepton_mass": None,
+            "met_pt": "MET_pt", "met_phi": "MET_phi",
+            "jet_pt": "Jet_pt", "jet_eta": "Jet_eta", "jet_phi": "Jet_phi", "jet_mass": "Jet_mass",
+            "jet_btag": None,
+        }
+        self.__mode = "normal"
+        self.__btagging = None
+        self.__lostJet = False
+        self.chunksize = 100000                     # entries per chunk
+        self.nworkers = multiprocessing.cpu_count() # number of worker processes
+        self.mass_w = 80.399                        # W mass for the neutrino
+        self.prefix = "ttbarReco_"                  # prefix of the output branches
+        self.workdir = outfilename+".chunks"        # directory for the chunk files
+        self.keepChunks = False                     # keep chunk files after merging?
+
+    ############################################################################
+    ## Set the columns (RDataFrame expressions) of the lepton
+    def setLepton(self, pt, eta, phi, mass):
+        self.__columns["lepton_pt"] = pt
+        self.__columns["lepton_eta"] = eta
+        self.__columns["lepton_phi"] = phi
+        self.__columns["lepton_mass"] = mass
+
+    ############################################################################
+    ## Set the columns of MET
+    def setMET(self, pt, phi):
+        self.__columns["met_pt"] = pt
+        self.__columns["met_phi"] = phi
+
+    ############################################################################
+    ## Set the columns of the jets (RVecs), btag is optional
+    def setJets(self, pt, eta, phi, mass, btag=None):
+        self.__columns["jet_pt"] = pt
+        self.__columns["jet_eta"] = eta
+        self.__columns["jet_phi"] = phi
+        self.__columns["jet_mass"] = mass
+        self.__columns["jet_btag"] = btag
+
+    ############################################################################
+    ## Same as ttbarReco.changeMode, a chi2Model has to be picklable
+    def changeMode(self, mode):
+        self.__mode = mode
+
+    ############################################################################
+    ## Same as ttbarReco.setBTagging, needs the btag column of the jets
+    def setBTagging(self, restrict=False, chi2term=False, workingpoint=0.5):
+        self.__btagging = (restrict, chi2term, workingpoint)
+
+    ############################################################################
+    ## Same as ttbarReco.setLostJet
+    def setLostJet(self, enable=True):
+        self.__lostJet = enable
+
+    ############################################################################
+    ## Configuration that is passed to the workers and stored with the chunks
+    def __getConfig(self):
+        config = {}
+        config["filename"] = self.__filename
+        config["treename"] = self.__treename
+        config["outtreename"] = self.__outtreename
+        config["columns"] = self.__columns
+        config["mode"] = self.__mode
+        config["btagging"] = self.__btagging
+        config["lostjet"] = self.__lostJet
+        config["mass_w"] = self.mass_w
+        config["prefix"] = self.prefix
+        config["chunksize"] = self.chunksize
+        config["isTree"] = self.__isTree()
+        return config
+
+    ############################################################################
+    ## Is the input a TTree (or an RNTuple)?
+    def __isTree(self):
+        infile = ROOT.TFile.Open(self.__filename)
+        if not infile or infile.IsZombie():
+            print("[Error]: Could not open %s" %(self.__filename))
+            sys.exit(1)
+        key = infile.GetKey(self.__treename)
+        treeclass = ROOT.TClass.GetClass(key.GetClassName()) if key else None
+        isTree = bool(treeclass) and treeclass.InheritsFrom("TTree")
+        infile.Close()
+        return isTree
+
+    ############################################################################
+    ## Mode for the manifest: the name or the class and all parameters of a
+    ## chi2Model, so chunks made with other model parameters are not reused
+    def __describeMode(self, mode):
+        if isinstance(mode, str):
+            return mode
+        return {"class": mode.__class__.__module__+"."+mode.__class__.__name__, "parameters": vars(mode)}
+
+    ############################################################################
+    ## Chunk files can only be reused if they were made with the same settings
+    def __checkManifest(self, config, Nentries, resume):
+        manifest = os.path.join(self.workdir, "manifest.json")
+        description = dict(config)
+        description["mode"] = self.__describeMode(config["mode"])
+        description["entries"] = Nentries
+        # values that are no JSON types (e.g. numpy numbers) are stored as repr
+        description = json.loads(json.dumps(description, default=repr))
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                stored = json.load(f)
+            if resume and description != stored:
+                print("[Error]: Chunks in %s were produced with different settings, use resume=False to start from scratch." %(self.workdir))
+                sys.exit(1)
+        with open(manifest, "w") as f:
+            json.dump(description, f)
+
+    ############################################################################
+    ## Process all chunks that are not done yet and merge them into the output
+    def run(self, resume=True):
+        if None in [self.__columns[name] for name in ["lepton_pt", "lepton_eta", "lepton_phi", "lepton_mass"]]:
+            print("[Error]: The lepton columns have to be set with setLepton().")
+            sys.exit(1)
+        if self.__btagging is not None and self.__columns["jet_btag"] is None:
+            print("[Error]: b-tagging needs the btag column in setJets().")
+            sys.exit(1)
+        if self.__lostJet and not supportsLostJet(getChi2Model(self.__mode)):
+            print("[Error]: The chi2 model does not support lost jet hypotheses, use setLostJet(False).")
+            sys.exit(1)
+        config = self.__getConfig()
+        Nentries = ROOT.RDataFrame(self.__treename, self.__filename).Count().GetValue()
+        if Nentries == 0:
+            print("[Error]: %s in %s has no entries." %(self.__treename, self.__filename))
+            sys.exit(1)
+
+        if not os.path.exists(self.workdir):
+            os.makedirs(self.workdir)
+        self.__checkManifest(config, Nentries, resume)
+
+        # Split into chunks, skip those that already exist
+        tasks = []
+        chunkfiles = []
+        for ichunk, start in enumerate(range(0, Nentries, self.chunksize)):
+            stop = min(start+self.chunksize, Nentries)
+            chunkfile = os.path.join(self.workdir, "chunk_%06i.root" %(ichunk))
+            chunkfiles.append(chunkfile)
+            if resume and os.path.exists(chunkfile):
+                continue
+            tasks.append( (config, start, stop, chunkfile) )
+        print("[Info]: %i of %i chunks to process" %(len(tasks), len(chunkfiles)))
+
+        # Fan out to the workers, chunks are done in any order
+        if len(tasks) > 0:
+            pool = multiprocessing.Pool(min(self.nworkers, len(tasks)))
+            try:
+                for Ndone, (start, stop) in enumerate(pool.imap_unordered(_processChunk, tasks)):
+                    print("[Info]: entries %i-%i done (%i/%i)" %(start, stop, Ndone+1, len(tasks)))
+            finally:
+                pool.close()
+                pool.join()
+
+        # Merge chunks in order of the entries
+        merger = ROOT.TFileMerger(False)
+        merger.OutputFile(self.__outfilename, "RECREATE")
+        for chunkfile in chunkfiles:
+            merger.AddFile(chunkfile)
+        if not merger.Merge():
+            print("[Error]: Could not merge the chunks into %s" %(self.__outfilename))
+            sys.exit(1)
+        if not self.keepChunks:
+            for chunkfile in chunkfiles:
+                os.remove(chunkfile)
+            os.remove(os.path.join(self.workdir, "manifest.json"))
+            os.rmdir(self.workdir)
+        print("[Info]: Wrote %s, add it with tree.AddFriend(\"%s\", \"%s\")" %(self.__outfilename, self.__outtreename, self.__outfilename))